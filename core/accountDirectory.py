@@ -0,0 +1,225 @@
+"""
+Shared account directory.
+Resolves any identifier form (numeric id, uuid, account number) to the account's
+immutable-ish facts: id, uuid, account_number, holder type/id, frozen and deleted flags.
+Balances are NOT in here, they change with every posting.
+- aliases (uuid / account number -> id) never change, they are cached long
+- the entry per id is cached in a per-worker LocalCache and in Redis, and dropped through
+  the invalidation bus by invalidate() whenever an account is frozen, deleted or created
+- like core.userCache, the Redis entry carries the account's version (acct:ver:{id}, bumped by
+  invalidate()) it was read under, so a lookup racing a freeze can't put the old entry back
+Money movements still re-check frozen/deleted on the locked rows (core.ledger), so a
+stale entry can never let a posting through.
+"""
+from typing import Any, Iterable, cast
+import simplejson as json
+from core.coreCache import redis_client, LocalCache
+from core.eventBus import subscribe, publish
+from core.logger import logger
+
+ENTRY_TTL = 300  # seconds in Redis
+ALIAS_TTL = 24 * 3600
+COLUMNS = "id, uuid, account_number, account_holder_type, account_holder_id, is_frozen, is_deleted"
+KIND_COLUMNS = {"id": "id", "uuid": "uuid", "number": "account_number"}
+
+_entries = LocalCache(maxsize=8192, ttl=60)
+_aliases = LocalCache(maxsize=16384, ttl=3600)
+_generation = 0  # bumped on every invalidation, a fill that overlapped one is not kept
+
+
+def kind_of(identifier: str | int) -> str:
+    """Which column an identifier refers to: "id", "uuid" or "number"."""
+    identifier = str(identifier)
+    if identifier.isdigit():
+        return "id"
+    if len(identifier) == 36 and "-" in identifier:
+        return "uuid"
+    return "number"
+
+
+def _entry_key(account_id: int) -> str:
+    return f"acct:{account_id}"
+
+
+def _version_key(account_id: int) -> str:
+    # No expiry: an entry must never outlive the counter it was written under
+    return f"acct:ver:{account_id}"
+
+
+def _alias_key(kind: str, value: str) -> str:
+    return f"acct:{kind}:{value}"
+
+
+def _normalize(row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": int(row["id"]),
+        "uuid": str(row["uuid"]),
+        "account_number": str(row["account_number"]),
+        "account_holder_type": str(row["account_holder_type"]),
+        "account_holder_id": str(row["account_holder_id"]),
+        "is_frozen": bool(row["is_frozen"]),
+        "is_deleted": bool(row["is_deleted"]),
+    }
+
+
+def _remember(entries: list[dict[str, Any]], versions: dict[int, str]) -> None:
+    """
+    Caches aliases, and entries under the version read before they were loaded. An entry
+    without one (found through an alias miss) isn't written, the next lookup reads it again.
+    """
+    if not entries:
+        return
+    pipe = redis_client.pipeline()
+    for entry in entries:
+        _aliases.set(("uuid", entry["uuid"]), entry["id"])
+        _aliases.set(("number", entry["account_number"]), entry["id"])
+        version = versions.get(entry["id"])
+        if version is not None:
+            pipe.setex(_entry_key(entry["id"]), ENTRY_TTL, f"{version}\n{json.dumps(entry)}")
+        pipe.setex(_alias_key("uuid", entry["uuid"]), ALIAS_TTL, entry["id"])
+        pipe.setex(_alias_key("number", entry["account_number"]), ALIAS_TTL, entry["id"])
+    try:
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to cache account entries: {e}")
+
+
+def _from_db(cur: Any, kind: str, values: list[str]) -> list[dict[str, Any]]:
+    placeholders = ", ".join(["%s"] * len(values))
+    cur.execute(f"SELECT {COLUMNS} FROM bank_accounts WHERE {KIND_COLUMNS[kind]} IN ({placeholders})", tuple(values))
+    return [_normalize(r) for r in cast(list[dict[str, Any]], cur.fetchall())]
+
+
+def lookup_many(
+    identifiers: Iterable[str | int],
+    cur: Any = None,
+    kinds: Iterable[str] | None = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Resolves identifiers of any form, returns {identifier: entry} for the ones that exist.
+    kinds restricts the accepted forms (see kind_of()), other identifiers are treated as unknown;
+    money routes take account uuids only, multi-form lookup is for the public / statement lookups.
+    Misses are filled with at most one Redis round trip per step and one IN query per identifier kind.
+    """
+    wanted = {str(i): kind_of(i) for i in identifiers}
+    if kinds is not None:
+        allowed = set(kinds)
+        wanted = {ident: kind for ident, kind in wanted.items() if kind in allowed}
+    found: dict[str, dict[str, Any]] = {}
+    ids: dict[str, int] = {}
+    fresh: list[dict[str, Any]] = []  # loaded from Redis / DB, go into L1 unless invalidated meanwhile
+    versions: dict[int, str] = {}
+    generation = _generation
+
+    # 1. identifier -> id (numeric ids are their own alias)
+    alias_misses = []
+    for ident, kind in wanted.items():
+        if kind == "id":
+            ids[ident] = int(ident)
+            continue
+        account_id = _aliases.get((kind, ident))
+        if account_id is None:
+            alias_misses.append(ident)
+        else:
+            ids[ident] = account_id
+    if alias_misses:
+        try:
+            cached = redis_client.mget([_alias_key(wanted[i], i) for i in alias_misses])
+        except Exception as e:
+            logger.warning(f"Account alias lookup failed: {e}")
+            cached = [None] * len(alias_misses)
+        for ident, account_id in zip(alias_misses, cached):
+            if account_id is not None:
+                ids[ident] = int(account_id)
+                _aliases.set((wanted[ident], ident), int(account_id))
+
+    # 2. id -> entry
+    entry_misses = []
+    for ident, account_id in ids.items():
+        entry = _entries.get(account_id)
+        if entry is None:
+            entry_misses.append(ident)
+        else:
+            found[ident] = entry
+    if entry_misses:
+        keys = []
+        for ident in entry_misses:
+            keys.extend((_version_key(ids[ident]), _entry_key(ids[ident])))
+        try:
+            cached = redis_client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Account entry lookup failed: {e}")
+            cached = []
+        for ident, version, raw in zip(entry_misses, cached[0::2], cached[1::2]):
+            version = version or "0"
+            versions[ids[ident]] = version
+            if raw is None:
+                continue
+            stored_version, _, body = cast(str, raw).partition("\n")
+            if stored_version == version:
+                entry = cast(dict[str, Any], json.loads(body))
+                fresh.append(entry)
+                found[ident] = entry
+
+    # 3. whatever is left comes from the database, one query per kind
+    missing: dict[str, list[str]] = {}
+    for ident, kind in wanted.items():
+        if ident not in found:
+            missing.setdefault(kind, []).append(ident)
+    if missing:
+        loaded: list[dict[str, Any]] = []
+        if cur is None:
+            from core.database import db_helper
+            with db_helper.cursor() as own_cur:
+                for kind, values in missing.items():
+                    loaded.extend(_from_db(own_cur, kind, values))
+        else:
+            for kind, values in missing.items():
+                loaded.extend(_from_db(cur, kind, values))
+        _remember(loaded, versions)
+        fresh.extend(loaded)
+        # The columns compare case-insensitively, so match them that way too
+        by_form: dict[tuple[str, str], dict[str, Any]] = {}
+        for entry in loaded:
+            by_form[("id", str(entry["id"]))] = entry
+            by_form[("uuid", entry["uuid"].lower())] = entry
+            by_form[("number", entry["account_number"].lower())] = entry
+        for kind, values in missing.items():
+            for ident in values:
+                entry = by_form.get((kind, ident.lower()))
+                if entry is not None:
+                    found[ident] = entry
+
+    if generation == _generation:
+        for entry in fresh:
+            _entries.set(entry["id"], entry)
+    return found
+
+
+def lookup(identifier: str | int, cur: Any = None, kinds: Iterable[str] | None = None) -> dict[str, Any] | None:
+    """Entry of one account by id, uuid or account number (or only the given kinds), None if it does not exist."""
+    return lookup_many([identifier], cur, kinds).get(str(identifier))
+
+
+def invalidate(account_id: int) -> None:
+    """Call after freezing, unfreezing, deleting or creating an account."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incr(_version_key(account_id))
+        pipe.delete(_entry_key(account_id))
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to drop cached account {account_id}: {e}")
+    publish("account", account_id)
+
+
+def _on_invalidate(key: str | None) -> None:
+    global _generation
+    _generation += 1
+    if key is None:
+        _entries.clear()
+    else:
+        _entries.pop(int(key))
+
+
+subscribe("account", _on_invalidate)
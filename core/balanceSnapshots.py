@@ -0,0 +1,180 @@
+"""
+Per-account balance checkpoints at month boundaries.
+account_balance_snapshots holds the exact balance of an account at the first
+instant of a month. A background job builds them incrementally:
+- seed: accounts without any snapshot get one at the start of the latest closed-off month
+  (live balance minus everything posted since, once per account)
+- forward: when a month closes, next = previous + that month's net flow
+- backward: older boundaries are filled in small batches down to the account's creation
+Statements anchor on the nearest snapshot instead of summing the whole later history.
+Month boundaries follow the DB clock (the one created_at is stamped with), and a boundary is
+only used once statementCache.CLOSE_GRACE has passed, so late-committing postings are in.
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, cast
+from core.logger import logger
+from core.statementCache import CLOSE_GRACE
+from core.scheduler import every
+
+BATCH = 500
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    index = moment.year * 12 + (moment.month - 1) + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def db_now(cur: Any) -> datetime:
+    cur.execute("SELECT NOW() AS now")
+    return cast(dict[str, Any], cur.fetchone())["now"]
+
+
+def net_flow(cur: Any, account_id: int, start: datetime, end: datetime | None = None) -> Decimal:
+    """Confirmed inflow minus outflow of an account in [start, end) (end=None means up to now)."""
+    params: dict[str, Any] = {"acc_id": account_id, "start": start, "end": end}
+    upper = "AND created_at < %(end)s" if end is not None else ""
+    cur.execute(f"""
+        SELECT SUM(amount) as flow_in
+        FROM transactions
+        WHERE to_account_id = %(acc_id)s
+          AND created_at >= %(start)s
+          {upper}
+          AND confirmed = 1
+    """, params)
+    flow_in = Decimal(str(cast(dict[str, Any], cur.fetchone() or {}).get("flow_in") or 0))
+    cur.execute(f"""
+        SELECT SUM(amount) as flow_out
+        FROM transactions
+        WHERE from_account_id = %(acc_id)s
+          AND created_at >= %(start)s
+          {upper}
+          AND confirmed = 1
+    """, params)
+    flow_out = Decimal(str(cast(dict[str, Any], cur.fetchone() or {}).get("flow_out") or 0))
+    return flow_in - flow_out
+
+
+def balance_at(cur: Any, account_id: int, moment: datetime, current_balance: Decimal) -> Decimal:
+    """
+    Balance of an account at `moment`. Anchors on the nearest snapshot at or after it,
+    so only the flow between the two is summed; falls back to the live balance.
+    """
+    cur.execute("""
+        SELECT as_of, balance
+        FROM account_balance_snapshots
+        WHERE account_id = %s AND as_of >= %s
+        ORDER BY as_of
+        LIMIT 1
+    """, (account_id, moment))
+    row = cast(dict[str, Any] | None, cur.fetchone())
+    if row is not None:
+        anchor = Decimal(str(row["balance"]))
+        if row["as_of"] == moment:
+            return anchor
+        return anchor - net_flow(cur, account_id, moment, row["as_of"])
+    return current_balance - net_flow(cur, account_id, moment)
+
+
+def _insert(cur: Any, rows: list[tuple[int, datetime, Decimal]]) -> None:
+    if not rows:
+        return
+    values = ", ".join(["(%s, %s, %s)"] * len(rows))
+    params: list[Any] = []
+    for row in rows:
+        params.extend(row)
+    cur.execute(f"INSERT IGNORE INTO account_balance_snapshots (account_id, as_of, balance) VALUES {values}", tuple(params))
+
+
+def _flow_sql(account_expr: str, bounded: bool = True) -> str:
+    # Net flow of one account in [%(start)s, %(end)s), both halves use the (account, created_at) indexes
+    upper = "AND t.created_at < %(end)s" if bounded else ""
+    return f"""
+        COALESCE((SELECT SUM(t.amount) FROM transactions t
+                  WHERE t.to_account_id = {account_expr} AND t.created_at >= %(start)s
+                    {upper} AND t.confirmed = 1), 0)
+      - COALESCE((SELECT SUM(t.amount) FROM transactions t
+                  WHERE t.from_account_id = {account_expr} AND t.created_at >= %(start)s
+                    {upper} AND t.confirmed = 1), 0)
+    """
+
+
+def seed(cur: Any, as_of: datetime) -> int:
+    # One consistent read: live balance (incl. hot-account slots) minus everything since as_of
+    cur.execute(f"""
+        SELECT b.id,
+               b.balance
+             + COALESCE((SELECT SUM(s.pending) FROM bank_account_credit_slots s WHERE s.account_id = b.id), 0)
+             - ({_flow_sql("b.id", bounded=False)}) AS balance
+        FROM bank_accounts b
+        WHERE NOT EXISTS (SELECT 1 FROM account_balance_snapshots x WHERE x.account_id = b.id)
+        ORDER BY b.id
+        LIMIT {BATCH}
+    """, {"start": as_of})
+    rows = cast(list[dict[str, Any]], cur.fetchall())
+    _insert(cur, [(int(r["id"]), as_of, Decimal(str(r["balance"]))) for r in rows])
+    return len(rows)
+
+
+def roll_forward(cur: Any, prev: datetime) -> int:
+    nxt = add_months(prev, 1)
+    cur.execute(f"""
+        SELECT s.account_id, s.balance + ({_flow_sql("s.account_id")}) AS balance
+        FROM account_balance_snapshots s
+        WHERE s.as_of = %(start)s
+          AND NOT EXISTS (SELECT 1 FROM account_balance_snapshots n
+                          WHERE n.account_id = s.account_id AND n.as_of = %(end)s)
+        LIMIT {BATCH}
+    """, {"start": prev, "end": nxt})
+    rows = cast(list[dict[str, Any]], cur.fetchall())
+    _insert(cur, [(int(r["account_id"]), nxt, Decimal(str(r["balance"]))) for r in rows])
+    return len(rows)
+
+
+def roll_backward(cur: Any) -> int:
+    # Earliest snapshot per account that is still after the month the account was opened in
+    cur.execute(f"""
+        SELECT s.account_id, s.as_of, s.balance
+        FROM account_balance_snapshots s
+        JOIN bank_accounts b ON b.id = s.account_id
+        WHERE s.as_of = (SELECT MIN(x.as_of) FROM account_balance_snapshots x WHERE x.account_id = s.account_id)
+          AND s.as_of > b.created_at
+        LIMIT {BATCH}
+    """)
+    earliest = cast(list[dict[str, Any]], cur.fetchall())
+    rows = []
+    for r in earliest:
+        prev = add_months(r["as_of"], -1)
+        flow = net_flow(cur, int(r["account_id"]), prev, r["as_of"])
+        rows.append((int(r["account_id"]), prev, Decimal(str(r["balance"])) - flow))
+    _insert(cur, rows)
+    return len(rows)
+
+
+@every(3600, name="build_balance_snapshots")
+def build_snapshots() -> None:
+    from core.database import db_helper
+    with db_helper.cursor() as cur:
+        # Latest boundary whose month closed more than CLOSE_GRACE ago
+        current = month_start(db_now(cur) - CLOSE_GRACE)
+        seeded = seed(cur, current)
+
+        forwarded = 0
+        cur.execute("""
+            SELECT MIN(latest) AS oldest FROM (
+                SELECT MAX(as_of) AS latest FROM account_balance_snapshots GROUP BY account_id
+            ) l
+        """)
+        row = cast(dict[str, Any] | None, cur.fetchone()) or {}
+        boundary = row.get("oldest")
+        while boundary is not None and boundary < current:
+            forwarded += roll_forward(cur, boundary)
+            boundary = add_months(boundary, 1)
+
+        backfilled = roll_backward(cur)
+    if seeded or forwarded or backfilled:
+        logger.verbose("Balance snapshots: %s seeded, %s rolled forward, %s backfilled", seeded, forwarded, backfilled)
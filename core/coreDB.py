@@ -1,10 +1,162 @@
 # db.py
 from contextlib import contextmanager
+from collections import OrderedDict, deque
+from typing import Any
+import time
 import mysql.connector
+from gevent.lock import BoundedSemaphore
 from flask import g
 import os
 from core.logger import logger
 
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection could be checked out within the pool timeout."""
+
+
+class PreparedStatement:
+    """A server-side prepared statement and the prepared dict cursor that owns it."""
+    __slots__ = ("sql", "cursor")
+
+    def __init__(self, sql: str, cursor: Any) -> None:
+        # The connector only reuses the statement when it gets the *same* str object again
+        self.sql = sql
+        self.cursor = cursor
+
+
+class PooledConnection:
+    """A physical connection plus the bookkeeping the pool needs for recycling."""
+    __slots__ = ("conn", "created", "last_used", "statements")
+
+    def __init__(self, conn: Any) -> None:
+        self.conn = conn
+        self.created = time.monotonic()
+        self.last_used = self.created
+        # Prepared statements of this connection by SQL text, LRU (they die with the connection)
+        self.statements: OrderedDict[str, PreparedStatement] = OrderedDict()
+
+
+class ConnectionPool:
+    """
+    Bounded, gevent-aware pool of MySQL connections (one pool per worker process).
+    - checkouts beyond `size` wait on a gevent semaphore for at most `timeout` seconds
+    - idle connections are reused LIFO, so the hot ones stay warm and the cold ones age out
+    - connections idle longer than `max_idle` or older than `max_lifetime` are closed on checkout
+    - connections idle longer than `ping_interval` are pinged before being handed out
+    """
+
+    def __init__(self, connect, size: int, timeout: float, max_idle: float, max_lifetime: float, ping_interval: float) -> None:
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._slots = BoundedSemaphore(size)
+        self._idle: deque[PooledConnection] = deque()
+        self._in_use = 0
+        self.metrics: dict[str, int | float] = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "recycled_idle": 0,
+            "recycled_lifetime": 0,
+            "failed_health_checks": 0,
+            "max_wait_ms": 0.0,
+            "stmt_prepared": 0,
+            "stmt_executions": 0,
+            "stmt_reused": 0,
+            "stmt_evicted": 0,
+        }
+
+    def _open(self) -> PooledConnection:
+        logger.verbose("Opening new database connection...")
+        entry = PooledConnection(self._connect())
+        self.metrics["created"] += 1
+        logger.verbose("New Database connection opened!")
+        return entry
+
+    def _discard(self, entry: PooledConnection) -> None:
+        self.metrics["closed"] += 1
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, entry: PooledConnection, now: float) -> bool:
+        if now - entry.created > self.max_lifetime:
+            self.metrics["recycled_lifetime"] += 1
+            return False
+        idle_for = now - entry.last_used
+        if idle_for > self.max_idle:
+            self.metrics["recycled_idle"] += 1
+            return False
+        if idle_for > self.ping_interval:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Exception:
+                self.metrics["failed_health_checks"] += 1
+                return False
+        return True
+
+    def acquire(self) -> PooledConnection:
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            self.metrics["waits"] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                self.metrics["timeouts"] += 1
+                logger.warning(f"Database pool exhausted ({self.size} connections in use), checkout timed out after {self.timeout}s")
+                raise PoolTimeout("Database connection pool exhausted")
+            waited_ms = (time.monotonic() - start) * 1000
+            self.metrics["max_wait_ms"] = max(self.metrics["max_wait_ms"], round(waited_ms, 2))
+
+        try:
+            now = time.monotonic()
+            while self._idle:
+                entry = self._idle.pop()
+                if self._is_usable(entry, now):
+                    break
+                self._discard(entry)
+            else:
+                entry = self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+        self._in_use += 1
+        self.metrics["checkouts"] += 1
+        return entry
+
+    def release(self, entry: PooledConnection) -> None:
+        self._in_use -= 1
+        try:
+            conn = entry.conn
+            # Never hand a connection with leftover state to the next request
+            if conn.unread_result:
+                conn.consume_results()
+            if conn.in_transaction:
+                conn.rollback()
+            if not conn.autocommit:
+                conn.autocommit = True
+            entry.last_used = time.monotonic()
+            self._idle.append(entry)
+        except Exception as e:
+            logger.warning(f"Dropping broken database connection: {e}")
+            self._discard(entry)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "size": self.size,
+            "in_use": self._in_use,
+            "idle": len(self._idle),
+            **self.metrics,
+        }
+
+
 class DataBase:
     def __init__(self):
         logger.verbose("Initializing database connection...")
@@ -21,21 +173,56 @@ class DataBase:
             logger.warning("DB_PORT not set, using default port (3306)")
         self.port = int(self.port) # Cast to INT for DB
 
+        # Pool tuning, per gunicorn worker
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", "10"))
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+        self.pool_max_idle = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+        self.pool_max_lifetime = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+        self.pool_ping_interval = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+        # Prepared statements kept per pooled connection, and the parameter count above which
+        # a statement is a one-off (long IN lists, big multi-row INSERTs) and runs as plain text
+        self.statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE", "32"))
+        self.prepare_max_params = int(os.getenv("DB_PREPARE_MAX_PARAMS", "32"))
+        self._pool: ConnectionPool | None = None
+        self._pool_pid: int | None = None
+
+    def _connect(self):
+        return mysql.connector.connect(
+            host=self.host,
+            user=self.user,
+            port=self.port,
+            password=self.password,
+            database=self.database,
+            autocommit=True,
+            connection_timeout=5,
+        )
+
+    @property
+    def pool(self) -> ConnectionPool:
+        # A forked worker must never share sockets with its parent, so pools are per PID
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            self._pool = ConnectionPool(
+                self._connect,
+                size=self.pool_size,
+                timeout=self.pool_timeout,
+                max_idle=self.pool_max_idle,
+                max_lifetime=self.pool_max_lifetime,
+                ping_interval=self.pool_ping_interval,
+            )
+            self._pool_pid = pid
+            logger.verbose("Database pool created for worker %s (size %s)", pid, self.pool_size)
+        return self._pool
+
+    def pool_stats(self) -> dict[str, int | float]:
+        return self.pool.stats()
 
     def get_db(self):
-        """Get or create a DB connection for the current request."""
+        """Get the pooled DB connection for the current request (checked out on first use)."""
         if "db" not in g:
-            logger.verbose("Opening new database connection...")
-            g.db = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                port=self.port,
-                password=self.password,
-                database=self.database,
-                autocommit=True,
-                connection_timeout=5,
-            )
-            logger.verbose("New Database connection opened!")
+            entry = self.pool.acquire()
+            g.db_entry = entry
+            g.db = entry.conn
         return g.db
 
     def get_cursor(self):
@@ -43,11 +230,11 @@ class DataBase:
         return self.get_db().cursor(dictionary=True)
 
     def close_db(self, e=None):
-        """Close the DB connection for the current request."""
-        db = g.pop("db", None)
-        if db is not None:
-            logger.verbose("Closing database connection...")
-            db.close()
+        """Return the DB connection of the current request to the pool."""
+        g.pop("db", None)
+        entry = g.pop("db_entry", None)
+        if entry is not None:
+            self.pool.release(entry)
 
     @contextmanager
     def cursor(self):
@@ -57,6 +244,54 @@ class DataBase:
         finally:
             cur.close()
 
+    def prepared(self, cur: Any, sql: str, params: tuple[Any, ...] = ()) -> Any:
+        """
+        Executes sql (%s placeholders, params as a tuple) as a server-side prepared statement
+        cached on the request's pooled connection, so the server parses and plans it once per
+        connection. Returns the cursor holding the result (dict rows, read it fully before the
+        next call with the same sql). `cur` must belong to the request connection (db_helper.cursor()
+        or a transaction cursor); statements with too many params just run on it as plain text.
+        Trade-off: every reuse costs two round trips (COM_STMT_RESET, then COM_STMT_EXECUTE)
+        where cur.execute() costs one. Only worth it for statements that are expensive to plan
+        (multi-join UNIONs and the like); primary key / IN lookups and small DML stay on cur.execute().
+        """
+        if len(params) > self.prepare_max_params or self.statement_cache_size <= 0:
+            cur.execute(sql, params)
+            return cur
+
+        self.get_db()
+        entry: PooledConnection = g.db_entry
+        metrics = self.pool.metrics
+        stmt = entry.statements.get(sql)
+        reused = stmt is not None
+        if stmt is None:
+            stmt = PreparedStatement(sql, entry.conn.cursor(prepared=True, dictionary=True))
+            entry.statements[sql] = stmt
+            metrics["stmt_prepared"] += 1
+            while len(entry.statements) > self.statement_cache_size:
+                _, old = entry.statements.popitem(last=False)
+                metrics["stmt_evicted"] += 1
+                try:
+                    old.cursor.close()  # deallocates it on the server
+                except Exception:
+                    pass
+        else:
+            entry.statements.move_to_end(sql)
+
+        try:
+            stmt.cursor.execute(stmt.sql, params)
+        except Exception:
+            entry.statements.pop(sql, None)
+            try:
+                stmt.cursor.close()
+            except Exception:
+                pass
+            raise
+        metrics["stmt_executions"] += 1
+        if reused:
+            metrics["stmt_reused"] += 1
+        return stmt.cursor
+
     @contextmanager
     def transaction(self):
         """Context manager for atomic transactions (even with autocommit=True globally)."""
@@ -71,4 +306,4 @@ class DataBase:
             db.rollback()
             raise
         finally:
-            db.autocommit = True  # restore if neede # type: ignore
\ No newline at end of file
+            db.autocommit = True  # restore if neede # type: ignore
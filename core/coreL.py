@@ -1,14 +1,33 @@
 __part__ = "Silk Logger"
-__version__ = "1.0.0"
-import inspect
+__version__ = "1.1.0"
+import atexit
+import sys
+import threading
+from collections import deque
 
 # Core Logger Module
 
+# filename -> short module name, resolved once per file instead of walking inspect.stack()
+_caller_names: dict[str, str] = {}
+
+
+def _caller_name(depth: int) -> str:
+    filename = sys._getframe(depth + 1).f_code.co_filename
+    name = _caller_names.get(filename)
+    if name is None:
+        name = filename.split("/")[-1].split(".")[0]
+        _caller_names[filename] = name
+    return name
+
+
 class Logger:
     def __init__(self, name):
         self.name = name
         self.mode: str = "INFO"
         self.module = False
+        self.buffered = False
+        self._queue: deque[str] = deque()
+        self._wakeup = threading.Event()
         try:
             from colorama import Fore, Style, just_fix_windows_console
             just_fix_windows_console()
@@ -20,6 +39,24 @@ class Logger:
             print(f"[INFO] [Logger] Fallback to ANSI Codes (Does not work on Windows!)")
             self.module = False
 
+        if self.module:
+            colours = {
+                "WARNING": (self.Fore.YELLOW, self.Style.RESET_ALL),
+                "ERROR": (self.Fore.RED, self.Style.RESET_ALL),
+                "DEBUG": (self.Fore.BLUE, self.Style.RESET_ALL),
+                "VERBOSE": (self.Fore.MAGENTA, self.Style.RESET_ALL),
+                "FATAL": (self.Fore.RED + self.Style.BRIGHT, self.Style.RESET_ALL),
+            }
+        else:
+            colours = {
+                "WARNING": ("\033[33m", "\033[0m"),
+                "ERROR": ("\033[31m", "\033[0m"),
+                "DEBUG": ("\033[34m", "\033[0m"),
+                "VERBOSE": ("\033[35m", "\033[0m"),
+                "FATAL": ("\033[1;31m", "\033[0m"),
+            }
+        self._colours: dict[str, tuple[str, str]] = colours
+
         self.reset() # Resets the terminal colours to ensure everything is in correct colour
 
     def version(self):
@@ -31,61 +68,95 @@ class Logger:
         else:
             print("\033[0m", end="")
 
-    def info(self, message: str) -> None:
-        caller = inspect.stack()[1].filename.split("/")[-1].split(".")[0]
-        print(f"[INFO] [{caller}] {message}")
+    # --- Formatting / Output ---
 
-    def warning(self, message: str) -> None:
-        caller = inspect.stack()[1].filename.split("/")[-1].split(".")[0]
-        if self.module:
-            print(self.Fore.YELLOW + f"[WARNING] [{caller}] {message}" + self.Style.RESET_ALL)
-        else:
-            print(f"\033[33m[WARNING] [{caller}] {message}\033[0m")
+    def _format(self, level: str, caller: str, message: str, args: tuple) -> str:
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError):
+                message = f"{message} {args}"
+        start, end = self._colours.get(level, ("", ""))
+        return f"{start}[{level}] [{caller}] {message}{end}"
 
-    def error(self, message: str) -> None:
-        caller = inspect.stack()[1].filename.split("/")[-1].split(".")[0]
-        if self.module:
-            print(self.Fore.RED + f"[ERROR] [{caller}] {message}" + self.Style.RESET_ALL)
+    def _emit(self, level: str, message: str, args: tuple) -> None:
+        # depth 2: _emit <- info/warning/... <- actual caller
+        caller = _caller_name(2)
+        # Formatted right away, args may be mutated after the call; only the write is deferred
+        line = self._format(level, caller, message, args)
+        if self.buffered:
+            self._queue.append(line)
+            self._wakeup.set()
         else:
-            print(f"\033[31m[ERROR] [{caller}] {message}\033[0m")
+            print(line)
 
-    def debug(self, message: str) -> None:
-        caller = inspect.stack()[1].filename.split("/")[-1].split(".")[0]
-        if self.module:
-            print(self.Fore.BLUE + f"[DEBUG] [{caller}] {message}" + self.Style.RESET_ALL)
-        else:    
-            print(f"\033[34m[DEBUG] [{caller}] {message}\033[0m")
+    def info(self, message: str, *args) -> None:
+        self._emit("INFO", message, args)
 
-    def verbose(self, message: str) -> None:
-        caller = inspect.stack()[1].filename.split("/")[-1].split(".")[0]
-        if self.module:
-            print(self.Fore.MAGENTA + f"[VERBOSE] [{caller}] {message}" + self.Style.RESET_ALL)
-        else:
-            print(f"\033[35m[VERBOSE] [{caller}] {message}\033[0m")
+    def warning(self, message: str, *args) -> None:
+        self._emit("WARNING", message, args)
 
-    def fatal(self, message: str) -> None:
-        caller = inspect.stack()[1].filename.split("/")[-1].split(".")[0]
-        if self.module:
-            print(self.Fore.RED + self.Style.BRIGHT + f"[FATAL] [{caller}] {message}" + self.Style.RESET_ALL)
-        else:
-            print(f"\033[1;31m[FATAL] [{caller}] {message}\033[0m")
+    def error(self, message: str, *args) -> None:
+        self._emit("ERROR", message, args)
+
+    def debug(self, message: str, *args) -> None:
+        self._emit("DEBUG", message, args)
+
+    def verbose(self, message: str, *args) -> None:
+        self._emit("VERBOSE", message, args)
+
+    def fatal(self, message: str, *args) -> None:
+        self._emit("FATAL", message, args)
+        # Fatal usually precedes an exit, never leave it sitting in the buffer
+        self.flush()
+
+    # --- Buffered Writer ---
+
+    def flush(self) -> None:
+        lines = []
+        while self._queue:
+            lines.append(self._queue.popleft())
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+
+    def _writer(self) -> None:
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def set_buffered(self, enabled: bool) -> None:
+        """
+        Route log lines through a queue drained by a background writer (a greenlet under gevent).
+        Flushed at exit; processes that leave through os._exit (gunicorn worker_exit) must call flush() first.
+        """
+        if enabled and not self.buffered:
+            self.buffered = True
+            threading.Thread(target=self._writer, name="silk-logger", daemon=True).start()
+            atexit.register(self.flush)
+        elif not enabled and self.buffered:
+            self.buffered = False
+            self.flush()
 
     def set_mode(self, mode: str) -> None:
         mode = mode.upper()
         match mode:
             case "DEBUG":
-                self.verbose = lambda message: None
+                self.verbose = lambda message, *args: None
                 self.mode = "DEBUG"
             case "QUIET": # deactivates everything except error and fatal
-                self.info = lambda message: None
-                self.warning = lambda message: None
-                self.debug = lambda message: None
-                self.verbose = lambda message: None
+                self.info = lambda message, *args: None
+                self.warning = lambda message, *args: None
+                self.debug = lambda message, *args: None
+                self.verbose = lambda message, *args: None
                 self.mode = "QUIET"
             case "VERBOSE":
                 self.mode = "VERBOSE" # dont deactivate anything as it shows everything
             case _: # aka INFO / default:
-                self.debug = lambda message: None
-                self.verbose = lambda message: None
+                self.debug = lambda message, *args: None
+                self.verbose = lambda message, *args: None
                 self.mode = "INFO"
-
@@ -0,0 +1,77 @@
+"""
+Cross-worker cache invalidation over Redis pub/sub.
+Every worker subscribes to one channel and dispatches events to the handlers
+registered for their topic. A handler receives the invalidated key, or None
+when the worker lost its subscription and must drop everything it cached.
+"""
+import os
+import threading
+import time
+from typing import Callable
+import simplejson as json
+from core.coreCache import redis_client
+from core.logger import logger
+
+CHANNEL = "silk:invalidate"
+
+_handlers: dict[str, list[Callable[[str | None], None]]] = {}
+_listener_pid: int | None = None
+
+
+def subscribe(topic: str, handler: Callable[[str | None], None]) -> None:
+    _handlers.setdefault(topic, []).append(handler)
+    _ensure_listener()
+
+
+def publish(topic: str, key: str | int) -> None:
+    key = str(key)
+    # Apply locally right away so this worker reads its own writes
+    _dispatch(topic, key)
+    try:
+        redis_client.publish(CHANNEL, json.dumps({"topic": topic, "key": key}))
+    except Exception as e:
+        logger.error(f"Failed to publish invalidation {topic}:{key}: {e}")
+
+
+def _dispatch(topic: str, key: str | None) -> None:
+    for handler in _handlers.get(topic, ()):
+        try:
+            handler(key)
+        except Exception as e:
+            logger.error(f"Invalidation handler for {topic} failed: {e}")
+
+
+def _reset_all() -> None:
+    for topic in list(_handlers):
+        _dispatch(topic, None)
+
+
+def _listen() -> None:
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            # Anything cached before (re)subscribing may have missed events
+            _reset_all()
+            for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    event = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                _dispatch(str(event.get("topic")), event.get("key"))
+        except Exception as e:
+            logger.error(f"Invalidation listener lost Redis connection: {e}")
+            _reset_all()
+            time.sleep(1)
+
+
+def _ensure_listener() -> None:
+    global _listener_pid
+    # One listener per worker process (gevent turns this thread into a greenlet)
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    _listener_pid = pid
+    threading.Thread(target=_listen, name="silk-invalidation", daemon=True).start()
@@ -0,0 +1,131 @@
+"""
+Background expiry of SP tokens and gift codes.
+Without it, expired value is only handled when somebody touches it: payments.issue_payment
+marks a token expired, giftcards.redeem_giftcard refunds an expired code. The sweeper does
+both ahead of time, in batches of BATCH rows per transaction:
+- tokens: issued + past `expires` (idx_tokens_expires_status) -> status 'expired'
+- gift codes: active + past `expires_at` (idx_expires) -> deactivated; bought codes (source 'account')
+  are refunded to the account in created_by, admin issued ones (source 'system') never debited
+  anything and are only deactivated. Only runs with EXPIRY_REFUND_GIFTCODES=1, which must not be
+  set before migrations/2026-10-18_gift_codes_source.sql has backfilled `source`.
+  A bought code without its 'giftcard' funding transaction, or whose account is gone, is never
+  refunded: it stays active, gets `parked_at` and is reported once for a manual refund.
+Rows are claimed with FOR UPDATE SKIP LOCKED, so every worker can sweep at the same time
+and a code being redeemed right now is simply left for the redeem route.
+Expiry times are stored in UTC (whenever Instants), hence UTC_TIMESTAMP().
+"""
+import os
+from typing import Any, cast
+from core.ledger import Leg, lock_for_posting, post_legs, run as ledger_run
+from core.logger import logger
+from core.scheduler import every
+
+SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+BATCH = int(os.getenv("EXPIRY_SWEEP_BATCH", "200"))
+MAX_BATCHES = 50  # per table and run, the rest waits for the next run
+REFUND_GIFTCODES = os.getenv("EXPIRY_REFUND_GIFTCODES", "0") == "1"
+
+
+def _expire_tokens(cur: Any) -> int:
+    cur.execute(f"""
+        SELECT token FROM tokens
+        WHERE expires < UTC_TIMESTAMP() AND status = 'issued'
+        ORDER BY expires
+        LIMIT {BATCH}
+        FOR UPDATE SKIP LOCKED
+    """)
+    tokens = [r["token"] for r in cast(list[dict[str, Any]], cur.fetchall())]
+    if tokens:
+        placeholders = ", ".join(["%s"] * len(tokens))
+        cur.execute(f"UPDATE tokens SET status = 'expired' WHERE token IN ({placeholders})", tuple(tokens))
+    return len(tokens)
+
+
+def funded(cur: Any, codes: list[dict[str, Any]]) -> set[tuple[int, str]]:
+    """(account, code) of the codes whose purchase debited created_by ("Code: <code>", as giftcards.create)."""
+    if not codes:
+        return set()
+    accounts = list({int(c["created_by"]) for c in codes})
+    descriptions = [f"Code: {c['code']}" for c in codes]
+    cur.execute(f"""
+        SELECT from_account_id, description FROM transactions
+        WHERE transaction_type = 'giftcard' AND confirmed = 1
+          AND from_account_id IN ({", ".join(["%s"] * len(accounts))})
+          AND description IN ({", ".join(["%s"] * len(descriptions))})
+    """, (*accounts, *descriptions))
+    # description compares case-insensitively in SQL, match it the same way here
+    return {(int(r["from_account_id"]), str(r["description"])[len("Code: "):].lower())
+            for r in cast(list[dict[str, Any]], cur.fetchall())}
+
+
+def _refund_giftcodes(cur: Any) -> tuple[int, list[str], list[str]]:
+    """One batch. Returns (codes claimed, codes parked unfunded, codes parked without account)."""
+    cur.execute(f"""
+        SELECT id, code, amount, created_by, source FROM gift_codes
+        WHERE expires_at < UTC_TIMESTAMP() AND is_active = 1 AND parked_at IS NULL
+        ORDER BY expires_at
+        LIMIT {BATCH}
+        FOR UPDATE SKIP LOCKED
+    """)
+    codes = cast(list[dict[str, Any]], cur.fetchall())
+    if not codes:
+        return 0, [], []
+
+    bought = [c for c in codes if c["source"] != "system"]
+    funded_codes = funded(cur, bought)
+    unfunded = [c for c in bought if (int(c["created_by"]), str(c["code"]).lower()) not in funded_codes]
+    bought = [c for c in bought if (int(c["created_by"]), str(c["code"]).lower()) in funded_codes]
+    # Same refund as the redeem route: back to the creating account, frozen or not
+    locked = lock_for_posting(cur, [], (int(c["created_by"]) for c in bought))
+    legs = []
+    retired = [c["id"] for c in codes if c["source"] == "system"]
+    orphaned = []
+    for c in bought:
+        row = locked.get(int(c["created_by"]))
+        if row is None or row["is_deleted"]:
+            orphaned.append(c)
+            continue
+        retired.append(c["id"])
+        legs.append(Leg("refund", c["amount"], to_account_id=int(c["created_by"]),
+                        description=str(f"Giftcard expired {c['code'][-4:]}"),
+                        metadata={"code": c["code"], "provider": "LinePay"}))
+    if retired:
+        placeholders = ", ".join(["%s"] * len(retired))
+        cur.execute(f"UPDATE gift_codes SET is_active = 0 WHERE id IN ({placeholders})", tuple(retired))
+    parked = unfunded + orphaned
+    if parked:
+        placeholders = ", ".join(["%s"] * len(parked))
+        cur.execute(f"UPDATE gift_codes SET parked_at = UTC_TIMESTAMP() WHERE id IN ({placeholders})",
+                    tuple(c["id"] for c in parked))
+    post_legs(cur, legs, locked=locked, allow_frozen=True)
+    return len(codes), [str(c["code"]) for c in unfunded], [str(c["code"]) for c in orphaned]
+
+
+@every(SWEEP_INTERVAL, name="sweep_expired", exclusive=False)
+def sweep_expired() -> None:
+    from core.database import db_helper
+    expired = retired = 0
+    for _ in range(MAX_BATCHES):
+        with db_helper.transaction() as db:
+            cur = db.cursor(dictionary=True)
+            try:
+                count = _expire_tokens(cur)
+            finally:
+                cur.close()
+        expired += count
+        if count < BATCH:
+            break
+    # Off until the source backfill ran, see the module docstring
+    if REFUND_GIFTCODES:
+        for _ in range(MAX_BATCHES):
+            count, unfunded, orphaned = ledger_run(_refund_giftcodes)
+            retired += count - len(unfunded) - len(orphaned)
+            # Parked codes are never claimed again, so each one is reported exactly once
+            if unfunded:
+                logger.error(f"Parked {len(unfunded)} expired gift codes without a funding transaction, not refunded: {', '.join(unfunded)}")
+            if orphaned:
+                logger.error(f"Parked {len(orphaned)} expired gift codes whose creating account is missing, refund by hand: {', '.join(orphaned)}")
+            if count < BATCH:
+                break
+    if expired or retired:
+        logger.verbose("Expiry sweep: %s tokens expired, %s gift codes retired", expired, retired)
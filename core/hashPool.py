@@ -0,0 +1,69 @@
+"""
+Native thread pool for bcrypt.
+bcrypt is CPU-bound C code that never yields to the gevent hub, so running it inline stalls
+every other greenlet of the worker for the whole hash. run() hands the call to a small pool of
+real OS threads (bcrypt releases the GIL while hashing) and only the calling greenlet waits.
+At most HASH_THREADS hashes run at once per worker, further callers queue on a semaphore.
+"""
+import os
+import time
+from typing import Any, Callable, TypeVar
+from gevent.lock import BoundedSemaphore
+from gevent.threadpool import ThreadPool
+
+T = TypeVar("T")
+
+THREADS = int(os.getenv("HASH_THREADS", "2"))
+
+_pool: ThreadPool | None = None
+_pool_pid: int | None = None
+_slots = BoundedSemaphore(THREADS)
+_metrics: dict[str, int | float] = {
+    "running": 0,
+    "queued": 0,
+    "max_queued": 0,
+    "completed": 0,
+    "max_wait_ms": 0.0,
+    "total_wait_ms": 0.0,
+}
+
+
+def _get_pool() -> ThreadPool:
+    # Threads don't survive a fork, every gunicorn worker gets its own pool
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        _pool = ThreadPool(THREADS)
+        _pool_pid = pid
+    return _pool
+
+
+def run(func: Callable[..., T], *args: Any) -> T:
+    """Runs func(*args) on the hash pool, blocking only the calling greenlet."""
+    queued_at = time.monotonic()
+    _metrics["queued"] += 1
+    _metrics["max_queued"] = max(_metrics["max_queued"], _metrics["queued"])
+    try:
+        _slots.acquire()
+    finally:
+        _metrics["queued"] -= 1
+    waited_ms = (time.monotonic() - queued_at) * 1000
+    _metrics["total_wait_ms"] += waited_ms
+    _metrics["max_wait_ms"] = max(_metrics["max_wait_ms"], round(waited_ms, 2))
+    _metrics["running"] += 1
+    try:
+        return _get_pool().apply(func, args)
+    finally:
+        _metrics["running"] -= 1
+        _metrics["completed"] += 1
+        _slots.release()
+
+
+def stats() -> dict[str, int | float]:
+    completed = _metrics["completed"]
+    return {
+        "threads": THREADS,
+        **_metrics,
+        "total_wait_ms": round(_metrics["total_wait_ms"], 2),
+        "avg_wait_ms": round(_metrics["total_wait_ms"] / completed, 2) if completed else 0.0,
+    }
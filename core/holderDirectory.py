@@ -0,0 +1,104 @@
+"""
+Display names of account holders.
+- users: username, cached per worker and filled with one IN query per batch of misses;
+  dropped through the "user" invalidation topic (renames go through invalidate_user)
+- gov accounts: gov_accounts table (name per account number), loaded once per worker
+- companies: companies table, loaded once per worker
+The two small tables are reloaded after RELOAD_INTERVAL or on a "holders" event.
+resolve() takes (holder_type, holder_id, account_number) refs and returns a name for each.
+"""
+import time
+from typing import Any, Iterable, cast
+from core.coreCache import LocalCache
+from core.eventBus import subscribe, publish
+from core.logger import logger
+
+RELOAD_INTERVAL = 600  # seconds
+
+HolderRef = tuple[str | None, str | int | None, str | None]  # (holder_type, holder_id, account_number)
+
+_usernames = LocalCache(maxsize=16384, ttl=600)
+_gov_names: dict[str, str] = {}
+_company_names: dict[str, str] = {}
+_loaded_at: float | None = None
+
+
+def _load_static(cur: Any) -> None:
+    global _gov_names, _company_names, _loaded_at
+    cur.execute("SELECT account_number, name FROM gov_accounts")
+    gov = {str(r["account_number"]): str(r["name"]) for r in cast(list[dict[str, Any]], cur.fetchall())}
+    cur.execute("SELECT id, name FROM companies")
+    companies = {str(r["id"]): str(r["name"]) for r in cast(list[dict[str, Any]], cur.fetchall())}
+    _gov_names, _company_names = gov, companies
+    _loaded_at = time.monotonic()
+    logger.verbose("Holder directory loaded: %s gov accounts, %s companies", len(gov), len(companies))
+
+
+def _load_usernames(cur: Any, user_ids: list[str]) -> None:
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    cur.execute(f"SELECT id, username FROM users WHERE id IN ({placeholders})", tuple(user_ids))
+    for r in cast(list[dict[str, Any]], cur.fetchall()):
+        _usernames.set(str(r["id"]), str(r["username"]))
+
+
+def _name(holder_type: str | None, holder_id: str | None, account_number: str | None) -> str:
+    if holder_type == "user":
+        return _usernames.get(holder_id) or "Unknown User"
+    if holder_type == "company":
+        return _company_names.get(str(holder_id)) or "Unknown Company"
+    if holder_type == "gov":
+        return _gov_names.get(str(account_number)) or "Regierung"
+    return "System/External"
+
+
+def resolve(refs: Iterable[HolderRef], cur: Any = None) -> dict[HolderRef, str]:
+    """Names for all refs; at most one users query for the uncached usernames."""
+    refs = set(refs)
+    stale = _loaded_at is None or time.monotonic() - _loaded_at > RELOAD_INTERVAL
+    missing_users = sorted({
+        str(holder_id) for holder_type, holder_id, _ in refs
+        if holder_type == "user" and holder_id is not None and _usernames.get(str(holder_id)) is None
+    })
+    if stale or missing_users:
+        if cur is None:
+            from core.database import db_helper
+            with db_helper.cursor() as own_cur:
+                if stale:
+                    _load_static(own_cur)
+                if missing_users:
+                    _load_usernames(own_cur, missing_users)
+        else:
+            if stale:
+                _load_static(cur)
+            if missing_users:
+                _load_usernames(cur, missing_users)
+    return {
+        ref: _name(ref[0], str(ref[1]) if ref[1] is not None else None, ref[2])
+        for ref in refs
+    }
+
+
+def resolve_one(holder_type: str | None, holder_id: str | int | None, account_number: str | None, cur: Any = None) -> str:
+    ref = (holder_type, holder_id, account_number)
+    return resolve([ref], cur)[ref]
+
+
+def invalidate_holders() -> None:
+    """Call after changing gov_accounts or companies."""
+    publish("holders", "all")
+
+
+def _on_user_invalidate(key: str | None) -> None:
+    if key is None:
+        _usernames.clear()
+    else:
+        _usernames.pop(key)
+
+
+def _on_holders_invalidate(key: str | None) -> None:
+    global _loaded_at
+    _loaded_at = None
+
+
+subscribe("user", _on_user_invalidate)
+subscribe("holders", _on_holders_invalidate)
@@ -0,0 +1,127 @@
+"""
+Hot-account mode.
+Accounts that receive a credit from nearly every posting (the government tax account)
+would serialize all of those postings on one InnoDB row lock. Credits to hot accounts
+are therefore added to one of N sub-balance slots (bank_account_credit_slots) picked at
+random, and a background job folds the slots into bank_accounts.balance.
+The real balance of a hot account is always balance + SUM(pending), which
+effective_balances() reads in a single consistent statement.
+"""
+import os
+import random
+from decimal import Decimal
+from typing import Any, Iterable, cast
+from core.logger import logger
+from core.scheduler import every
+
+# Defaults to the government tax account (ledger.GOV_TAX_ACCOUNT)
+HOT_ACCOUNTS: frozenset[int] = frozenset(
+    int(x) for x in os.getenv("HOT_ACCOUNTS", "26").split(",") if x.strip()
+)
+SLOTS = int(os.getenv("HOT_ACCOUNT_SLOTS", "16"))
+FOLD_INTERVAL = float(os.getenv("HOT_ACCOUNT_FOLD_INTERVAL", "5"))
+
+
+def is_hot(account_id: int) -> bool:
+    return account_id in HOT_ACCOUNTS
+
+
+def credit(cur: Any, credits: dict[int, Decimal]) -> None:
+    """Adds credits to random slots; only the chosen slot rows are locked."""
+    if not credits:
+        return
+    values = []
+    params: list[Any] = []
+    for account_id, amount in credits.items():
+        values.append("(%s, %s, %s)")
+        params.extend((account_id, random.randrange(SLOTS), amount))
+    cur.execute(f"""
+        INSERT INTO bank_account_credit_slots (account_id, slot, pending)
+        VALUES {", ".join(values)}
+        ON DUPLICATE KEY UPDATE pending = pending + VALUES(pending)
+    """, tuple(params))
+
+
+def fold(cur: Any, account_id: int) -> Decimal:
+    """
+    Moves all pending credits into the real balance. Caller owns the transaction.
+    The account row is locked before its slots, the order postings take them in.
+    """
+    cur.execute("SELECT id FROM bank_accounts WHERE id = %s FOR UPDATE", (account_id,))
+    cur.fetchall()
+    cur.execute("""
+        SELECT slot, pending
+        FROM bank_account_credit_slots
+        WHERE account_id = %s
+        FOR UPDATE
+    """, (account_id,))
+    rows = cast(list[dict[str, Any]], cur.fetchall())
+    slots = {int(r["slot"]): Decimal(str(r["pending"])) for r in rows if Decimal(str(r["pending"])) != 0}
+    pending = sum(slots.values(), Decimal("0"))
+    if slots:
+        cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE id = %s", (pending, account_id))
+        # Take out exactly what was read, a credit that got in anyway is kept for the next fold
+        cases = " ".join(["WHEN %s THEN %s"] * len(slots))
+        placeholders = ", ".join(["%s"] * len(slots))
+        params: list[Any] = []
+        for slot, amount in slots.items():
+            params.extend((slot, amount))
+        params.append(account_id)
+        params.extend(slots)
+        cur.execute(f"""
+            UPDATE bank_account_credit_slots
+            SET pending = pending - CASE slot {cases} END
+            WHERE account_id = %s AND slot IN ({placeholders})
+        """, tuple(params))
+    return pending
+
+
+def effective_balances(cur: Any, account_ids: Iterable[int]) -> dict[int, Decimal]:
+    """balance + pending slot credits for the given hot accounts (non-hot ids are ignored)."""
+    ids = sorted({int(i) for i in account_ids if int(i) in HOT_ACCOUNTS})
+    if not ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(ids))
+    cur.execute(f"""
+        SELECT b.id, b.balance + COALESCE(SUM(s.pending), 0) AS balance
+        FROM bank_accounts b
+        LEFT JOIN bank_account_credit_slots s ON s.account_id = b.id
+        WHERE b.id IN ({placeholders})
+        GROUP BY b.id, b.balance
+    """, tuple(ids))
+    return {int(r["id"]): Decimal(str(r["balance"])) for r in cast(list[dict[str, Any]], cur.fetchall())}
+
+
+def balance_of(cur: Any, account_id: int) -> Decimal | None:
+    """Exact current balance of any account (hot or not), None if it does not exist."""
+    cur.execute("SELECT id, balance FROM bank_accounts WHERE id = %s", (account_id,))
+    row = cast(dict[str, Any] | None, cur.fetchone())
+    if row is None:
+        return None
+    apply_pending(cur, [row])
+    return Decimal(str(row["balance"]))
+
+
+def apply_pending(cur: Any, rows: list[dict[str, Any]]) -> None:
+    """Rewrites row["balance"] of any hot account in rows to its exact balance. No query for normal accounts."""
+    hot = [r for r in rows if r.get("id") is not None and int(r["id"]) in HOT_ACCOUNTS]
+    if not hot:
+        return
+    balances = effective_balances(cur, (r["id"] for r in hot))
+    for r in hot:
+        if int(r["id"]) in balances:
+            r["balance"] = balances[int(r["id"])]
+
+
+@every(FOLD_INTERVAL, name="fold_hot_accounts")
+def fold_hot_accounts() -> None:
+    from core.database import db_helper
+    for account_id in sorted(HOT_ACCOUNTS):
+        with db_helper.transaction() as db:
+            cur = db.cursor(dictionary=True)
+            try:
+                folded = fold(cur, account_id)
+            finally:
+                cur.close()
+        if folded:
+            logger.verbose("Folded %s pending credits into hot account %s", folded, account_id)
@@ -0,0 +1,113 @@
+"""
+Idempotency-Key support for money-moving endpoints.
+A request carrying an Idempotency-Key header is executed at most once per (endpoint, user, key):
+- the first request takes a short in-flight lock in Redis, runs, and stores its response for TTL
+- a retry with the same key gets the stored response back (one Redis GET, no ledger transaction)
+- a concurrent duplicate waits for the first one to finish instead of executing again
+- reusing a key with a different body is rejected with 422
+5xx responses are not stored, so those can be retried.
+Goes below @require_token, so the key is scoped to the authenticated user. Endpoints without
+a user (/api/pay/issue) are scoped by a hash of the SP token in the body instead.
+If Redis can't be reached before running, the request is answered with 503 rather than run
+without protection; once it ran, the real response is returned even if storing it fails.
+"""
+import hashlib
+import os
+import time
+import uuid
+from functools import wraps
+from typing import Any, Callable, cast
+from flask import Response, jsonify, make_response, request
+from core.coreCache import redis_client
+from core.logger import logger
+
+HEADER = "Idempotency-Key"
+TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+LOCK_MS = 30_000  # longer than any ledger transaction incl. retries
+WAIT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.05
+MAX_KEY_LENGTH = 255
+
+# KEYS: lock  ARGV: token. Only the request that took the lock may release it
+_RELEASE_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+""")
+
+
+def _replay(stored: dict[str, str]) -> Response:
+    response = Response(stored["body"], status=int(stored["status"]), mimetype=stored.get("mimetype") or "application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _principal(args: tuple[Any, ...]) -> str:
+    if args and isinstance(args[0], dict) and args[0].get("id") is not None:
+        return str(args[0]["id"])
+    body = request.get_json(silent=True)
+    token = body.get("token") if isinstance(body, dict) else None
+    if token:
+        return "sp:" + hashlib.sha256(str(token).encode()).hexdigest()[:32]
+    return "anon"
+
+
+def idempotent(func: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return func(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": "Idempotency-Key too long"}), 400
+
+        principal = _principal(args)
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        result_key = f"idem:{request.endpoint}:{principal}:{digest}"
+        lock_key = f"{result_key}:lock"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        # A lock that outlived LOCK_MS may have been taken over, never delete someone else's
+        token = uuid.uuid4().hex
+
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            try:
+                stored = cast(dict[str, str], redis_client.hgetall(result_key))
+                locked = not stored and redis_client.set(lock_key, token, nx=True, px=LOCK_MS)
+            except Exception as e:
+                logger.error(f"Idempotency store unavailable on {request.endpoint}: {e}")
+                return jsonify({"error": "Service temporarily unavailable, retry later"}), 503
+            if stored:
+                if stored.get("fingerprint") != fingerprint:
+                    return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+                logger.verbose("Replaying stored response for idempotency key on %s", request.endpoint)
+                return _replay(stored)
+            if locked:
+                break
+            # Same key in flight right now: wait for its result instead of running twice
+            if time.monotonic() > deadline:
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            response = make_response(func(*args, **kwargs))
+            if response.status_code < 500 and not response.is_streamed:
+                try:
+                    pipe = redis_client.pipeline()
+                    pipe.hset(result_key, mapping={
+                        "status": response.status_code,
+                        "body": response.get_data(as_text=True),
+                        "mimetype": response.mimetype or "",
+                        "fingerprint": fingerprint,
+                    })
+                    pipe.expire(result_key, TTL)
+                    pipe.execute()
+                except Exception as e:
+                    # The request already ran (and may have committed), its response must reach the client
+                    logger.error(f"Failed to store idempotent response on {request.endpoint}: {e}")
+            return response
+        finally:
+            try:
+                _RELEASE_SCRIPT(keys=[lock_key], args=[token])
+            except Exception as e:
+                logger.error(f"Failed to release idempotency lock on {request.endpoint}: {e}")
+    return wrapper
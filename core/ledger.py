@@ -0,0 +1,243 @@
+"""
+Ledger posting engine.
+Every money movement is a list of legs posted inside one DB transaction:
+1. all touched accounts are locked with a single SELECT ... ORDER BY id FOR UPDATE
+   (consistent lock order, so concurrent postings queue instead of deadlocking)
+2. existence, frozen state and balances are checked against the locked rows
+3. transaction rows are written with one multi-row INSERT per wave
+4. balance deltas are applied with one UPDATE
+   (credits to hot accounts go to sub-balance slots instead, see core.hotAccounts)
+run() wraps a posting in a transaction and retries it on deadlocks / lock wait timeouts.
+"""
+import time
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Callable, Iterable, TypeVar, cast
+import mysql.connector
+import simplejson as json
+from core.database import db_helper
+from core import hotAccounts
+from core.logger import logger
+
+T = TypeVar("T")
+
+GOV_TAX_ACCOUNT = 26  # hardcoded until Government System
+RETRY_ERRNOS = (1213, 1205)  # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+MAX_ATTEMPTS = 3
+
+
+class LedgerError(Exception):
+    def __init__(self, reason: str, message: str, status: int, account_id: int | None = None) -> None:
+        super().__init__(message)
+        self.reason = reason  # "not_found" | "frozen" | "insufficient"
+        self.message = message
+        self.status = status
+        self.account_id = account_id
+
+
+@dataclass
+class Leg:
+    transaction_type: str
+    amount: Decimal
+    from_account_id: int | None = None
+    to_account_id: int | None = None
+    description: str | None = None
+    metadata: dict[str, Any] | None = None
+    tax_category: int | str = 0
+    # Index of an earlier leg this one refers to (e.g. a tax leg -> its payment).
+    # The parent's transaction id is put into metadata["transaction_id"] and
+    # replaces "{parent_id}" in the description.
+    parent: int | None = None
+
+
+def lock_accounts(cur: Any, account_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+    """Locks the given accounts in id order and returns their rows keyed by id."""
+    ids = sorted({int(i) for i in account_ids})
+    if not ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(ids))
+    cur.execute(f"""
+        SELECT id, uuid, account_number, balance, is_frozen, is_deleted,
+               account_holder_type, account_holder_id
+        FROM bank_accounts
+        WHERE id IN ({placeholders})
+        ORDER BY id
+        FOR UPDATE
+    """, tuple(ids))
+    rows = cast(list[dict[str, Any]], cur.fetchall())
+    return {int(r["id"]): r for r in rows}
+
+
+def read_accounts(cur: Any, account_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+    """Like lock_accounts() but without locking (existence / frozen checks for hot accounts)."""
+    ids = sorted({int(i) for i in account_ids})
+    if not ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(ids))
+    cur.execute(f"""
+        SELECT id, uuid, account_number, balance, is_frozen, is_deleted,
+               account_holder_type, account_holder_id
+        FROM bank_accounts
+        WHERE id IN ({placeholders})
+    """, tuple(ids))
+    rows = cast(list[dict[str, Any]], cur.fetchall())
+    return {int(r["id"]): r for r in rows}
+
+
+def lock_for_posting(cur: Any, debited: Iterable[int], credited: Iterable[int]) -> dict[int, dict[str, Any]]:
+    """
+    Locks what a posting needs, for callers that want to inspect the rows before post_legs():
+    every debited account and every credited normal account. Hot accounts that are only
+    credited are just read, their credits never touch the row (see core.hotAccounts).
+    """
+    to_lock = {int(i) for i in debited}
+    credit_only_hot = set()
+    for acc in {int(i) for i in credited}:
+        if acc in to_lock:
+            continue
+        if hotAccounts.is_hot(acc):
+            credit_only_hot.add(acc)
+        else:
+            to_lock.add(acc)
+    locked = lock_accounts(cur, to_lock)
+    locked.update(read_accounts(cur, credit_only_hot))
+    return locked
+
+
+def _insert_wave(cur: Any, legs: list[Leg], parent_ids: list[int | None]) -> list[int]:
+    values = []
+    params: list[Any] = []
+    # Ids are read back by uuid, auto-increment ids of a multi-row INSERT need not be consecutive
+    # (innodb_autoinc_lock_mode 2, auto_increment_increment > 1)
+    tx_uuids = [str(uuid.uuid4()) for _ in legs]
+    for leg, parent_id, tx_uuid in zip(legs, parent_ids, tx_uuids):
+        description = leg.description
+        metadata = leg.metadata
+        if parent_id is not None:
+            if description is not None:
+                description = description.replace("{parent_id}", str(parent_id))
+            metadata = {**(metadata or {}), "transaction_id": parent_id}
+        values.append("(%s, %s, %s, %s, %s, %s, %s, %s, 1)")
+        params.extend((
+            tx_uuid,
+            leg.transaction_type,
+            leg.from_account_id,
+            leg.to_account_id,
+            leg.amount,
+            leg.tax_category,
+            description,
+            json.dumps(metadata) if metadata is not None else None,
+        ))
+    cur.execute(f"""
+        INSERT INTO transactions (
+            uuid,
+            transaction_type,
+            from_account_id,
+            to_account_id,
+            amount,
+            tax_category,
+            description,
+            metadata,
+            confirmed
+        ) VALUES {", ".join(values)}
+        RETURNING id, uuid
+    """, tuple(params))
+    ids = {str(r["uuid"]): int(r["id"]) for r in cast(list[dict[str, Any]], cur.fetchall())}
+    return [ids[tx_uuid] for tx_uuid in tx_uuids]
+
+
+def post_legs(
+    cur: Any,
+    legs: list[Leg],
+    locked: dict[int, dict[str, Any]] | None = None,
+    allow_frozen: bool = False,
+    check_funds: bool = True,
+) -> list[int]:
+    """
+    Posts all legs atomically (caller owns the transaction) and returns their transaction ids.
+    Pass `locked` when the caller already ran lock_accounts() for these accounts.
+    Raises LedgerError before writing anything if a check fails.
+    """
+    if not legs:
+        return []
+
+    deltas: dict[int, Decimal] = {}
+    for leg in legs:
+        if leg.amount <= 0:
+            raise ValueError("Ledger legs need a positive amount")
+        if leg.from_account_id is not None:
+            acc = int(leg.from_account_id)
+            deltas[acc] = deltas.get(acc, Decimal("0")) - leg.amount
+        if leg.to_account_id is not None:
+            acc = int(leg.to_account_id)
+            deltas[acc] = deltas.get(acc, Decimal("0")) + leg.amount
+
+    # Hot accounts that are only credited take the credit in a sub-balance slot instead of a row lock
+    hot_credits = {acc: delta for acc, delta in deltas.items() if delta > 0 and hotAccounts.is_hot(acc)}
+    if locked is None:
+        locked = lock_for_posting(cur, (acc for acc in deltas if acc not in hot_credits), hot_credits)
+    # A hot account that is debited needs its pending credits in the real balance first,
+    # folded into the row locked above so the lock order stays by id
+    for acc in sorted(deltas):
+        if deltas[acc] < 0 and hotAccounts.is_hot(acc) and acc in locked:
+            folded = hotAccounts.fold(cur, acc)
+            locked[acc]["balance"] = Decimal(str(locked[acc]["balance"])) + folded
+
+    for acc_id in sorted(deltas):
+        row = locked.get(acc_id)
+        if row is None or row["is_deleted"]:
+            raise LedgerError("not_found", "Account not found", 404, acc_id)
+        if row["is_frozen"] and not allow_frozen:
+            raise LedgerError("frozen", "Account is frozen", 403, acc_id)
+    if check_funds:
+        for acc_id, delta in deltas.items():
+            if delta < 0 and Decimal(str(locked[acc_id]["balance"])) + delta < 0:
+                raise LedgerError("insufficient", "Insufficient funds", 402, acc_id)
+
+    # Wave 1: independent legs, wave 2: legs referencing a wave 1 transaction id
+    ids: list[int | None] = [None] * len(legs)
+    first = [i for i, leg in enumerate(legs) if leg.parent is None]
+    second = [i for i, leg in enumerate(legs) if leg.parent is not None]
+    for i, tx_id in zip(first, _insert_wave(cur, [legs[i] for i in first], [None] * len(first))):
+        ids[i] = tx_id
+    if second:
+        parent_ids = [ids[cast(int, legs[i].parent)] for i in second]
+        for i, tx_id in zip(second, _insert_wave(cur, [legs[i] for i in second], parent_ids)):
+            ids[i] = tx_id
+
+    hotAccounts.credit(cur, hot_credits)
+    changed = sorted(acc for acc, delta in deltas.items() if delta != 0 and acc not in hot_credits)
+    if changed:
+        cases = " ".join(["WHEN %s THEN %s"] * len(changed))
+        placeholders = ", ".join(["%s"] * len(changed))
+        params: list[Any] = []
+        for acc in changed:
+            params.extend((acc, deltas[acc]))
+        params.extend(changed)
+        cur.execute(
+            f"UPDATE bank_accounts SET balance = balance + CASE id {cases} END WHERE id IN ({placeholders})",
+            tuple(params)
+        )
+        for acc in changed:
+            locked[acc]["balance"] = Decimal(str(locked[acc]["balance"])) + deltas[acc]
+
+    return cast(list[int], ids)
+
+
+def run(fn: Callable[[Any], T], attempts: int = MAX_ATTEMPTS) -> T:
+    """Runs fn(cursor) in a transaction, retrying the whole unit on deadlock."""
+    for attempt in range(1, attempts + 1):
+        try:
+            with db_helper.transaction() as db:
+                cur = db.cursor(dictionary=True)
+                try:
+                    return fn(cur)
+                finally:
+                    cur.close()
+        except mysql.connector.errors.DatabaseError as e:
+            if e.errno not in RETRY_ERRNOS or attempt == attempts:
+                raise
+            logger.warning("Ledger posting hit lock error %s, retrying (%s/%s)", e.errno, attempt, attempts)
+            time.sleep(0.02 * attempt)
+    raise RuntimeError("unreachable")
@@ -0,0 +1,238 @@
+"""
+Set-based payroll run: pays every eligible user their daily salary in chunks, instead of
+one /api/jobs/claim request per user.
+- eligible: not banned, salary cooldown (24h, same as the claim route) over, at least one job
+- amount: highest salary_classes.daily_amount over the user's jobs (same as the claim route)
+- target: the user's oldest active personal account
+Users are walked in id order, CHUNK at a time. Each chunk is one ledger transaction:
+the users rows are locked (the claim route locks them too, so nobody is paid twice),
+all salary legs go through post_legs (multi-row INSERT + one balance UPDATE) and
+last_salary_claim is set for the whole chunk with one UPDATE.
+A run is requested via request_run() (admin route or PAYROLL_INTERVAL), executed by the
+payroll_run job and reports its progress in the Redis hash payroll:{run_id}.
+The worker executing a run holds a short lease (payroll:lease:{run_id}) it renews after every
+chunk, and the hash keeps the id of the last walked user. A worker that dies mid-run (recycled
+by max_requests, killed) stops renewing; once the lease ran out, the next payroll_run poll on
+any worker resumes after that id. A chunk committed but not yet recorded is walked again,
+the cooldown re-check under lock keeps those users from being paid twice.
+"""
+import os
+import time
+import uuid
+from decimal import Decimal
+from typing import Any, cast
+from core.coreCache import redis_client
+from core.ledger import Leg, lock_for_posting, post_legs, run as ledger_run
+from core.logger import logger
+from core.scheduler import every, wake
+
+CHUNK = int(os.getenv("PAYROLL_CHUNK", "500"))
+INTERVAL = int(os.getenv("PAYROLL_INTERVAL", "0"))  # seconds between automatic runs, 0 = admin only
+POLL_INTERVAL = 30
+LEASE_MS = 60_000  # far longer than one chunk, a dead worker's run is taken over after this
+ACTIVE_TTL = 6 * 3600  # renewed per chunk, a run nobody works on stops blocking new ones after this
+STATUS_TTL = 7 * 24 * 3600
+
+ACTIVE_KEY = "payroll:active"
+LAST_KEY = "payroll:last_started"
+
+# KEYS: lease  ARGV: holder, lease ms (0 = release)
+_LEASE_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+if ARGV[2] == '0' then return redis.call('DEL', KEYS[1]) end
+return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+""")
+
+
+def _status_key(run_id: str) -> str:
+    return f"payroll:{run_id}"
+
+
+def _lease_key(run_id: str) -> str:
+    return f"payroll:lease:{run_id}"
+
+
+def _renew(run_id: str, holder: str) -> bool:
+    """Extends the lease if this worker still holds it."""
+    if not _LEASE_SCRIPT(keys=[_lease_key(run_id)], args=[holder, LEASE_MS]):
+        return False
+    redis_client.expire(ACTIVE_KEY, ACTIVE_TTL)
+    return True
+
+
+def _finish(run_id: str, holder: str) -> None:
+    redis_client.delete(ACTIVE_KEY)
+    _LEASE_SCRIPT(keys=[_lease_key(run_id)], args=[holder, 0])
+
+
+def request_run(requested_by: str) -> tuple[str, bool]:
+    """Queues a payroll run. Returns (run_id, created); a run already queued / running is returned instead."""
+    run_id = uuid.uuid4().hex
+    if not redis_client.set(ACTIVE_KEY, run_id, nx=True, ex=ACTIVE_TTL):
+        return str(redis_client.get(ACTIVE_KEY) or ""), False
+    pipe = redis_client.pipeline()
+    pipe.hset(_status_key(run_id), mapping={
+        "status": "queued",
+        "requested_by": requested_by,
+        "requested_at": int(time.time()),
+    })
+    pipe.expire(_status_key(run_id), STATUS_TTL)
+    pipe.execute()
+    wake("payroll_run")
+    logger.verbose("Payroll run %s requested by %s", run_id, requested_by)
+    return run_id, True
+
+
+def status(run_id: str) -> dict[str, str] | None:
+    stored = cast(dict[str, str], redis_client.hgetall(_status_key(run_id)))
+    return stored or None
+
+
+def _next_users(cur: Any, after: int) -> list[int]:
+    cur.execute("SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s", (after, CHUNK))
+    return [int(r["id"]) for r in cast(list[dict[str, Any]], cur.fetchall())]
+
+
+def _salaries(cur: Any, first: int, last: int) -> list[dict[str, Any]]:
+    """Highest paying job per eligible user in [first, last], one row per user."""
+    cur.execute("""
+        SELECT user_id, daily_amount, job_name, class_level FROM (
+            SELECT u.id AS user_id, sc.daily_amount, j.job_name, sc.class_level,
+                   ROW_NUMBER() OVER (PARTITION BY u.id ORDER BY sc.daily_amount DESC, sc.class_level DESC) AS rn
+            FROM users u
+            JOIN user_jobs uj ON uj.user_uuid = u.uuid
+            JOIN jobs j ON uj.job_id = j.id
+            JOIN salary_classes sc ON j.salary_class = sc.class_level
+            WHERE u.id BETWEEN %s AND %s
+              AND u.is_banned = 0
+              AND (u.last_salary_claim IS NULL OR u.last_salary_claim <= NOW() - INTERVAL 24 HOUR)
+              AND sc.daily_amount > 0
+        ) ranked
+        WHERE rn = 1
+    """, (first, last))
+    return cast(list[dict[str, Any]], cur.fetchall())
+
+
+def _pay_chunk(cur: Any, salaries: list[dict[str, Any]]) -> tuple[int, Decimal]:
+    """One transaction: re-checks the cooldown under lock and pays everyone still eligible."""
+    by_user = {int(s["user_id"]): s for s in salaries}
+    placeholders = ", ".join(["%s"] * len(by_user))
+    # Same lock the claim route takes, a concurrent claim either finished before or waits for us
+    cur.execute(f"""
+        SELECT id FROM users
+        WHERE id IN ({placeholders})
+          AND (last_salary_claim IS NULL OR last_salary_claim <= NOW() - INTERVAL 24 HOUR)
+        ORDER BY id
+        FOR UPDATE
+    """, tuple(sorted(by_user)))
+    eligible = [int(r["id"]) for r in cast(list[dict[str, Any]], cur.fetchall())]
+    if not eligible:
+        return 0, Decimal("0")
+
+    placeholders = ", ".join(["%s"] * len(eligible))
+    cur.execute(f"""
+        SELECT account_holder_id, MIN(id) AS account_id
+        FROM bank_accounts
+        WHERE account_holder_type = 'user' AND account_holder_id IN ({placeholders})
+          AND is_frozen = 0 AND is_deleted = 0
+        GROUP BY account_holder_id
+    """, tuple(str(u) for u in eligible))
+    accounts = {int(r["account_holder_id"]): int(r["account_id"]) for r in cast(list[dict[str, Any]], cur.fetchall())}
+
+    locked = lock_for_posting(cur, [], accounts.values())
+    legs: list[Leg] = []
+    paid: list[int] = []
+    for user_id in eligible:
+        acc_id = accounts.get(user_id)
+        row = locked.get(acc_id) if acc_id is not None else None
+        if row is None or row["is_frozen"] or row["is_deleted"]:
+            continue  # no usable account, the user can still claim manually later
+        salary = by_user[user_id]
+        legs.append(Leg("salary", Decimal(str(salary["daily_amount"])), to_account_id=acc_id, description="Salary Payment",
+                        metadata={"job_name": salary["job_name"], "class_level": salary["class_level"], "payroll": True}))
+        paid.append(user_id)
+    if not legs:
+        return 0, Decimal("0")
+
+    post_legs(cur, legs, locked=locked)
+    placeholders = ", ".join(["%s"] * len(paid))
+    cur.execute(f"UPDATE users SET last_salary_claim = NOW() WHERE id IN ({placeholders})", tuple(paid))
+    return len(paid), sum((leg.amount for leg in legs), Decimal("0"))
+
+
+def execute(run_id: str, holder: str) -> None:
+    """Runs (or resumes) the run; the caller took its lease for holder."""
+    from core.database import db_helper
+    key = _status_key(run_id)
+    progress = status(run_id) or {}
+    resumed = progress.get("status") == "running"
+    started = time.monotonic()
+    elapsed_before = float(progress.get("elapsed") or 0)
+    scanned = int(progress.get("users_scanned") or 0)
+    paid = int(progress.get("paid") or 0)
+    total = Decimal(progress.get("amount") or "0")
+    after = int(progress.get("after") or 0)
+    if resumed:
+        logger.warning(f"Payroll run {run_id} resumed by {holder} after user {after}")
+        redis_client.hset(key, mapping={"worker": holder, "resumed": int(progress.get("resumed") or 0) + 1})
+    else:
+        redis_client.hset(key, mapping={"status": "running", "worker": holder, "started_at": int(time.time())})
+        redis_client.set(LAST_KEY, int(time.time()))
+    try:
+        while True:
+            with db_helper.cursor() as cur:
+                users = _next_users(cur, after)
+                if not users:
+                    break
+                salaries = _salaries(cur, users[0], users[-1])
+            if salaries:
+                count, amount = ledger_run(lambda cur: _pay_chunk(cur, salaries))
+                paid += count
+                total += amount
+            after = users[-1]
+            scanned += len(users)
+            elapsed = elapsed_before + time.monotonic() - started
+            redis_client.hset(key, mapping={
+                "after": after,
+                "users_scanned": scanned,
+                "paid": paid,
+                "amount": str(total),
+                "elapsed": f"{elapsed:.3f}",
+                "users_per_second": f"{scanned / elapsed:.1f}" if elapsed > 0 else "0",
+            })
+            if not _renew(run_id, holder):
+                # Took too long and another worker resumed the run, it finishes it
+                logger.warning(f"Payroll run {run_id} lost its lease after user {after}, stopping")
+                return
+    except Exception as e:
+        redis_client.hset(key, mapping={"status": "failed", "error": str(e), "finished_at": int(time.time())})
+        _finish(run_id, holder)
+        raise
+    elapsed = elapsed_before + time.monotonic() - started
+    redis_client.hset(key, mapping={
+        "status": "done",
+        "finished_at": int(time.time()),
+        "users_scanned": scanned,
+        "paid": paid,
+        "amount": str(total),
+        "elapsed": f"{elapsed:.3f}",
+        "users_per_second": f"{scanned / elapsed:.1f}" if elapsed > 0 else "0",
+    })
+    _finish(run_id, holder)
+    logger.info(f"Payroll run {run_id}: paid {paid} of {scanned} users ({total}) in {elapsed:.1f}s")
+
+
+@every(POLL_INTERVAL, "payroll_run")
+def payroll_run() -> None:
+    if INTERVAL > 0:
+        last = redis_client.get(LAST_KEY)
+        if last is None or time.time() - float(last) >= INTERVAL:
+            request_run("scheduler")
+    run_id = redis_client.get(ACTIVE_KEY)
+    if not run_id:
+        return
+    # One worker holds a run at a time, a queued run or one whose worker died is free to take
+    holder = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    if not redis_client.set(_lease_key(str(run_id)), holder, nx=True, px=LEASE_MS):
+        return
+    execute(str(run_id), holder)
@@ -0,0 +1,166 @@
+"""
+Compiled permission matching.
+A user's permission set is compiled once into a segment trie, so checking a
+permission walks the dot-segments of the required key instead of running one
+regex per pattern. Semantics are identical to compile_pattern()/has_permission():
+- ** matches across dot segments
+- * matches within a single dot segment (prefix, suffix and middle wildcards too)
+- !pattern denies, the more specific (higher scoring) side wins, ties deny
+"""
+import re
+from typing import Iterable
+import simplejson as json
+from core.coreCache import LocalCache
+
+
+def compile_pattern(pattern: str) -> re.Pattern[str]:
+    """
+    Converts permission pattern into regex.
+    Supports:
+    - ** (matches across dot segments)
+    - * (matches within a single dot segment)
+    - prefix, suffix, middle wildcards
+    """
+
+    escaped = re.escape(pattern)
+
+    # restore wildcard meaning
+    # A double asterisk `\*\*` becomes `.*` (match across dots)
+    escaped = escaped.replace(r"\*\*", ".*")
+    # A single asterisk `\*` becomes `[^.]+` (match anything except a dot)
+    escaped = escaped.replace(r"\*", r"[^.]+")
+
+    # anchor full match
+    return re.compile("^" + escaped + "$")
+
+
+def score(pattern: str) -> int:
+    # specificity = fewer wildcards = more specific
+    return pattern.count("*") * -10 + len(pattern)
+
+
+class _Node:
+    __slots__ = ("literal", "star", "globs", "globstar", "allow", "deny")
+
+    def __init__(self) -> None:
+        self.literal: dict[str, _Node] = {}
+        self.star: _Node | None = None                        # segment is exactly "*"
+        self.globs: dict[str, tuple[re.Pattern[str], _Node]] = {}  # segment like "acc*" or "*view"
+        self.globstar: _Node | None = None                    # segment is exactly "**"
+        self.allow = -1
+        self.deny = -1
+
+
+class PermissionMatcher:
+    MEMO_SIZE = 512
+
+    def __init__(self, permissions: Iterable[str]) -> None:
+        self._root = _Node()
+        # "**" glued to other characters (e.g. "bank.acc**") can span a partial segment,
+        # those rare patterns keep their regex
+        self._fallback: list[tuple[re.Pattern[str], bool, int]] = []
+        self._memo: dict[str, bool] = {}
+        for perm in permissions:
+            self._add(perm)
+
+    def _add(self, perm: str) -> None:
+        is_deny = perm.startswith("!")
+        clean = perm[1:] if is_deny else perm
+        s = score(clean)
+
+        segments = clean.split(".")
+        if any("**" in seg and seg != "**" for seg in segments):
+            self._fallback.append((compile_pattern(clean), is_deny, s))
+            return
+
+        node = self._root
+        for seg in segments:
+            if seg == "**":
+                node.globstar = node.globstar or _Node()
+                node = node.globstar
+            elif seg == "*":
+                node.star = node.star or _Node()
+                node = node.star
+            elif "*" in seg:
+                if seg not in node.globs:
+                    node.globs[seg] = (compile_pattern(seg), _Node())
+                node = node.globs[seg][1]
+            else:
+                node = node.literal.setdefault(seg, _Node())
+
+        if is_deny:
+            node.deny = max(node.deny, s)
+        else:
+            node.allow = max(node.allow, s)
+
+    def _walk(self, node: _Node, segments: list[str], i: int, best: list[int]) -> None:
+        if i == len(segments):
+            best[0] = max(best[0], node.allow)
+            best[1] = max(best[1], node.deny)
+            return
+        seg = segments[i]
+        child = node.literal.get(seg)
+        if child is not None:
+            self._walk(child, segments, i + 1, best)
+        if node.star is not None and seg:
+            self._walk(node.star, segments, i + 1, best)
+        for regex, child in node.globs.values():
+            if regex.match(seg):
+                self._walk(child, segments, i + 1, best)
+        if node.globstar is not None:
+            # ** consumes one or more whole segments
+            for j in range(i + 1, len(segments) + 1):
+                self._walk(node.globstar, segments, j, best)
+
+    def _evaluate(self, required: str) -> bool:
+        best = [-1, -1]
+        self._walk(self._root, required.split("."), 0, best)
+        best_allow, best_deny = best
+
+        for regex, is_deny, s in self._fallback:
+            if regex.match(required) is None:
+                continue
+            if is_deny:
+                best_deny = max(best_deny, s)
+            else:
+                best_allow = max(best_allow, s)
+
+        if best_allow == -1 and best_deny == -1:
+            return False
+
+        if best_deny > best_allow:
+            return False
+        if best_allow > best_deny:
+            return True
+
+        return best_allow != -1 and best_deny == -1
+
+    def allows(self, required: str) -> bool:
+        result = self._memo.get(required)
+        if result is None:
+            if len(self._memo) >= self.MEMO_SIZE:
+                self._memo.clear()
+            result = self._evaluate(required)
+            self._memo[required] = result
+        return result
+
+
+# Compiled matchers keyed by the exact permission payload cached in Redis (see core/permissionCache.py)
+_matchers = LocalCache(maxsize=2048, ttl=600)
+
+
+def matcher_from_cache(raw: str) -> PermissionMatcher:
+    matcher = _matchers.get(raw)
+    if matcher is None:
+        matcher = PermissionMatcher(json.loads(raw))
+        _matchers.set(raw, matcher)
+    return matcher
+
+
+def matcher_for(permissions: Iterable[str]) -> PermissionMatcher:
+    key = frozenset(permissions)
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = PermissionMatcher(key)
+        _matchers.set(key, matcher)
+    return matcher
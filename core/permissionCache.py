@@ -0,0 +1,158 @@
+"""
+Redis cache of a user's resolved permission list (JSON), used by require_permission.
+Entries are versioned instead of expiring quickly: perms:{user_id} holds "<version>\\n<permissions json>"
+- perm:epoch is bumped by invalidate_all() (job index rebuilt, grant tables changed)
+- perms:ver:{user_id} is bumped by invalidate(user_id) (job assigned / removed, ...)
+Neither counter expires: an entry must never outlive the version it was written under, or a
+reset counter could count back up to it and make a pre-revocation entry valid again.
+One MGET reads both counters and the entry, an entry written under an older version is a miss.
+A refill that raced with an invalidation therefore stores an entry that is already stale,
+revoked permissions can't come back through it. That is what lets TTL be long.
+Misses refill single-flight: one request takes perm:lock:{user_id} and queries the DB,
+concurrent requests of the same user wait for its entry instead of running the query too.
+On top of that every worker keeps the compiled matcher per user (L1), dropped through the
+"perm" invalidation topic, so a check on a warm worker doesn't touch Redis at all.
+If Redis is unavailable the permissions are computed from the database (and not kept in L1).
+"""
+import time
+from typing import Any, cast
+import redis
+import simplejson as json
+from core.coreCache import redis_client, LocalCache
+from core.eventBus import subscribe, publish
+from core.logger import logger
+from core.permissionIndex import user_permissions
+from core.permMatcher import PermissionMatcher, matcher_from_cache
+
+TTL = 24 * 3600
+LOCK_MS = 5000
+WAIT_TIMEOUT = 2.0
+POLL_INTERVAL = 0.02
+
+EPOCH_KEY = "perm:epoch"
+
+_local = LocalCache(maxsize=4096, ttl=300)  # TTL only as a safety net, invalidation is event driven
+_generation = 0  # bumped on every invalidation, a fill that overlapped one is not kept
+
+
+def _entry_key(user_id: int | str) -> str:
+    return f"perms:{user_id}"
+
+
+def _version_key(user_id: int | str) -> str:
+    return f"perms:ver:{user_id}"
+
+
+def _read(user_id: int | str) -> tuple[str, str | None]:
+    """(current version, cached permissions json or None)."""
+    epoch, ver, raw = redis_client.mget([EPOCH_KEY, _version_key(user_id), _entry_key(user_id)])
+    version = f"{epoch or 0}:{ver or 0}"
+    if raw is None:
+        return version, None
+    stored_version, _, permissions = cast(str, raw).partition("\n")
+    return version, permissions if stored_version == version else None
+
+
+def _load(user_id: int | str, user_uuid: str | None) -> str:
+    from core.database import db_helper
+    with db_helper.cursor() as cur:
+        if not user_uuid:
+            # Auth row cached before it carried the uuid
+            cur.execute("SELECT uuid FROM users WHERE id = %s", (user_id,))
+            row = cast(dict[str, Any] | None, cur.fetchone())
+            user_uuid = row["uuid"] if row else None
+        permissions = user_permissions(cur, str(user_uuid)) if user_uuid else []
+    return json.dumps(permissions)
+
+
+def _fetch(user_id: int | str, user_uuid: str | None) -> tuple[str, bool]:
+    """(permissions json, whether it came through Redis and may be kept in L1)."""
+    try:
+        version, permissions = _read(user_id)
+        if permissions is not None:
+            return permissions, True
+
+        lock_key = f"perm:lock:{user_id}"
+        if not redis_client.set(lock_key, "1", nx=True, px=LOCK_MS):
+            deadline = time.monotonic() + WAIT_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                version, permissions = _read(user_id)
+                if permissions is not None:
+                    return permissions, True
+            # The refilling request is stuck or died, answer this one uncached
+            logger.warning("Permission refill for user %s timed out, loading uncached", user_id)
+            return _load(user_id, user_uuid), False
+    except redis.RedisError as e:
+        logger.warning(f"Permission cache unavailable, loading user {user_id} from the database: {e}")
+        return _load(user_id, user_uuid), False
+
+    try:
+        permissions = _load(user_id, user_uuid)
+        redis_client.set(_entry_key(user_id), f"{version}\n{permissions}", ex=TTL)
+        return permissions, True
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache permissions of user {user_id}: {e}")
+        return permissions, False
+    finally:
+        try:
+            redis_client.delete(lock_key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release permission refill lock of user {user_id}: {e}")
+
+
+def get(user_id: int | str, user_uuid: str | None = None) -> str:
+    """The user's permission keys as a JSON list, from cache or refilled once for all concurrent callers."""
+    return _fetch(user_id, user_uuid)[0]
+
+
+def get_matcher(user_id: int | str, user_uuid: str | None = None) -> PermissionMatcher:
+    """Compiled permissions of the user, from this worker's L1 or through get()."""
+    key = str(user_id)
+    matcher = _local.get(key)
+    if matcher is not None:
+        return matcher
+    generation = _generation
+    permissions, cacheable = _fetch(user_id, user_uuid)
+    matcher = matcher_from_cache(permissions)
+    # Without Redis other workers' invalidations may not arrive either, don't keep it
+    if cacheable and generation == _generation:
+        _local.set(key, matcher)
+    return matcher
+
+
+def invalidate(user_id: int | str) -> None:
+    """Call after changing anything that grants permissions to this one user."""
+    try:
+        redis_client.incr(_version_key(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Failed to invalidate cached permissions of user {user_id}: {e}")
+    publish("perm", user_id)
+
+
+def invalidate_uuid(cur: Any, user_uuid: str) -> None:
+    cur.execute("SELECT id FROM users WHERE uuid = %s", (user_uuid,))
+    row = cast(dict[str, Any] | None, cur.fetchone())
+    if row:
+        invalidate(row["id"])
+
+
+def invalidate_all() -> None:
+    """Call after changing jobs, job / group permissions or anything else shared by many users."""
+    try:
+        redis_client.incr(EPOCH_KEY)
+    except redis.RedisError as e:
+        logger.error(f"Failed to invalidate all cached permissions: {e}")
+    publish("perm", "all")
+
+
+def _on_invalidate(key: str | None) -> None:
+    global _generation
+    _generation += 1
+    if key is None or key == "all":
+        _local.clear()
+    else:
+        _local.pop(key)
+
+
+subscribe("perm", _on_invalidate)
@@ -0,0 +1,153 @@
+"""
+Precomputed job hierarchy for permission resolution.
+- job_closure: one row per (ancestor, descendant) pair of jobs.parent_job_id, incl. the job itself
+- job_effective_permissions: every permission a job has directly or through one of its ancestors
+Both are rebuilt from jobs / job_permissions as a whole (a few hundred rows), so resolving a
+user's permissions is a flat indexed union (user_permissions() below) instead of a recursive CTE,
+no matter how deep the job tree is. The closure is built in Python, a parent cycle just ends the walk.
+Job permissions are mostly edited directly in the DB, so a background job compares a fingerprint
+of both source tables and rebuilds when it changed; call refresh(force=True) after changing them in code.
+The same job watches the direct / group grant tables, any change drops all cached permission sets
+(core/permissionCache.py).
+"""
+import os
+from typing import Any, cast
+from core.coreCache import redis_client
+from core.logger import logger
+from core.scheduler import every
+
+REFRESH_INTERVAL = float(os.getenv("PERMISSION_INDEX_INTERVAL", "60"))
+FINGERPRINT_KEY = "permindex:fingerprint"
+GRANTS_FINGERPRINT_KEY = "permindex:grants"
+
+
+def _fingerprint(cur: Any) -> str:
+    cur.execute("""
+        SELECT COUNT(*) AS n, COALESCE(SUM(CRC32(CONCAT(id, ':', COALESCE(parent_job_id, '')))), 0) AS h
+        FROM jobs
+    """)
+    jobs = cast(dict[str, Any], cur.fetchone())
+    cur.execute("""
+        SELECT COUNT(*) AS n, COALESCE(SUM(CRC32(CONCAT(job_id, ':', permission_id))), 0) AS h
+        FROM job_permissions
+    """)
+    perms = cast(dict[str, Any], cur.fetchone())
+    return f"{jobs['n']}:{jobs['h']}:{perms['n']}:{perms['h']}"
+
+
+def _grants_fingerprint(cur: Any) -> str:
+    """Same for the tables that grant permissions without going through the job index."""
+    cur.execute("""
+        SELECT
+            (SELECT COALESCE(SUM(CRC32(CONCAT(user_uuid, ':', permission_id))), 0) FROM user_permissions) AS up,
+            (SELECT COALESCE(SUM(CRC32(CONCAT(user_uuid, ':', group_id))), 0) FROM user_groups) AS ug,
+            (SELECT COALESCE(SUM(CRC32(CONCAT(group_id, ':', permission_id))), 0) FROM group_permissions) AS gp,
+            (SELECT COALESCE(SUM(CRC32(CONCAT(id, ':', group_key))), 0) FROM permission_groups) AS pg,
+            (SELECT COALESCE(SUM(CRC32(CONCAT(id, ':', permission_key))), 0) FROM permissions) AS p
+    """)
+    row = cast(dict[str, Any], cur.fetchone())
+    return ":".join(str(row[k]) for k in ("up", "ug", "gp", "pg", "p"))
+
+
+def _closure(parents: dict[int, int | None]) -> list[tuple[int, int, int]]:
+    """(ancestor_id, descendant_id, depth) for every job and each of its ancestors."""
+    rows = []
+    for job_id in parents:
+        seen = {job_id}
+        rows.append((job_id, job_id, 0))
+        parent, depth = parents.get(job_id), 1
+        while parent is not None and parent not in seen and parent in parents:
+            seen.add(parent)
+            rows.append((parent, job_id, depth))
+            parent, depth = parents.get(parent), depth + 1
+    return rows
+
+
+def rebuild(cur: Any) -> None:
+    """Rebuilds both tables inside the caller's transaction."""
+    cur.execute("SELECT id, parent_job_id FROM jobs")
+    parents = {
+        int(r["id"]): int(r["parent_job_id"]) if r["parent_job_id"] is not None else None
+        for r in cast(list[dict[str, Any]], cur.fetchall())
+    }
+    rows = _closure(parents)
+
+    cur.execute("DELETE FROM job_closure")
+    if rows:
+        cur.executemany("INSERT INTO job_closure (ancestor_id, descendant_id, depth) VALUES (%s, %s, %s)", rows)
+    cur.execute("DELETE FROM job_effective_permissions")
+    cur.execute("""
+        INSERT INTO job_effective_permissions (job_id, permission_id)
+        SELECT DISTINCT jc.descendant_id, jp.permission_id
+        FROM job_closure jc
+        JOIN job_permissions jp ON jp.job_id = jc.ancestor_id
+    """)
+    logger.verbose("Permission index rebuilt: %s jobs, %s closure rows", len(parents), len(rows))
+
+
+def refresh(force: bool = False) -> bool:
+    """
+    Rebuilds if jobs or job_permissions changed since the last build (or always with force). Returns whether it did.
+    Any change to the index or the other grant tables invalidates every cached permission set.
+    """
+    from core.database import db_helper
+    from core import permissionCache
+    stored_index, stored_grants = redis_client.mget([FINGERPRINT_KEY, GRANTS_FINGERPRINT_KEY])
+    with db_helper.transaction() as db:
+        cur = db.cursor(dictionary=True)
+        try:
+            fingerprint = _fingerprint(cur)
+            grants = _grants_fingerprint(cur)
+            rebuilt = force or fingerprint != stored_index
+            if rebuilt:
+                rebuild(cur)
+        finally:
+            cur.close()
+    if not rebuilt and grants == stored_grants:
+        return False
+    # Only after the commit, a rolled back rebuild is retried next time
+    redis_client.mset({FINGERPRINT_KEY: fingerprint, GRANTS_FINGERPRINT_KEY: grants})
+    permissionCache.invalidate_all()
+    return rebuilt
+
+
+def user_permissions(cur: Any, user_uuid: str) -> list[str]:
+    """All permission keys of a user: jobs (incl. inherited), direct, groups and the default group."""
+    from core.database import db_helper
+    # Four-way UNION of joins, planning it costs more than the extra round trip of a prepared statement
+    rows = db_helper.prepared(cur, """
+        SELECT p.permission_key
+        FROM user_jobs uj
+        JOIN job_effective_permissions jep ON jep.job_id = uj.job_id
+        JOIN permissions p ON p.id = jep.permission_id
+        WHERE uj.user_uuid = %s
+
+        UNION
+
+        SELECT p.permission_key
+        FROM user_permissions up
+        JOIN permissions p ON p.id = up.permission_id
+        WHERE up.user_uuid = %s
+
+        UNION
+
+        SELECT p.permission_key
+        FROM user_groups ug
+        JOIN group_permissions gp ON gp.group_id = ug.group_id
+        JOIN permissions p ON p.id = gp.permission_id
+        WHERE ug.user_uuid = %s
+
+        UNION
+
+        SELECT p.permission_key
+        FROM permission_groups pg
+        JOIN group_permissions gp ON gp.group_id = pg.id
+        JOIN permissions p ON p.id = gp.permission_id
+        WHERE pg.group_key = 'default'
+    """, (user_uuid, user_uuid, user_uuid)).fetchall()
+    return sorted({r["permission_key"] for r in cast(list[dict[str, Any]], rows)})
+
+
+@every(REFRESH_INTERVAL, "refresh_permission_index")
+def refresh_permission_index() -> None:
+    refresh()
@@ -0,0 +1,87 @@
+"""
+PIN attempt counters and lockouts in Redis.
+A failed PIN is one atomic script (INCR + EXPIRE, lock once MAX_ATTEMPTS is reached), a correct
+PIN clears the counter. Neither touches bank_accounts, the row payments lock. Accounts whose
+state changed are remembered in a set and a background job copies their counter / lock into
+pin_failed_attempts / pin_locked_until for auditing.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Any, cast
+from core.coreCache import redis_client
+from core.logger import logger
+from core.scheduler import every
+
+MAX_ATTEMPTS = 3
+LOCK_SECONDS = 15 * 60
+FAIL_WINDOW = int(os.getenv("PIN_FAIL_WINDOW", str(24 * 3600)))  # failures older than this are forgotten
+PERSIST_INTERVAL = float(os.getenv("PIN_PERSIST_INTERVAL", "60"))
+PERSIST_BATCH = 500
+DIRTY_KEY = "pin:dirty"
+
+# KEYS: fail counter, lock, dirty set  ARGV: window, max attempts, lock seconds, account uuid
+_FAIL_SCRIPT = redis_client.register_script("""
+local n = redis.call('INCR', KEYS[1])
+if n == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+if n >= tonumber(ARGV[2]) then redis.call('SET', KEYS[2], '1', 'EX', ARGV[3]) end
+redis.call('SADD', KEYS[3], ARGV[4])
+return n
+""")
+# KEYS: fail counter, dirty set  ARGV: account uuid
+_RESET_SCRIPT = redis_client.register_script("""
+if redis.call('DEL', KEYS[1]) == 1 then redis.call('SADD', KEYS[2], ARGV[1]) end
+return 0
+""")
+
+
+def _fail_key(account_uuid: str) -> str:
+    return f"pin:fail:{account_uuid}"
+
+
+def _lock_key(account_uuid: str) -> str:
+    return f"pin:lock:{account_uuid}"
+
+
+def is_locked(account_uuid: str) -> bool:
+    return bool(redis_client.exists(_lock_key(account_uuid)))
+
+
+def record_failure(account_uuid: str) -> int:
+    """Counts a wrong PIN and locks the account once MAX_ATTEMPTS is reached. Returns the attempt count."""
+    return int(cast(Any, _FAIL_SCRIPT(
+        keys=[_fail_key(account_uuid), _lock_key(account_uuid), DIRTY_KEY],
+        args=[FAIL_WINDOW, MAX_ATTEMPTS, LOCK_SECONDS, account_uuid],
+    )))
+
+
+def record_success(account_uuid: str) -> None:
+    _RESET_SCRIPT(keys=[_fail_key(account_uuid), DIRTY_KEY], args=[account_uuid])
+
+
+@every(PERSIST_INTERVAL, name="persist_pin_state")
+def persist_pin_state() -> None:
+    from core.database import db_helper
+    uuids = cast(list[str], redis_client.spop(DIRTY_KEY, PERSIST_BATCH) or [])
+    if not uuids:
+        return
+    pipe = redis_client.pipeline()
+    for account_uuid in uuids:
+        pipe.get(_fail_key(account_uuid))
+        pipe.ttl(_lock_key(account_uuid))
+    replies = pipe.execute()
+    now = datetime.now()
+    rows = []
+    for i, account_uuid in enumerate(uuids):
+        attempts, lock_ttl = replies[2 * i], replies[2 * i + 1]
+        locked_until = now + timedelta(seconds=int(lock_ttl)) if lock_ttl and int(lock_ttl) > 0 else None
+        rows.append((int(attempts or 0), locked_until, account_uuid))
+    try:
+        with db_helper.cursor() as cur:
+            cur.executemany(
+                "UPDATE bank_accounts SET pin_failed_attempts = %s, pin_locked_until = %s WHERE uuid = %s",
+                rows,
+            )
+    except Exception:
+        redis_client.sadd(DIRTY_KEY, *uuids)  # try again next round
+        raise
+    logger.verbose("Persisted PIN state of %s accounts", len(rows))
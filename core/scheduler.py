@@ -0,0 +1,62 @@
+"""
+Tiny in-worker job scheduler.
+Modules register periodic jobs with @every(...) at import time, main.py starts them
+once the app exists. Each job runs inside an app context, so it can use db_helper
+exactly like a request does. Exclusive jobs take a short Redis lock per run, so only
+one of the gunicorn workers executes them per interval.
+wake(name) runs a job of this worker right away instead of at its next interval.
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable
+from flask import Flask
+from core.coreCache import redis_client
+from core.logger import logger
+
+_jobs: list[tuple[str, float, Callable[[], None], bool]] = []
+_started_pid: int | None = None
+_wakeups: dict[str, threading.Event] = {}
+
+
+def every(seconds: float, name: str | None = None, exclusive: bool = True) -> Callable[[Callable[[], None]], Callable[[], None]]:
+    def decorator(func: Callable[[], None]) -> Callable[[], None]:
+        _jobs.append((name or func.__name__, seconds, func, exclusive))
+        _wakeups[name or func.__name__] = threading.Event()
+        return func
+    return decorator
+
+
+def wake(name: str) -> None:
+    event = _wakeups.get(name)
+    if event is not None:
+        event.set()
+
+
+def _run_forever(app: Flask, name: str, interval: float, func: Callable[[], None], exclusive: bool) -> None:
+    wakeup = _wakeups[name]
+    # Spread workers out so they don't all wake up at the same moment
+    wakeup.wait(random.uniform(0, interval))
+    while True:
+        wakeup.clear()
+        started = time.monotonic()
+        try:
+            lock_ms = max(int(interval * 1000) - 100, 100)
+            if not exclusive or redis_client.set(f"job:{name}", str(os.getpid()), nx=True, px=lock_ms):
+                with app.app_context():
+                    func()
+        except Exception as e:
+            logger.error(f"Background job {name} failed: {e}")
+        wakeup.wait(max(interval - (time.monotonic() - started), 0.1))
+
+
+def start_jobs(app: Flask) -> None:
+    global _started_pid
+    pid = os.getpid()
+    if _started_pid == pid:
+        return
+    _started_pid = pid
+    for name, interval, func, exclusive in _jobs:
+        threading.Thread(target=_run_forever, args=(app, name, interval, func, exclusive), name=f"silk-job-{name}", daemon=True).start()
+        logger.verbose("Background job %s scheduled every %ss", name, interval)
@@ -0,0 +1,46 @@
+"""
+Cache for statements of closed months.
+Postings are always booked at NOW(), so once a month has ended its transactions never change.
+The statement is kept in Redis per (account, year, month) as JSON with holder refs
+(type / id / account number) instead of holder names; names can change (user renames), so
+they are resolved from core.holderDirectory every time the statement is served.
+The ETag is a hash of the served body, repeated views and exports cost one Redis lookup (or a 304).
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+from core.coreCache import redis_client
+from core.logger import logger
+
+CACHE_TTL = int(os.getenv("STATEMENT_CACHE_TTL", str(30 * 24 * 3600)))  # refilled on demand after that
+# Postings commit a moment after NOW() was taken, don't cache a month until they are surely visible
+CLOSE_GRACE = timedelta(seconds=int(os.getenv("STATEMENT_CLOSE_GRACE", "300")))
+
+
+def _cache_key(account_id: int, year: int, month: int) -> str:
+    return f"statement:{account_id}:{year}:{month:02d}"
+
+
+def is_closed(end: datetime, now: datetime | None = None) -> bool:
+    return (now or datetime.now()) >= end + CLOSE_GRACE
+
+
+def etag_for(body: str) -> str:
+    return hashlib.sha256(body.encode()).hexdigest()[:32]
+
+
+def get(account_id: int, year: int, month: int) -> str | None:
+    """Returns the cached statement data (JSON, holder refs instead of names) or None."""
+    try:
+        cached = redis_client.get(_cache_key(account_id, year, month))
+    except Exception as e:
+        logger.warning(f"Statement cache lookup failed: {e}")
+        return None
+    return str(cached) if cached is not None else None
+
+
+def put(account_id: int, year: int, month: int, data: str) -> None:
+    try:
+        redis_client.setex(_cache_key(account_id, year, month), CACHE_TTL, data)
+    except Exception as e:
+        logger.warning(f"Statement cache write failed: {e}")
@@ -0,0 +1,139 @@
+"""
+Revocation of issued JWTs (logout, password change, ban).
+- per token: revoked:jti:{jti}, kept until the token would have expired anyway
+- per user: revoked:user:{user_id} = unix time, every token of the user issued before it is dead
+Redis is the source of truth. Every worker keeps a Bloom filter of all revoked jtis / user ids,
+filled from Redis at start and through the "revoked" invalidation topic, so the common case
+(token not revoked) is answered from memory. Only a filter hit (really revoked or a false
+positive, ~1%) asks Redis. While the filter is not known to be complete (before the first load,
+after the pub/sub connection dropped) every check goes to Redis.
+"""
+import hashlib
+import os
+import time
+from typing import Any
+from core.coreCache import redis_client
+from core.eventBus import subscribe, publish
+from core.logger import logger
+from core.scheduler import every, wake
+
+TOKEN_LIFETIME = 30 * 24 * 3600  # create_jwt
+CAPACITY = int(os.getenv("REVOCATION_FILTER_CAPACITY", "100000"))
+RELOAD_INTERVAL = 600  # rebuilt from Redis, drops expired entries and covers lost messages
+
+
+class BloomFilter:
+    """Plain Bloom filter, ~1% false positives at capacity."""
+
+    def __init__(self, capacity: int, hashes: int = 7) -> None:
+        self.size = max(capacity * 10, 1024)  # bits
+        self.hashes = hashes
+        self._bits = bytearray(self.size // 8 + 1)
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+_filter = BloomFilter(CAPACITY)
+_complete = False  # filter holds every revocation in Redis
+_loaded_pid: int | None = None
+_arrived: list[str] | None = None  # set while _load() runs
+
+
+def revoke_token(jti: str, exp: int | float | None = None) -> None:
+    """Revokes one token (logout). exp: the token's own expiry, the entry is useless after it."""
+    ttl = int(exp - time.time()) + 1 if exp else TOKEN_LIFETIME
+    if ttl <= 0:
+        return
+    redis_client.set(f"revoked:jti:{jti}", "1", ex=ttl)
+    publish("revoked", f"jti:{jti}")
+
+
+def revoke_user(user_id: int | str) -> None:
+    """Revokes every token of the user issued before now (password change, ban)."""
+    redis_client.set(f"revoked:user:{user_id}", int(time.time()), ex=TOKEN_LIFETIME)
+    publish("revoked", f"user:{user_id}")
+
+
+def is_revoked(claims: dict[str, Any]) -> bool:
+    _ensure_loaded()
+    jti = claims.get("jti")
+    user_id = claims.get("id")
+    check_jti = jti is not None and (not _complete or f"jti:{jti}" in _filter)
+    check_user = not _complete or f"user:{user_id}" in _filter
+    if not check_jti and not check_user:
+        return False
+
+    keys = [f"revoked:jti:{jti}"] if check_jti else []
+    if check_user:
+        keys.append(f"revoked:user:{user_id}")
+    values = redis_client.mget(keys)
+    if check_jti and values[0] is not None:
+        return True
+    revoked_before = values[-1] if check_user else None
+    # Tokens of the same second as the revocation stay valid, the replacement token is issued right after it
+    return revoked_before is not None and int(claims.get("iat", 0)) < int(revoked_before)
+
+
+def _load() -> None:
+    global _filter, _complete, _arrived
+    fresh = BloomFilter(CAPACITY)
+    count = 0
+    # Revocations published while scanning may be missed by the scan, they are added afterwards
+    _arrived = []
+    try:
+        for key in redis_client.scan_iter(match="revoked:*", count=1000):
+            kind, _, ident = str(key)[len("revoked:"):].partition(":")
+            fresh.add(f"{kind}:{ident}")
+            count += 1
+        for item in _arrived:
+            fresh.add(item)
+    finally:
+        _arrived = None
+    _filter, _complete = fresh, True
+    if count > CAPACITY:
+        logger.warning(f"{count} revoked tokens exceed the filter capacity of {CAPACITY}, more Redis lookups expected")
+    logger.verbose("Revocation filter loaded with %s entries", count)
+
+
+def _ensure_loaded() -> None:
+    global _loaded_pid, _complete
+    pid = os.getpid()
+    if _loaded_pid == pid:
+        return
+    _loaded_pid = pid
+    _complete = False
+    try:
+        _load()
+    except Exception as e:
+        logger.error(f"Failed to load revocation filter, checking Redis until the next reload: {e}")
+
+
+def _on_revoked(key: str | None) -> None:
+    global _complete
+    if key is None:
+        # Missed messages, answer from Redis until the filter is rebuilt
+        _complete = False
+        wake("reload_revocations")
+        return
+    _filter.add(key)
+    if _arrived is not None:
+        _arrived.append(key)
+
+
+@every(RELOAD_INTERVAL, "reload_revocations", exclusive=False)
+def reload_revocations() -> None:
+    _load()
+
+
+subscribe("revoked", _on_revoked)
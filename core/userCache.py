@@ -0,0 +1,93 @@
+"""
+Two-tier cache for the user row require_token validates on every request.
+L1 is a per-worker LocalCache, L2 is Redis; both are dropped through the
+invalidation bus whenever a ban, verification, profile or role change touches the user.
+The Redis entry carries the user's version (authuser:ver:{user_id}, bumped by invalidate_user)
+it was read under, so a request that read the row just before a ban can't put the old row
+back: it is written under the old version and is a miss from then on.
+If Redis is unavailable the row is read from the database.
+"""
+from typing import Any, cast
+import simplejson as json
+from core.coreCache import redis_client, LocalCache
+from core.eventBus import subscribe, publish
+from core.logger import logger
+
+REDIS_TTL = 300  # seconds
+_local = LocalCache(maxsize=4096, ttl=30)
+_generation = 0  # bumped on every invalidation, a fill that overlapped one is not kept
+
+
+def _cache_key(user_id: int | str) -> str:
+    return f"authuser:{user_id}"
+
+
+def _version_key(user_id: int | str) -> str:
+    # No expiry: an entry must never outlive the counter it was written under
+    return f"authuser:ver:{user_id}"
+
+
+def _from_db(user_id: int | str) -> dict[str, Any] | None:
+    from core.database import db_helper
+    with db_helper.cursor() as cur:
+        cur.execute("SELECT id, uuid, role, is_banned, username FROM users WHERE id = %s", (user_id,))
+        # Cast to dict because generic stubs don't know about dictionary=True
+        return cast(dict[str, Any] | None, cur.fetchone())
+
+
+def get_auth_user(user_id: int | str) -> dict[str, Any] | None:
+    """Returns {id, uuid, role, is_banned, username} for the user or None if it does not exist."""
+    key = str(user_id)
+    user = _local.get(key)
+    if user is not None:
+        return user
+
+    generation = _generation
+    try:
+        version, raw = redis_client.mget([_version_key(key), _cache_key(key)])
+    except Exception as e:
+        logger.warning(f"Cached user lookup failed, reading {key} from the database: {e}")
+        return _from_db(user_id)
+    version = version or "0"
+    if raw is not None:
+        stored_version, _, body = cast(str, raw).partition("\n")
+        if stored_version == version:
+            user = cast(dict[str, Any], json.loads(body))
+    if user is None:
+        user = _from_db(user_id)
+        if not user:
+            return None
+        try:
+            redis_client.setex(_cache_key(key), REDIS_TTL, f"{version}\n{json.dumps(user)}")
+        except Exception as e:
+            logger.warning(f"Failed to cache user {key}: {e}")
+
+    if generation != _generation:
+        # Invalidated while we were reading, the row may predate it
+        return user
+    _local.set(key, user)
+    return user
+
+
+def invalidate_user(user_id: int | str) -> None:
+    """Call after any write to a user's id/uuid/role/is_banned/username."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incr(_version_key(user_id))
+        pipe.delete(_cache_key(user_id))
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Failed to drop cached user {user_id}: {e}")
+    publish("user", user_id)
+
+
+def _on_invalidate(key: str | None) -> None:
+    global _generation
+    _generation += 1
+    if key is None:
+        _local.clear()
+    else:
+        _local.pop(key)
+
+
+subscribe("user", _on_invalidate)
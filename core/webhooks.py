@@ -0,0 +1,188 @@
+"""
+Durable webhook delivery.
+enqueue() writes the payload to webhook_outbox inside the caller's DB transaction, so a
+committed payment always has its webhook and a rolled back one never does. Every worker
+drains the outbox in the background:
+- rows are claimed with FOR UPDATE SKIP LOCKED and leased, workers never send the same row twice
+- one pooled requests.Session per worker, at most PER_HOST requests in flight per host
+- Discord rate limits (429 + Retry-After, X-RateLimit-Remaining/Reset-After) pause that webhook,
+  global ones (X-RateLimit-Global) the whole host
+- failures are retried with exponential backoff until MAX_ATTEMPTS, then marked failed
+"""
+import math
+import os
+import random
+import time
+from typing import Any, cast
+from urllib.parse import urlsplit
+import requests
+import simplejson as json
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+from requests.adapters import HTTPAdapter
+from core.logger import logger
+from core.scheduler import every, wake
+
+POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))
+BATCH = int(os.getenv("WEBHOOK_BATCH", "50"))
+CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "20"))
+PER_HOST = int(os.getenv("WEBHOOK_PER_HOST", "4"))
+TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "5"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = 5.0  # seconds, doubled per attempt
+BACKOFF_MAX = 3600.0
+# Seconds a claimed row is hidden from other workers: a whole batch queued on one host
+# (ceil(BATCH / PER_HOST) rounds of TIMEOUT) plus time to record the results
+LEASE = int(math.ceil(BATCH / PER_HOST) * TIMEOUT) + 30
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_host_slots: dict[str, BoundedSemaphore] = {}
+# Rate limit pauses, keyed by webhook (host + path) or by host for global limits
+_blocked_until: dict[str, float] = {}
+
+
+def enqueue(cur: Any, url: str, payload: dict[str, Any]) -> None:
+    """Adds a webhook to the outbox. Caller owns the transaction, call kick() after commit."""
+    cur.execute(
+        "INSERT INTO webhook_outbox (url, payload) VALUES (%s, %s)",
+        (url, json.dumps(payload)),
+    )
+
+
+def kick() -> None:
+    """Lets this worker deliver fresh rows now instead of at the next poll."""
+    wake("deliver_webhooks")
+
+
+def _get_session() -> requests.Session:
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=CONCURRENCY)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session_pid = pid
+    return _session
+
+
+def _host_slot(host: str) -> BoundedSemaphore:
+    slot = _host_slots.get(host)
+    if slot is None:
+        slot = _host_slots[host] = BoundedSemaphore(PER_HOST)
+    return slot
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_BASE * (2 ** (attempts - 1)), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _header_seconds(response: requests.Response, name: str) -> float | None:
+    value = response.headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _send(row: dict[str, Any]) -> tuple[str, float, str | None]:
+    """Delivers one row. Returns (outcome, retry_in_seconds, error) with outcome delivered|retry|throttled."""
+    parts = urlsplit(row["url"])
+    host = parts.netloc
+    webhook = parts.netloc + parts.path
+    blocked = max(_blocked_until.get(host, 0), _blocked_until.get(webhook, 0)) - time.monotonic()
+    if blocked > 0:
+        return "throttled", blocked, None
+
+    with _host_slot(host):
+        try:
+            response = _get_session().post(
+                row["url"],
+                data=row["payload"],
+                headers={"Content-Type": "application/json"},
+                timeout=TIMEOUT,
+            )
+        except requests.RequestException as e:
+            return "retry", _backoff(int(row["attempts"]) + 1), str(e)[:500]
+
+    if response.status_code == 429:
+        retry_after = _header_seconds(response, "Retry-After") or _backoff(1)
+        scope = host if response.headers.get("X-RateLimit-Global") else webhook
+        _blocked_until[scope] = time.monotonic() + retry_after
+        return "throttled", retry_after, "429 Too Many Requests"
+    if _header_seconds(response, "X-RateLimit-Remaining") == 0:
+        reset_after = _header_seconds(response, "X-RateLimit-Reset-After")
+        if reset_after:
+            _blocked_until[webhook] = time.monotonic() + reset_after
+    if 200 <= response.status_code < 300:
+        return "delivered", 0, None
+    return "retry", _backoff(int(row["attempts"]) + 1), f"HTTP {response.status_code}"
+
+
+def _claim(db_helper: Any) -> list[dict[str, Any]]:
+    with db_helper.transaction() as db:
+        cur = db.cursor(dictionary=True)
+        try:
+            cur.execute(f"""
+                SELECT id, url, payload, attempts
+                FROM webhook_outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at, id
+                LIMIT {BATCH}
+                FOR UPDATE SKIP LOCKED
+            """)
+            rows = cast(list[dict[str, Any]], cur.fetchall())
+            if rows:
+                placeholders = ", ".join(["%s"] * len(rows))
+                # Lease the rows, a crashed worker's rows come back after LEASE seconds
+                cur.execute(
+                    f"UPDATE webhook_outbox SET next_attempt_at = NOW() + INTERVAL {LEASE} SECOND WHERE id IN ({placeholders})",
+                    tuple(r["id"] for r in rows),
+                )
+        finally:
+            cur.close()
+    return rows
+
+
+def _record(cur: Any, row: dict[str, Any], outcome: str, retry_in: float, error: str | None) -> None:
+    if outcome == "delivered":
+        cur.execute(
+            "UPDATE webhook_outbox SET status = 'delivered', attempts = attempts + 1, delivered_at = NOW(), last_error = NULL WHERE id = %s",
+            (row["id"],),
+        )
+    elif outcome == "throttled":
+        # Waiting for a rate limit window is not the endpoint's fault, doesn't use up an attempt
+        cur.execute(
+            "UPDATE webhook_outbox SET next_attempt_at = NOW() + INTERVAL %s SECOND, last_error = COALESCE(%s, last_error) WHERE id = %s",
+            (int(retry_in) + 1, error, row["id"]),
+        )
+    elif int(row["attempts"]) + 1 >= MAX_ATTEMPTS:
+        cur.execute(
+            "UPDATE webhook_outbox SET status = 'failed', attempts = attempts + 1, last_error = %s WHERE id = %s",
+            (error, row["id"]),
+        )
+        logger.error(f"Webhook {row['id']} failed permanently after {MAX_ATTEMPTS} attempts: {error}")
+    else:
+        cur.execute(
+            "UPDATE webhook_outbox SET attempts = attempts + 1, next_attempt_at = NOW() + INTERVAL %s SECOND, last_error = %s WHERE id = %s",
+            (int(retry_in) + 1, error, row["id"]),
+        )
+
+
+@every(POLL_INTERVAL, name="deliver_webhooks", exclusive=False)
+def deliver_webhooks() -> None:
+    from core.database import db_helper
+    while True:
+        rows = _claim(db_helper)
+        if not rows:
+            return
+        results = Pool(CONCURRENCY).map(_send, rows)
+        with db_helper.cursor() as cur:
+            for row, (outcome, retry_in, error) in zip(rows, results):
+                _record(cur, row, outcome, retry_in, error)
+        delivered = sum(1 for outcome, _, _ in results if outcome == "delivered")
+        logger.verbose("Webhooks: %s of %s delivered", delivered, len(rows))
+        if len(rows) < BATCH:
+            return
@@ -16,6 +16,12 @@ max_requests = 1000
 max_requests_jitter = 50
 
 def worker_exit(server, worker):  # pyright: ignore[]
+    try:
+        # os._exit skips atexit, write out the buffered log lines first
+        from core.logger import logger
+        logger.flush()
+    except Exception:
+        pass
     try:
         os._exit(0)
     except:
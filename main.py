@@ -25,6 +25,8 @@ except FileNotFoundError:
 
 # Set Logger Mode with help of the config
 logger.set_mode(str(config.get_str("environment", "log_level")))
+# Buffered logging moves formatting and terminal writes off the request path
+logger.set_buffered(bool(config.get("environment", "log_buffered", default=False)))
 
 # Load dotenv with config or default (.env)
 env = config.get("environment", "env_file")
@@ -35,6 +37,8 @@ from core.database import db_helper
 #Create the flask app and start the database
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+# Return pooled DB connections after every request (gunicorn workers too, not just the dev server)
+app.teardown_appcontext(db_helper.close_db)
 # Set CORS
 from flask_cors import CORS
 CORS(app, origins=["https://brickrigs.de"], supports_credentials=True)
@@ -46,8 +50,10 @@ register_blueprints(app)
 # Initialize Rate Limiter
 from core.limiter import init_limiter
 init_limiter(app)
+# Start periodic background jobs (registered by the core modules the blueprints import)
+from core.scheduler import start_jobs
+start_jobs(app)
 
 logger.info("App started!")
 if __name__ == "__main__":
-    app.teardown_appcontext(db_helper.close_db)
     app.run(host="0.0.0.0", port=1236, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,19 @@
+-- gift_codes: source + parked_at, and backfill of the source of existing codes.
+-- Run once, BEFORE setting EXPIRY_REFUND_GIFTCODES=1 (the sweeper refunds no gift codes until then).
+-- Idempotent, safe to run again.
+
+ALTER TABLE `gift_codes`
+  ADD COLUMN IF NOT EXISTS `source` enum('account','system') NOT NULL DEFAULT 'account' AFTER `is_active`,
+  ADD COLUMN IF NOT EXISTS `parked_at` datetime DEFAULT NULL AFTER `source`;
+
+-- Codes issued before the column existed all got 'account'. System cards (admin issued) are the
+-- ones that were never paid for: no 'giftcard' debit of created_by for this code.
+UPDATE `gift_codes` g
+SET g.`source` = 'system'
+WHERE g.`source` = 'account'
+  AND NOT EXISTS (
+    SELECT 1 FROM `transactions` t
+    WHERE t.`transaction_type` = 'giftcard'
+      AND t.`from_account_id` = g.`created_by`
+      AND t.`description` = CONCAT('Code: ', g.`code`)
+  );
@@ -2,22 +2,28 @@ from flask import Blueprint, jsonify, request
 from core.coreAuthUtil import require_token, hash_pin
 from core.database import db_helper
 from core.logger import logger
+from core.limiter import limiter
 from typing import  Any, cast
 import os
 from core.coreRandUtil import generate_account_number
+from core.hotAccounts import apply_pending, balance_of
+from core.holderDirectory import resolve as resolve_holders, resolve_one as resolve_holder
+from core.accountDirectory import lookup as lookup_account, lookup_many as lookup_accounts, invalidate as invalidate_account
 
 
 bp = Blueprint("accounting", __name__, url_prefix="/api/bank")
+PUBLIC_BATCH_LIMIT = 250
 
 
 @bp.route("/accounts", methods=["GET"])
 @require_token
 def get_user_accounts(data):
     user_id = data["id"]
-    logger.verbose(f"Retrieving bank accounts of {user_id}...")
+    logger.verbose("Retrieving bank accounts of %s...", user_id)
     with db_helper.cursor() as cur:
         cur.execute("SELECT * FROM bank_accounts WHERE account_holder_id  = %s and account_holder_type = 'user'", (user_id,))
         rows = cur.fetchall()
+        apply_pending(cur, cast(list[dict[str, Any]], rows))
         # The cursor already returns dict-like rows, so `dict(row)` is not needed.
         return jsonify({"accounts": rows})
 
@@ -25,7 +31,7 @@ def get_user_accounts(data):
 @require_token
 def create_user_accounts(data):
     user_id = data["id"]
-    logger.verbose(f"Creating bank accounts for {user_id}...")
+    logger.verbose("Creating bank accounts for %s...", user_id)
     with db_helper.cursor() as cur:
         cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
         row = cur.fetchone()
@@ -59,10 +65,11 @@ def create_user_accounts(data):
                 return {"error": "Maximum account limit reached, contact support to create additional accounts."}, 400
             
             cur.execute("INSERT INTO bank_accounts (account_number, account_holder_type, account_holder_id) VALUES (%s, %s, %s)", (accnum, 'user', user_id,))
+            invalidate_account(int(cur.lastrowid))
         except Exception as e:
             logger.error(str(e))
             return jsonify({"error": "Failed to create bank account"}), 500
-    logger.verbose(f"Bank Account created for {user_id}; {accnum}")
+    logger.verbose("Bank Account created for %s; %s", user_id, accnum)
     return jsonify({"account_number": accnum}), 201
 
 @bp.route("/accounts/<uuid:account_uuid>", methods=["GET"])
@@ -70,7 +77,7 @@ def create_user_accounts(data):
 def retrieve_acc_details(data, account_uuid):
     user_id = data["id"]
     account_uuid = str(account_uuid)
-    logger.verbose(f"Retrieving bank account {account_uuid}...")
+    logger.verbose("Retrieving bank account %s...", account_uuid)
     with db_helper.cursor() as cur:
         cur.execute("SELECT * FROM bank_accounts WHERE uuid = %s", (account_uuid,))
         row = cur.fetchone()
@@ -79,6 +86,7 @@ def retrieve_acc_details(data, account_uuid):
         account = cast(dict[str, Any], row)
         if int(account["account_holder_id"]) != user_id:
             return jsonify({"error": "Account not found"}), 404
+        apply_pending(cur, [account])
         return jsonify({
             "balance": account["balance"],
             "account_number": account["account_number"],
@@ -98,67 +106,55 @@ def update_acc_details(data, account_uuid):
     if freeze:
         if freeze is not isinstance(freeze, bool):
             return jsonify({"error": "Invalid JSON"}), 400
-        logger.verbose(f"Updating bank account {account_uuid}...")
+        logger.verbose("Updating bank account %s...", account_uuid)
+        account = lookup_account(account_uuid)
+        if not account:
+            return jsonify({"error": "Account not found"}), 404
+        if int(account["account_holder_id"]) != int(user_id):
+            return jsonify({"error": "Account not found"}), 404
         with db_helper.cursor() as cur:
-            cur.execute("SELECT * FROM bank_accounts WHERE uuid = %s", (account_uuid,))
-            row = cur.fetchone()
-            if not row:
-                return jsonify({"error": "Account not found"}), 404
-            account = cast(dict[str, Any], row)
-            if account["account_holder_id"] != user_id:
-                return jsonify({"error": "Account not found"}), 404
             cur.execute("UPDATE bank_accounts SET is_frozen = %s WHERE uuid = %s", (freeze, account_uuid))
+        invalidate_account(account["id"])
         return jsonify({"success": True, "message": "Account updated"})
     pin = str(req.get("pin"))
     if len(pin) not in [4, 5, 6]:
         return jsonify({"error": "Invalid JSON"}), 400
     pin = hash_pin(pin, account_uuid)
     if pin:
-        logger.verbose(f"Updating Pin for account {account_uuid}...")
+        logger.verbose("Updating Pin for account %s...", account_uuid)
+        account = lookup_account(account_uuid)
+        if not account:
+            return jsonify({"error": "Account not found"}), 404
+        if int(account["account_holder_id"]) != int(user_id):
+            return jsonify({"error": "Account not found"}), 404
+        if str(account["account_holder_type"]) != "user":
+            logger.verbose("Invalid Account Type. Non Personal Account attempting Pin Change")
+            return jsonify({"error": "Account not found"}), 404
         with db_helper.cursor() as cur:
-            cur.execute("SELECT * FROM bank_accounts WHERE uuid = %s", (account_uuid,))
-            row = cur.fetchone()
-            if not row:
-                return jsonify({"error": "Account not found"}), 404
-            account = cast(dict[str, Any], row)
-            if int(account["account_holder_id"]) != int(user_id):
-                return jsonify({"error": "Account not found"}), 404
-            if str(account["account_holder_type"]) != "user":
-                logger.verbose("Invalid Account Type. Non Personal Account attempting Pin Change")
-                return jsonify({"error": "Account not found"}), 404
             cur.execute("UPDATE bank_accounts SET pin_hash = %s WHERE uuid = %s", (pin, account_uuid))
         return jsonify({"success": True, "message": "Account updated"})
     else:
         return jsonify({"error": "Invalid JSON"}), 400
 
+def _holder_ref(account: dict[str, Any]) -> tuple[str, str, str]:
+    return account["account_holder_type"], account["account_holder_id"], account["account_number"]
+
+def _holder_name(account: dict[str, Any], cur: Any = None) -> str:
+    return resolve_holder(*_holder_ref(account), cur=cur)
+
 # Public Acc lookup
 @bp.route("/public/<uuid:account_uuid>", methods=["GET"])
 def lookup_uuid(account_uuid):
     account_uuid = str(account_uuid)
-    logger.verbose(f"Retrieving public info from {account_uuid}...")
+    logger.verbose("Retrieving public info from %s...", account_uuid)
+    account = lookup_account(account_uuid)
+    if not account or account["is_frozen"]:
+        return jsonify({"error": "Account not found"}), 404
     with db_helper.cursor() as cur:
-        cur.execute("SELECT balance, id, is_frozen, account_number, account_holder_id, account_holder_type FROM bank_accounts WHERE uuid = %s", (account_uuid,))
-        row = cur.fetchone()
-        account = cast(dict[str, Any], row)
-        if not row or account["is_frozen"]:
-            return jsonify({"error": "Account not found"}), 404
         account_number = account["account_number"]
-        balance = account["balance"]
-        holder = account["account_holder_id"]
+        balance = balance_of(cur, account["id"])
+        holder = _holder_name(account, cur)
         acc_id = account["id"]
-        acctype = str(account["account_holder_type"])
-        if acctype == "user":
-            cur.execute("SELECT username FROM users WHERE id = %s",(holder,))
-            row = cur.fetchone()
-            if not row:
-                return jsonify({"error": "Account not found"}), 404 
-            user = cast(dict[str, Any], row)
-            holder = str(user["username"])
-        elif acctype == "company":
-            # to be implemented
-            holder = "Unknown Company"
-        else:
-            holder = "Unknown Company"
     return jsonify({
         "account_number": account_number,
         "balance": balance,
@@ -168,71 +164,58 @@ def lookup_uuid(account_uuid):
 
 @bp.route("/public/<int:acc_id>", methods=["GET"])
 def lookup_id(acc_id: int):
+    account = lookup_account(acc_id)
+    if not account or account["is_deleted"]:
+        return {"error": "Account not found"}, 404
+    return {"account_number": account["account_number"], "holder": _holder_name(account)}, 200
+        
+@bp.route("/public/batch", methods=["POST"])
+@limiter.limit("10 per minute")  # up to PUBLIC_BATCH_LIMIT accounts each, keep enumeration expensive
+def lookup_batch():
+    """
+    Resolves up to PUBLIC_BATCH_LIMIT mixed ids / uuids / account numbers in one call.
+    Same fields as /public/<id>, plus id and uuid. Unknown, deleted or frozen accounts are listed in "not_found".
+    """
+    req = request.get_json(silent=True)
+    identifiers = req.get("accounts") if isinstance(req, dict) else None
+    if not isinstance(identifiers, list) or not identifiers:
+        return jsonify({"error": "Missing required fields"}), 400
+    if len(identifiers) > PUBLIC_BATCH_LIMIT:
+        return jsonify({"error": f"At most {PUBLIC_BATCH_LIMIT} accounts per request"}), 400
+    identifiers = list(dict.fromkeys(str(i) for i in identifiers))
+
     with db_helper.cursor() as cur:
-        cur.execute("""
-            SELECT 
-                b.account_number,
-                CASE
-                    WHEN b.account_holder_type = 'user' THEN u.username
-                    WHEN b.account_holder_type = 'gov' THEN 'Gov Entity'
-                    WHEN b.account_holder_type = 'company' THEN 'Company'
-                    ELSE 'Unknown'
-                END AS holder
-            FROM bank_accounts b
-            LEFT JOIN users u
-                ON b.account_holder_type = 'user'
-                AND u.id = CAST(b.account_holder_id AS UNSIGNED)
-            WHERE b.id = %s
-              AND b.is_deleted = 0
-            LIMIT 1
-        """, (acc_id,))
+        # Directory first, one IN query per identifier kind for the misses
+        found = {ident: acc for ident, acc in lookup_accounts(identifiers, cur).items()
+                 if not acc["is_deleted"] and not acc["is_frozen"]}
+        # ... and one users query for the uncached holder names
+        names = resolve_holders([_holder_ref(acc) for acc in found.values()], cur)
+
+    accounts = {}
+    for ident, acc in found.items():
+        holder = names[_holder_ref(acc)]
+        accounts[ident] = {
+            "id": acc["id"],
+            "uuid": acc["uuid"],
+            "account_number": acc["account_number"],
+            "holder": holder,
+        }
+    return jsonify({
+        "accounts": accounts,
+        "not_found": [ident for ident in identifiers if ident not in accounts],
+    }), 200
 
-        row = cur.fetchone()
-        if not row:
-            return {"error": "Account not found"}, 404
-    result = cast(dict[str, Any], row)
-    return result, 200
-        
 @bp.route("/public/<string:accnum>", methods=["GET"])
 def lookup_accnum(accnum: str):
+    account = lookup_account(accnum)
+    if not account or account["is_frozen"]:
+        return jsonify({"error": "Account not found"}), 404
+    logger.verbose("Retrieving public info from %s...", account['uuid'])
     with db_helper.cursor() as cur:
-        cur.execute("SELECT balance, id, is_frozen, uuid, account_holder_id, account_holder_type FROM bank_accounts WHERE account_number  = %s", (accnum,))
-        row = cur.fetchone()
-        account = cast(dict[str, Any], row)
-        if not row or account["is_frozen"]:
-            return jsonify({"error": "Account not found"}), 404
-        logger.verbose(f"Retrieving public info from {account['uuid']}...")
         account_uuid = account["uuid"]
-        balance = account["balance"]
+        balance = balance_of(cur, account["id"])
         acc_id = account["id"]
-        holder = account["account_holder_id"]
-        acctype = str(account["account_holder_type"])
-        match acctype:
-            case "user":
-                cur.execute("SELECT username FROM users WHERE id = %s",(holder,))
-                row = cur.fetchone()
-                if not row:
-                    return jsonify({"error": "Account not found"}), 404 
-                user = cast(dict[str, Any], row)
-                holder = str(user["username"])
-            case "company":
-                # to be implemented
-                holder = "Unknown Company"
-            case "gov":
-                holder = "Regierung"
-                match accnum:
-                    case "G-10091a4":
-                        holder = "Allgemeine Staatskasse"
-                    case "G-4003854":
-                        holder = "Andere"
-                    case "G-3006707":
-                        holder = "Strafgelder"
-                    case "G-200a869":
-                        holder = "Steuern"
-                    case _:
-                        pass
-            case _:
-                holder = "Unknown Company"
+        holder = _holder_name(account, cur)
     return jsonify({
         "account_uuid": account_uuid,
         "balance": balance,
@@ -2,6 +2,7 @@
 
 from flask import Blueprint, redirect, request, jsonify, make_response, Response
 from core.coreAuthUtil import hash_password, check_password, create_jwt, require_token
+from core.tokenRevocation import revoke_token, revoke_user
 from core.database import db_helper
 from core.logger import logger
 from typing import cast, Any
@@ -38,7 +39,7 @@ def register():
             VALUES (UUID(), %s, %s, %s, NOW(), TRUE)
         """, (username, email, hash_password(password)))
     
-    logger.verbose(f"User sucessfully registered! {username}")
+    logger.verbose("User sucessfully registered! %s", username)
     return jsonify({"success": True, "message": "Registered successfully!"}), 201
 
 # Manual Authentication
@@ -59,11 +60,11 @@ def login():
             return jsonify({"error": "Invalid credentials"}), 401
 
         if user.get("is_banned"):
-            logger.verbose(f"Login failed: User {user['id']} is banned; 403")
+            logger.verbose("Login failed: User %s is banned; 403", user['id'])
             return jsonify({"error": "This account has been banned"}), 403
 
         if user["password_hash"] is None:
-            logger.verbose(f"Login failed: User {user['id']} has no password set; 401")
+            logger.verbose("Login failed: User %s has no password set; 401", user['id'])
             return jsonify({"error": "Invalid credentials"}), 401
 
         if not check_password(password, user["password_hash"]):
@@ -177,7 +178,7 @@ def discord_callback():
     username = discord_user["username"]
     internal_user_id: int
     if email == None:
-        logger.verbose(f"{username} did not grand email permission, callback denied.")
+        logger.verbose("%s did not grand email permission, callback denied.", username)
         return redirect(BASE_URL + "/login?err=400")
     with db_helper.cursor() as cur:
         cur.execute("SELECT id, is_banned FROM users WHERE discord_id = %s", (discord_id,))
@@ -203,7 +204,7 @@ def discord_callback():
                     return redirect(BASE_URL + "/login?err=403")
                 internal_user_id = int(existing_user["id"])
                 cur.execute("UPDATE users SET discord_id = %s WHERE id = %s", (discord_id, internal_user_id,))
-                logger.verbose(f"Linked existing email {email} to new discord_id {discord_id}")
+                logger.verbose("Linked existing email %s to new discord_id %s", email, discord_id)
             else:
                 cur.execute("""
                     INSERT INTO users (uuid, username, email, discord_id, manual)
@@ -218,7 +219,7 @@ def discord_callback():
 
     # Issue JWT
     token = create_jwt(internal_user_id)
-    logger.verbose(f"Discord user {discord_id} authenticated as internal user {internal_user_id}")
+    logger.verbose("Discord user %s authenticated as internal user %s", discord_id, internal_user_id)
     return redirect(BASE_URL + "/dashboard" f"?token={token}")
 
 @bp.route("/change-password", methods=["POST"])
@@ -258,5 +259,22 @@ def change_password(data):
             "UPDATE users SET password_hash = %s WHERE id = %s",
             (hash_password(new_password), user_id)
         )
-    logger.verbose(f"Password updated for user {user_id}")
-    return jsonify({"success": True, "message": "Password updated"})    
\ No newline at end of file
+    # Every older session (incl. this token) ends here, the caller continues with the new token
+    revoke_user(user_id)
+    if data.get("jti"):
+        revoke_token(data["jti"], data.get("exp"))
+    token = create_jwt(user_id)
+    logger.verbose("Password updated for user %s", user_id)
+    return jsonify({"success": True, "message": "Password updated", "token": token})
+
+@bp.route("/logout", methods=["POST"])
+@require_token
+def logout(data):
+    user_id = data["id"]
+    if data.get("jti"):
+        revoke_token(data["jti"], data.get("exp"))
+    else:
+        # Tokens issued before jti existed can only be revoked all at once
+        revoke_user(user_id)
+    logger.verbose("User %s logged out", user_id)
+    return jsonify({"success": True, "message": "Logged out"})    
\ No newline at end of file
@@ -1,6 +1,7 @@
 from flask import Blueprint, redirect, request, jsonify
 from core.coreAuthUtil import require_token
 from core.database import db_helper
+from core.userCache import invalidate_user
 from core.logger import logger
 from typing import cast, Any
 import os
@@ -20,7 +21,7 @@ def me(data):
             logger.verbose("User not found; 404")
             return jsonify({"error": "User not found"}), 404
         user = cast(dict[str, Any], row)
-        logger.verbose(f"Information retrieved from {user_id}")
+        logger.verbose("Information retrieved from %s", user_id)
         return jsonify({
             "uuid": user["uuid"],
             "username": user["username"],
@@ -38,7 +39,7 @@ def update_me(data):
     req = request.get_json()
     if not isinstance(req, dict):
         return jsonify({"error": "Invalid JSON"}), 400
-    logger.verbose(f"Profile being updated of {user_id}...")
+    logger.verbose("Profile being updated of %s...", user_id)
     updates = []
     params = []
 
@@ -70,7 +71,8 @@ def update_me(data):
 
     with db_helper.cursor() as cur:
         cur.execute(query, params)
-    logger.verbose(f"Profile updated for user {user_id}")
+    invalidate_user(user_id)
+    logger.verbose("Profile updated for user %s", user_id)
     return jsonify({"success": True, "message": "Profile updated"})
 
 
@@ -90,7 +92,7 @@ def public_profile(user_uuid):
         if not row:
             return jsonify({"error": "User not found"}), 404
         user = cast(dict[str, Any], row)
-        logger.verbose(f"user {user['username']} requested from {ip}")
+        logger.verbose("user %s requested from %s", user['username'], ip)
         return jsonify({
             "uuid": str(user_uuid),
             "id": user["id"],
@@ -109,7 +111,7 @@ def public_profile_id(userid):
         if not row:
             return jsonify({"error": "User not found"}), 404
         user = cast(dict[str, Any], row)
-        logger.verbose(f"user {user['username']} requested from {ip}")
+        logger.verbose("user %s requested from %s", user['username'], ip)
         return jsonify({
             "uuid": str(user["uuid"]),
             "username": user["username"],
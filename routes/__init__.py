@@ -15,7 +15,7 @@ def register_blueprints(app: Flask) -> None:
         bp = getattr(module, "bp", None)
         if isinstance(bp, Blueprint):
             app.register_blueprint(bp)
-            logger.verbose(f"Registered blueprint: {module_name}")
+            logger.verbose("Registered blueprint: %s", module_name)
 
 def initStatus():
     try:
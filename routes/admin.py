@@ -2,6 +2,8 @@
 from flask import Blueprint, jsonify, request
 from core.coreAuthUtil import require_token, require_role
 from core.database import db_helper
+from core.ledger import Leg, LedgerError, lock_accounts, post_legs, run as ledger_run
+from core.hotAccounts import effective_balances
 from core.logger import logger
 from typing import Any, cast
 import secrets
@@ -10,6 +12,11 @@ import simplejson as json
 from whenever import Instant, hours
 from decimal import Decimal
 from core.limiter import limiter
+from core.userCache import invalidate_user
+from core.tokenRevocation import revoke_user
+from core import payroll, hashPool
+from core.permissionIndex import refresh as refresh_permission_index
+from core.permissionCache import invalidate_uuid as invalidate_permissions
 
 bp = Blueprint("admin", __name__, url_prefix="/api/admin")
 
@@ -53,11 +60,11 @@ def create_system_giftcard(data):
              # But we DONT deduct money from them.
              cur.execute("""
                 INSERT INTO gift_codes (
-                    code, amount, created_by, expires_at, is_active
-                ) VALUES (%s, %s, %s, %s, 1)
+                    code, amount, created_by, expires_at, is_active, source
+                ) VALUES (%s, %s, %s, %s, 1, 'system')
              """, (code, amount, admin_id, expires_at))
              
-             logger.verbose(f"Admin/Mod {admin_id} created system giftcard {code} worth {amount}")
+             logger.verbose("Admin/Mod %s created system giftcard %s worth %s", admin_id, code, amount)
              
         except Exception as e:
             logger.error(f"Failed to create system giftcard: {e}")
@@ -120,8 +127,9 @@ def assign_user_job(data, user_uuid):
              
         # Assign
         cur.execute("INSERT INTO user_jobs (user_uuid, job_id) VALUES (%s, %s)", (user_uuid, job_id))
+        invalidate_permissions(cur, str(user_uuid))
         
-    logger.verbose(f"Mod {data['id']} assigned job {job_id} to user {user_uuid}")
+    logger.verbose("Mod %s assigned job %s to user %s", data['id'], job_id, user_uuid)
     return jsonify({"success": True, "message": "Job assigned"}), 201
 
 
@@ -133,8 +141,9 @@ def remove_user_job(data, user_uuid, job_id):
         cur.execute("DELETE FROM user_jobs WHERE user_uuid = %s AND job_id = %s", (user_uuid, job_id))
         if cur.rowcount == 0:
              return jsonify({"error": "Job assignment not found"}), 404
+        invalidate_permissions(cur, str(user_uuid))
              
-    logger.verbose(f"Mod {data['id']} removed job {job_id} from user {user_uuid}")
+    logger.verbose("Mod %s removed job %s from user %s", data['id'], job_id, user_uuid)
     return jsonify({"success": True, "message": "Job removed"}), 200
 
 # --- ADMIN ROUTES (Balance, Data Mangement) ---
@@ -164,48 +173,84 @@ def adjust_balance(data, user_id):
         
     reason = req.get("reason", "Admin Adjustment")
 
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
+    if amount == 0:
+        return jsonify({"error": "Invalid amount"}), 400
+
+    def post(cur):
+        # Find target account
+        query = "SELECT id FROM bank_accounts WHERE account_holder_id = %s"
+        params = [user_id]
+        
+        if account_uuid:
+            query += " AND uuid = %s"
+            params.append(account_uuid)
+        
+        query += " LIMIT 1"
+        
+        cur.execute(query, tuple(params))
+        account = cur.fetchone()
+        
+        if not account:
+            return jsonify({"error": "User has no bank account"}), 404
+        acc_id = cast(dict[str, Any], account)["id"]
+
+        # Deposits credit the account, withdrawals debit it (ledger amounts are always positive)
+        if amount > 0:
+            leg = Leg("adjustment", amount, to_account_id=acc_id, description=reason, metadata={"admin_id": admin_id})
+        else:
+            leg = Leg("adjustment", -amount, from_account_id=acc_id, description=reason, metadata={"admin_id": admin_id})
+
+        locked = lock_accounts(cur, [acc_id])
         try:
-            # Find target account
-            query = "SELECT id, balance FROM bank_accounts WHERE account_holder_id = %s"
-            params = [user_id]
-            
-            if account_uuid:
-                query += " AND uuid = %s"
-                params.append(account_uuid)
-            
-            query += " LIMIT 1 FOR UPDATE"
-            
-            cur.execute(query, tuple(params))
-            account = cur.fetchone()
-            
-            if not account:
-                return jsonify({"error": "User has no bank account"}), 404
-            account = cast(dict[str, Any], account)
-            acc_id = account["id"]
-            new_balance = Decimal(str(account["balance"])) + amount
-            
-            if new_balance < 0:
-                 return jsonify({"error": "Insufficient funds for deduction"}), 400
+            post_legs(cur, [leg], locked=locked, allow_frozen=True)
+        except LedgerError as e:
+            if e.reason == "insufficient":
+                return jsonify({"error": "Insufficient funds for deduction"}), 400
+            return jsonify({"error": "User has no bank account"}), 404
+        
+        logger.verbose("Admin %s adjusted balance for user %s by %s", admin_id, user_id, amount)
+        return {"new_balance": effective_balances(cur, [acc_id]).get(acc_id, locked[acc_id]["balance"])}
 
-            # Update Balance
-            cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE id = %s", (amount, acc_id))
-            
-            # Log Transaction
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_type, to_account_id, amount, confirmed, description, metadata, created_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, NOW())
-            """, ('admin_adj', acc_id, amount, 1, reason, json.dumps({"admin_id": admin_id})))
-            
-            logger.verbose(f"Admin {admin_id} adjusted balance for user {user_id} by {amount}")
-            
-        except Exception as e:
-            logger.error(f"Balance adjustment failed: {e}")
-            raise e
+    try:
+        result = ledger_run(post)
+    except Exception as e:
+        logger.error(f"Balance adjustment failed: {e}")
+        raise e
+    if not isinstance(result, dict):
+        return result
             
-    return jsonify({"success": True, "new_balance": new_balance}), 200
+    return jsonify({"success": True, "new_balance": result["new_balance"]}), 200
+
+
+@bp.route("/payroll", methods=["POST"])
+@require_role("admin")
+def start_payroll(data):
+    """
+    Queues a payroll run paying every eligible user's daily salary (see core/payroll.py).
+    Only one run at a time, a second request gets the running one back.
+    """
+    run_id, created = payroll.request_run(f"admin:{data['id']}")
+    if not created:
+        return jsonify({"error": "A payroll run is already in progress", "run_id": run_id}), 409
+    logger.verbose("Admin %s started payroll run %s", data["id"], run_id)
+    return jsonify({"success": True, "run_id": run_id}), 202
+
+
+@bp.route("/payroll/<string:run_id>", methods=["GET"])
+@require_role("admin")
+def payroll_status(data, run_id):
+    """Progress / result of a payroll run."""
+    run = payroll.status(run_id)
+    if run is None:
+        return jsonify({"error": "Payroll run not found"}), 404
+    return jsonify({"run_id": run_id, **run}), 200
+
+
+@bp.route("/status/pools", methods=["GET"])
+@require_role("admin")
+def pool_status(data):
+    """Internals of the DB connection pool and the bcrypt thread pool of this worker."""
+    return jsonify({"db_pool": db_helper.pool_stats(), "hash_pool": hashPool.stats()}), 200
 
 
 @bp.route("/users/<int:user_id>", methods=["DELETE"])
@@ -227,8 +272,9 @@ def delete_user(data, user_id):
         cur.execute("UPDATE users SET is_banned = 1 WHERE id = %s", (user_id,))
         if cur.rowcount == 0:
              return jsonify({"error": "User not found"}), 404
-             
-    logger.verbose(f"Admin {admin_id} banned user {user_id}")
+    invalidate_user(user_id)
+    revoke_user(user_id)
+    logger.verbose("Admin %s banned user %s", admin_id, user_id)
     return jsonify({"success": True, "message": "User banned"}), 200
 
 @bp.route("/jobs", methods=["GET"])
@@ -260,8 +306,9 @@ def create_job_definition(data):
         """, (req["job_name"], req["department"], req["salary_class"]))
         
         new_id = cur.lastrowid
+    refresh_permission_index(force=True)
         
-    logger.verbose(f"Admin {data['id']} created job {req['job_name']}")
+    logger.verbose("Admin %s created job %s", data['id'], req['job_name'])
     return jsonify({"success": True, "id": new_id, "message": "Job created"}), 201
 
 @bp.route("/verify_user/<int:user_id>", methods=["POST"])
@@ -275,7 +322,8 @@ def verify_user(data, user_id):
         cur.execute("UPDATE users SET is_verified = 1 WHERE id = %s", (user_id,))
         if cur.rowcount == 0:
              return jsonify({"error": "User not found"}), 404
-    logger.verbose(f"Admin {admin_id} verified user {user_id}")
+    invalidate_user(user_id)
+    logger.verbose("Admin %s verified user %s", admin_id, user_id)
     return jsonify({"success": True, "message": "User verified"}), 200
 
 @bp.route("/is-admin", methods=["GET"])
@@ -1,6 +1,10 @@
 from flask import Blueprint, jsonify, request
 from core.coreAuthUtil import require_token
 from core.database import db_helper
+from core.idempotency import idempotent
+from core.accountDirectory import lookup as lookup_account
+from core.ledger import Leg, LedgerError, post_legs, run as ledger_run
+from core import expirySweeper  # also registers the background refund of expired codes
 from core.logger import logger
 from typing import Any, cast
 import os
@@ -29,63 +33,63 @@ def redeem_giftcard(data):
     code = req["code"]
     to_account = req["to_account"]
     
-    with db_helper.cursor() as cur:
-        cur.execute("SELECT * FROM gift_codes WHERE code = %s", (code,))
+    def post(cur):
+        cur.execute("SELECT * FROM gift_codes WHERE code = %s FOR UPDATE", (code,))
         row = cur.fetchone()
         if not row:
             return jsonify({"error": "Giftcard not found"}), 404
         giftcard = cast(dict[str, Any], row)
         amount = giftcard["amount"]
         is_active = int(giftcard["is_active"])
-        if is_active != 1:
-            return jsonify({"error": "Giftcard already used"}), 400
         source_acc = giftcard["created_by"]
         expires_at = giftcard["expires_at"] 
         if expires_at.tzinfo is None:
             expires_at = expires_at.replace(tzinfo=timezone.utc)
+        expired = Instant.now().py_datetime() > expires_at
+        if is_active != 1:
+            # Never redeemed but inactive: the expiry sweeper already refunded / retired it
+            if expired and giftcard["redeemed_by"] is None:
+                return jsonify({"error": "Giftcard expired"}), 403
+            return jsonify({"error": "Giftcard already used"}), 400
         
-        if Instant.now().py_datetime() > expires_at:
+        if expired:
+            if giftcard["source"] == "system":
+                # Issued by an admin, nothing was debited: nothing to give back
+                cur.execute("UPDATE gift_codes SET is_active = %s WHERE code = %s", (0, code,))
+                return jsonify({"error": "Giftcard expired"}), 403
+            if giftcard["parked_at"] is not None:
+                # Already found unrefundable, waits for a manual refund
+                return jsonify({"error": "Giftcard expired"}), 403
+            if (int(source_acc), str(code).lower()) not in expirySweeper.funded(cur, [giftcard]):
+                # Never paid for (e.g. an admin card from before `source`), refunding would create money
+                cur.execute("UPDATE gift_codes SET parked_at = UTC_TIMESTAMP() WHERE code = %s", (code,))
+                logger.error(f"Expired gift code {code} has no funding transaction, parked instead of refunded")
+                return jsonify({"error": "Giftcard expired"}), 403
+            # Give Money back to original account
             metadata = {
                 "code": code,
                 "provider": "LinePay"
             }
-            
-            cur.execute("""
-            INSERT INTO transactions (
-                transaction_type, 
-                to_account_id,
-                amount,
-                confirmed,
-                description,
-                metadata
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, ("refund", source_acc, amount, 1, str(f"Giftcard expired {code[-4:]}"), json.dumps(metadata)))
-            transaction_id = cur.lastrowid
-            
-            cur.execute("UPDATE gift_codes SET is_active = %s WHERE code = %s", (0, code,))
-            cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE id = %s",
-                (amount, source_acc,))
-            if cur.rowcount == 0:
+            try:
+                post_legs(cur, [
+                    Leg("refund", amount, to_account_id=int(source_acc), description=str(f"Giftcard expired {code[-4:]}"), metadata=metadata),
+                ], allow_frozen=True)
+            except (LedgerError, ValueError):
+                # Stays active so the value isn't lost, it has to be refunded by hand
                 logger.fatal(f"Refund failed, Amount: {amount}, Code: {code}")
+                return jsonify({"error": "Giftcard expired"}), 403
+            cur.execute("UPDATE gift_codes SET is_active = %s WHERE code = %s", (0, code,))
             return jsonify({"error": "Giftcard expired"}), 403
         
-        # Give Money back to original account?
-        
-        cur.execute("SELECT * FROM bank_accounts WHERE uuid = %s", (to_account,))
-        row = cur.fetchone()
-        if not row:
+        account = lookup_account(str(to_account), cur, kinds=("uuid",))
+        if not account:
             return jsonify({"error": "Account not found"}), 404
-        account = cast(dict[str, Any], row)
-        balance = account["balance"]
 
         holder = account["account_holder_id"]
         acc_id = account["id"]
-        validify2 = int(account["is_frozen"])
         validify1 = str(account["account_holder_type"])
         if validify1 != "user":
             return jsonify({"error": "Account not found"}), 404
-        if validify2 != 0:
-            return jsonify({"error": "Account not found"}), 404
         if int(holder) != int(user_id):
             return jsonify({"error": "Account not found"}), 404
 
@@ -97,47 +101,40 @@ def redeem_giftcard(data):
         "balance": Decimal(0.000),
         "provider": "LinePay"
         }
-            
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
-        try:
-            cur.execute("""
-                    UPDATE gift_codes SET
-                    redeemed_by = %s,
-                    redeemed_at = %s,
-                    is_active = %s
-                    WHERE code = %s AND is_active = 1
-                    """, (acc_id, redeemed_at, 0, code))
-            
-            if cur.rowcount == 0:
-                cur.close()
-                return jsonify({"error": "Giftcard already redeemed or invalid"}), 400
-            
-            cur.execute("""
-            INSERT INTO transactions (
-                transaction_type, 
-                to_account_id,
-                amount,
-                confirmed,
-                description,
-                metadata
-            ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, ("giftcard", acc_id, amount, 1, str(desc), json.dumps(metadata)))
-            transaction_id = cur.lastrowid
-            
-            cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE uuid = %s",
-                (amount, to_account))
-        finally:
-            cur.close()
-        return jsonify({
-            "transaction_id": transaction_id,
-            "amount": amount
-        }), 200
+
+        cur.execute("""
+                UPDATE gift_codes SET
+                redeemed_by = %s,
+                redeemed_at = %s,
+                is_active = %s
+                WHERE code = %s AND is_active = 1
+                """, (acc_id, redeemed_at, 0, code))
+        
+        if cur.rowcount == 0:
+            return jsonify({"error": "Giftcard already redeemed or invalid"}), 400
+
+        # Frozen / deleted target accounts are rejected by the ledger (rolls back the redemption)
+        transaction_id, = post_legs(cur, [
+            Leg("giftcard", amount, to_account_id=acc_id, description=str(desc), metadata=metadata),
+        ])
+        return {"transaction_id": transaction_id, "amount": amount}
+
+    try:
+        result = ledger_run(post)
+    except LedgerError:
+        return jsonify({"error": "Account not found"}), 404
+    if not isinstance(result, dict):
+        return result
+    return jsonify({
+        "transaction_id": result["transaction_id"],
+        "amount": result["amount"]
+    }), 200
                 
         
 
 @bp.route("/giftcards/create", methods=["POST"])
 @require_token
+@idempotent
 def create_giftcard(data):
     user_id = data["id"]  # internal int ID from JWT
     req = request.get_json()
@@ -150,26 +147,8 @@ def create_giftcard(data):
         amount = Decimal(str(req["amount"]))
     except:
         return jsonify({"error": "Invalid amount"}), 400
-    
-    with db_helper.cursor() as cur:
-        cur.execute("SELECT * FROM bank_accounts WHERE uuid = %s", (source_acc,))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({"error": "Account not found"}), 404
-        account = cast(dict[str, Any], row)
-        money = account["balance"]
-        holder = account["account_holder_id"]
-        acc_id = account["id"]
-        validify2 = int(account["is_frozen"])
-        validify1 = str(account["account_holder_type"])
-        if validify1 != "user":
-            return jsonify({"error": "Account not found"}), 404
-        if validify2 != 0:
-            return jsonify({"error": "Account not found"}), 404
-        if int(holder) != int(user_id):
-            return jsonify({"error": "Account not found"}), 404
-        if money < amount:
-            return jsonify({"error": "Insufficient funds"}), 402
+    if amount <= 0:
+        return jsonify({"error": "Invalid amount"}), 400
 
     code = gen_giftcode()
     expires_at = Instant.now() + hours(365 * 24)
@@ -180,37 +159,43 @@ def create_giftcard(data):
         "expires": expires_at.isoformat(),
         "provider": "LinePay"
     }
-    
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
-        try:
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_type, 
-                    from_account_id,
+
+    def post(cur):
+        account = lookup_account(str(source_acc), cur, kinds=("uuid",))
+        if not account:
+            return jsonify({"error": "Account not found"}), 404
+        holder = account["account_holder_id"]
+        acc_id = account["id"]
+        validify1 = str(account["account_holder_type"])
+        if validify1 != "user":
+            return jsonify({"error": "Account not found"}), 404
+        if int(holder) != int(user_id):
+            return jsonify({"error": "Account not found"}), 404
+
+        # Balance is checked against the locked row, so two concurrent cards can't overdraw
+        transaction_id, = post_legs(cur, [
+            Leg("giftcard", amount, from_account_id=acc_id, description=str(f"Code: {code}"), metadata=metadata),
+        ])
+        cur.execute("""
+                INSERT INTO gift_codes (
+                    code,
                     amount,
-                    confirmed,
-                    description,
-                    metadata
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-            """, ("giftcard", acc_id, amount, 1, str(f"Code: {code}"), json.dumps(metadata)))
-            transaction_id = cur.lastrowid
-            
-            cur.execute("""
-                    INSERT INTO gift_codes (
-                        code,
-                        amount,
-                        created_by,
-                        expires_at
-                    ) VALUES (%s, %s, %s, %s)
-                """, (code, amount, acc_id, expires_at))
-            cur.execute(
-                "UPDATE bank_accounts SET balance = balance - %s WHERE uuid = %s",
-                (amount, source_acc)
-            )               
-        finally:
-            cur.close() 
+                    created_by,
+                    expires_at,
+                    source
+                ) VALUES (%s, %s, %s, %s, 'account')
+            """, (code, amount, acc_id, expires_at))
+        return {"transaction_id": transaction_id}
+
+    try:
+        result = ledger_run(post)
+    except LedgerError as e:
+        if e.reason == "insufficient":
+            return jsonify({"error": "Insufficient funds"}), 402
+        return jsonify({"error": "Account not found"}), 404
+    if not isinstance(result, dict):
+        return result
     return jsonify({
-        "transaction_id": transaction_id,
+        "transaction_id": result["transaction_id"],
         "code": code
-    }), 201
\ No newline at end of file
+    }), 201
@@ -1,6 +1,9 @@
 from flask import Blueprint, jsonify, request
 from core.coreAuthUtil import require_token
 from core.database import db_helper
+from core.idempotency import idempotent
+from core.accountDirectory import lookup as lookup_account
+from core.ledger import Leg, LedgerError, post_legs, run as ledger_run
 from core.logger import logger
 from core.limiter import limiter
 from typing import Any, cast
@@ -79,6 +82,7 @@ def get_jobs(data):
 # This route is a contribution by Google
 @bp.route("/claim", methods=["POST"])
 @require_token
+@idempotent
 def claim_salary(data):
     user_id = data["id"]
     req = request.get_json()
@@ -88,106 +92,89 @@ def claim_salary(data):
         
     target_account_uuid = req["account_id"]
     
-    # Use a transaction to ensure atomicity
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
+    def post(cur):
+        # 1. Verify User & Get Last Claim
+        cur.execute("SELECT uuid, last_salary_claim FROM users WHERE id = %s FOR UPDATE", (user_id,))
+        user_row = cur.fetchone()
+        if not user_row:
+            return jsonify({"success": False, "message": "User not found"}), 404
+
+        user_row = cast(dict[str, Any], user_row)
+        user_uuid = user_row["uuid"]
+        last_claim = user_row["last_salary_claim"]
+
+        # 2. Check Cooldown
+        if last_claim:
+            cooldown_expires = last_claim + timedelta(hours=24)
+            if datetime.now() < cooldown_expires:
+                return jsonify({
+                    "success": False,
+                    "message": "Cooldown active",
+                    "cooldown": cooldown_expires.isoformat()
+                }), 403
+
+        # 3. Calculate Salary Amount
+        cur.execute("""
+            SELECT sc.daily_amount, j.job_name, sc.class_level
+            FROM user_jobs uj
+            JOIN jobs j ON uj.job_id = j.id
+            JOIN salary_classes sc ON j.salary_class = sc.class_level
+            WHERE uj.user_uuid = %s
+            ORDER BY sc.daily_amount DESC
+            LIMIT 1
+        """, (user_uuid,))
+
+        job_row = cur.fetchone()
+        if not job_row:
+             return jsonify({"success": False, "message": "Jobless"}), 400
+
+        job_row = cast(dict[str, Any], job_row)
+        salary_amount = job_row["daily_amount"]
+        job_name = job_row["job_name"]
+        class_level = job_row["class_level"]
+
+        if salary_amount <= 0:
+             return jsonify({"success": False, "message": "Salary amount is zero or negative"}), 400
+
+        # 4. Verify Target Account (frozen / deleted are checked by the ledger under lock)
+        account = lookup_account(str(target_account_uuid), cur, kinds=("uuid",))
+
+        if not account or account["account_holder_id"] != str(user_id):
+            return jsonify({"success": False, "message": "Account not found or not owned by user"}), 404
+
+        internal_account_id = account["id"]
+
+        # 5. Execute Updates
+        # Log Transaction + Update Balance
+        # TODO: Add withdrawal from Treasury account in the future
         try:
-            # 1. Verify User & Get Last Claim
-            cur.execute("SELECT uuid, last_salary_claim FROM users WHERE id = %s FOR UPDATE", (user_id,))
-            user_row = cur.fetchone()
-            if not user_row:
-                return jsonify({"success": False, "message": "User not found"}), 404
-            
-            user_row = cast(dict[str, Any], user_row)
-            user_uuid = user_row["uuid"]
-            last_claim = user_row["last_salary_claim"]
-            
-            # 2. Check Cooldown
-            if last_claim:
-                cooldown_expires = last_claim + timedelta(hours=24)
-                if datetime.now() < cooldown_expires:
-                    return jsonify({
-                        "success": False,
-                        "message": "Cooldown active",
-                        "cooldown": cooldown_expires.isoformat()
-                    }), 403
-
-            # 3. Calculate Salary Amount
-            cur.execute("""
-                SELECT sc.daily_amount, j.job_name, sc.class_level
-                FROM user_jobs uj
-                JOIN jobs j ON uj.job_id = j.id
-                JOIN salary_classes sc ON j.salary_class = sc.class_level
-                WHERE uj.user_uuid = %s
-                ORDER BY sc.daily_amount DESC
-                LIMIT 1
-            """, (user_uuid,))
-            
-            job_row = cur.fetchone()
-            if not job_row:
-                 return jsonify({"success": False, "message": "Jobless"}), 400
-                 
-            job_row = cast(dict[str, Any], job_row)
-            salary_amount = job_row["daily_amount"]
-            job_name = job_row["job_name"]
-            class_level = job_row["class_level"]
-            
-            if salary_amount <= 0:
-                 return jsonify({"success": False, "message": "Salary amount is zero or negative"}), 400
-
-            # 4. Verify Target Account
-            cur.execute("SELECT id, is_frozen, is_deleted FROM bank_accounts WHERE uuid = %s AND account_holder_id = %s", (target_account_uuid, user_id))
-            account_row = cur.fetchone()
-            
-            if not account_row:
-                return jsonify({"success": False, "message": "Account not found or not owned by user"}), 404
-            
-            account_row = cast(dict[str, Any], account_row)
-            if account_row["is_frozen"]:
+            transaction_id, = post_legs(cur, [
+                Leg("salary", salary_amount, to_account_id=internal_account_id, description="Salary Payment",
+                    metadata={"job_name": job_name, "class_level": class_level}),
+            ])
+        except LedgerError as e:
+            if e.reason == "frozen":
                 return jsonify({"success": False, "message": "Account is frozen"}), 403
-            
-            if account_row.get("is_deleted", 0):
-                return jsonify({"success": False, "message": "Account not found or not owned by user"}), 404
-                # check if account is deleted but not tell the user that its deleted to not expose potentially sensitive data
-            internal_account_id = account_row["id"]
-
-            # 5. Execute Updates
-            # Update User Last Claim
-            cur.execute("UPDATE users SET last_salary_claim = NOW() WHERE id = %s", (user_id,))
-            
-            import simplejson as json
-            metadata = json.dumps({
-                "job_name": job_name,
-                "class_level": class_level
-            })
-            
-            # Log Transaction
-            # TODO: Add withdrawal from Treasury account in the future
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_type, 
-                    to_account_id, 
-                    amount, 
-                    description,
-                    metadata,
-                    confirmed, 
-                    created_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, NOW())
-            """, ('salary', internal_account_id, salary_amount, 'Salary Payment', metadata, 1))
-            
-            transaction_id = cur.lastrowid
-            
-            # Update Balance
-            cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE id = %s", (salary_amount, internal_account_id))
-            
-            logger.verbose(f"User {user_id} claimed salary {salary_amount} to account {target_account_uuid}")
-            
-        except Exception as e:
-            logger.error(f"Salary claim failed for user {user_id}: {e}")
-            raise e # Reraise to trigger rollback
-            
+            # check if account is deleted but not tell the user that its deleted to not expose potentially sensitive data
+            return jsonify({"success": False, "message": "Account not found or not owned by user"}), 404
+
+        # Update User Last Claim
+        cur.execute("UPDATE users SET last_salary_claim = NOW() WHERE id = %s", (user_id,))
+
+        logger.verbose("User %s claimed salary %s to account %s", user_id, salary_amount, target_account_uuid)
+        return {"amount": salary_amount, "transaction_id": transaction_id}
+
+    # Use a transaction to ensure atomicity
+    try:
+        result = ledger_run(post)
+    except Exception as e:
+        logger.error(f"Salary claim failed for user {user_id}: {e}")
+        raise e
+    if not isinstance(result, dict):
+        return result
+
     return jsonify({
         "success": True, 
-        "amount": salary_amount,
-        "transaction_id": transaction_id
+        "amount": result["amount"],
+        "transaction_id": result["transaction_id"]
     }), 200
@@ -2,11 +2,15 @@ from posix import TMP_MAX
 from flask import Blueprint, redirect, request, jsonify
 from core.coreAuthUtil import hash_password, check_password, create_jwt, require_token, hash_pin, check_pin
 from core.database import db_helper
+from core.idempotency import idempotent
+from core.accountDirectory import lookup as lookup_account, lookup_many as lookup_accounts
+from core.holderDirectory import resolve as resolve_holders
+from core.ledger import Leg, LedgerError, post_legs, run as ledger_run, GOV_TAX_ACCOUNT
 from whenever import Instant, minutes
 from core.logger import logger
+from core import pinGuard, webhooks
 from typing import cast, Any, Callable
 import os
-import requests
 from urllib.parse import urlencode
 from decimal import Decimal, InvalidOperation
 import secrets
@@ -54,6 +58,9 @@ def issue_SP_token():
         if not row:
             return jsonify({"error": "Account not found"}), 404
         sender = cast(dict[str, Any], row)
+        # Attempt counters / locks live in Redis (core.pinGuard), the DB columns are an audit copy
+        if pinGuard.is_locked(sender["uuid"]):
+            return jsonify({"error": "Account is locked"}), 403
         if sender["pin_locked_until"] is not None:
             locked_until = Instant.from_timestamp(sender["pin_locked_until"].timestamp())
             if Instant.now() < locked_until:
@@ -61,22 +68,15 @@ def issue_SP_token():
         if not sender["pin_hash"]:
             return jsonify({"error": "PIN not set"}), 400
         if not check_pin(pin, sender["uuid"], sender["pin_hash"]):
-            attempts = sender["pin_failed_attempts"] + 1
-            if attempts >= 3:
-                cur.execute("UPDATE bank_accounts SET pin_locked_until = DATE_ADD(NOW(), INTERVAL 15 MINUTE) WHERE uuid = %s", (sender["uuid"],))
-            else: 
-                cur.execute("UPDATE bank_accounts SET pin_failed_attempts = %s WHERE uuid = %s", (attempts, sender["uuid"],))
+            pinGuard.record_failure(sender["uuid"])
             return jsonify({"error": "Invalid PIN"}), 401
-        cur.execute("UPDATE bank_accounts SET pin_failed_attempts = 0, pin_locked_until = NULL WHERE uuid = %s",
-        (sender["uuid"],))
+        pinGuard.record_success(sender["uuid"])
         if sender["balance"] < amount:
             return jsonify({"error": "Insufficient funds"}), 402
         sender_uuid = sender["uuid"]
-        cur.execute("SELECT * FROM bank_accounts WHERE uuid = %s", (req["recipient_uuid"],))
-        row = cur.fetchone()
-        if not row:
+        reciever = lookup_account(str(req["recipient_uuid"]), cur, kinds=("uuid",))
+        if not reciever:
             return jsonify({"error": "Account not found"}), 404
-        reciever = cast(dict[str, Any], row)
         if int(sender["is_frozen"]) != 0 or int(reciever["is_frozen"]) != 0:
             return jsonify({"error": "Account is frozen"}), 403
         if int(sender["is_deleted"]) != 0 or int(reciever["is_deleted"]) != 0:
@@ -149,11 +149,49 @@ def issue_SP_token():
             ua_data))
         except Exception as e:
             logger.fatal("Saving Token failed")
-            logger.debug(f"Traceback: {e}")
+            logger.debug("Traceback: %s", e)
             return jsonify({"error": "Internal Server Error"}), 500
     return jsonify({"token": token, "expires": expires_at.isoformat()}), 201
 
+def _webhook_payload(webhook_url: str, transaction_id: int, amount: Decimal, tax_amount: Decimal, description: str,
+                     donor_account_number: str, donor_holder: str,
+                     receiver_account_number: str, receiver_holder: str) -> dict[str, Any]:
+    timestamp_iso = Instant.now().py_datetime().isoformat()
+    is_discord = "discord.com/api/webhooks/" in webhook_url
+    if is_discord:
+        # Discord Rich Embed format
+        return {
+            "embeds": [{
+                "title": "Payment Completed",
+                "color": 65280, # Green
+                "timestamp": timestamp_iso,
+                "fields": [
+                    {"name": "Transaction ID", "value": str(transaction_id), "inline": True},
+                    {"name": "Amount", "value": f"{amount} $", "inline": True},
+                    {"name": "Tax Subtracted", "value": f"{tax_amount} $", "inline": True},
+                    {"name": "Sender", "value": f"{donor_holder} ({donor_account_number})", "inline": False},
+                    {"name": "Recipient", "value": f"{receiver_holder} ({receiver_account_number})", "inline": False},
+                    {"name": "Label", "value": description, "inline": False}
+                ],
+                "footer": {"text": "LinePay - Provided by Albion InterCap"}
+            }]
+        }
+    # Custom generic JSON format
+    return {
+        "status": "Payment Completed",
+        "transaction_id": transaction_id,
+        "amount": str(amount),
+        "tax_amount": str(tax_amount),
+        "description": description,
+        "sender_account_number": donor_account_number,
+        "sender_holder": donor_holder,
+        "recipient_account_number": receiver_account_number,
+        "recipient_holder": receiver_holder,
+        "timestamp": timestamp_iso
+    }
+
 @bp.route("/issue", methods=["POST"])
+@idempotent
 def issue_payment():
     """
     Executes a pre-authorized payment using a Single Pay Token.
@@ -166,200 +204,110 @@ def issue_payment():
         
     token_str = req["token"]
     
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
-        try:
-            # 1. Fetch token
-            cur.execute("SELECT * FROM tokens WHERE token = %s FOR UPDATE", (token_str,))
-            token_row = cur.fetchone()
-            if not token_row:
-                return jsonify({"error": "Token not found"}), 404
-            
-            token_data = cast(dict[str, Any], token_row)
-            
-            # 2. Check status and expiry
-            if token_data["status"] != "issued":
-                return jsonify({"error": "Token is not valid or already used"}), 400
-                
-            expires_at = Instant.from_timestamp(token_data["expires"].timestamp())
-            if Instant.now() > expires_at:
-                cur.execute("UPDATE tokens SET status = 'expired' WHERE token = %s", (token_str,))
-                return jsonify({"error": "Token has expired"}), 400
-                
-            amount = Decimal(str(token_data["amount"])).quantize(Decimal("0.001"))
-            if amount < Decimal("0.001"):
-                return jsonify({"error": "Payment amount cannot be lower than 0.001"}), 400
+    def post(cur):
+        # 1. Fetch token
+        cur.execute("SELECT * FROM tokens WHERE token = %s FOR UPDATE", (token_str,))
+        token_row = cur.fetchone()
+        if not token_row:
+            return jsonify({"error": "Token not found"}), 404
 
-            tax_category = str(token_data["tax"])
-            sender_uuid = str(token_data["sender_uuid"])
-            recipient_uuid = str(token_data["recipient_uuid"])
-            
-            # Tax calculation
-            if tax_category == "1":
-                tax = Decimal("0.300")
-                tax_amount = (amount * tax).quantize(Decimal("0.001"))
-                if tax_amount < Decimal("0.001"):
-                    tax_amount = Decimal("0.001")
-                final_amount = amount + tax_amount
-            else:
-                tax_amount = Decimal("0.000")
-                final_amount = amount
-                
-            # 3. Retrieve Donor
-            cur.execute("""
-                SELECT b.id, b.balance, b.is_frozen, b.account_number,
-                       CASE
-                           WHEN b.account_holder_type = 'user' THEN u.username
-                           WHEN b.account_holder_type = 'gov' THEN 'Gov Entity'
-                           WHEN b.account_holder_type = 'company' THEN 'Company'
-                           ELSE 'Unknown'
-                       END AS holder
-                FROM bank_accounts b
-                LEFT JOIN users u
-                    ON b.account_holder_type = 'user'
-                    AND u.id = CAST(b.account_holder_id AS UNSIGNED)
-                WHERE b.uuid = %s
-                  AND b.is_deleted = 0
-                LIMIT 1
-            """, (sender_uuid,))
-            donor_row = cur.fetchone()
-            if not donor_row:
-                return jsonify({"error": "Sender account not found"}), 404
-            
-            donor = cast(dict[str, Any], donor_row)
-            if donor["balance"] < final_amount:
+        token_data = cast(dict[str, Any], token_row)
+
+        # 2. Check status and expiry
+        if token_data["status"] != "issued":
+            return jsonify({"error": "Token is not valid or already used"}), 400
+
+        expires_at = Instant.from_timestamp(token_data["expires"].timestamp())
+        if Instant.now() > expires_at:
+            cur.execute("UPDATE tokens SET status = 'expired' WHERE token = %s", (token_str,))
+            return jsonify({"error": "Token has expired"}), 400
+
+        amount = Decimal(str(token_data["amount"])).quantize(Decimal("0.001"))
+        if amount < Decimal("0.001"):
+            return jsonify({"error": "Payment amount cannot be lower than 0.001"}), 400
+
+        tax_category = str(token_data["tax"])
+        sender_uuid = str(token_data["sender_uuid"])
+        recipient_uuid = str(token_data["recipient_uuid"])
+
+        # Tax calculation
+        if tax_category == "1":
+            tax = Decimal("0.300")
+            tax_amount = (amount * tax).quantize(Decimal("0.001"))
+            if tax_amount < Decimal("0.001"):
+                tax_amount = Decimal("0.001")
+        else:
+            tax_amount = Decimal("0.000")
+
+        # 3. Retrieve Donor and Recipient (frozen / balance are checked by the ledger under lock)
+        accounts = {ident: acc for ident, acc in lookup_accounts([sender_uuid, recipient_uuid], cur, kinds=("uuid",)).items() if not acc["is_deleted"]}
+        donor = accounts.get(sender_uuid)
+        if not donor:
+            return jsonify({"error": "Sender account not found"}), 404
+        receiver = accounts.get(recipient_uuid)
+        if not receiver:
+            return jsonify({"error": "Recipient account not found"}), 404
+
+        # 4. Primary Transaction (+ Tax Transaction if necessary), balances applied by the ledger
+        description = token_data.get("label") or "SP Token Payment"
+        legs = [Leg("payment", amount, from_account_id=donor["id"], to_account_id=receiver["id"],
+                    description=description, tax_category=tax_category)]
+        if tax_amount > 0:
+            tax = Decimal("0.300")
+            legs.append(Leg("tax", tax_amount, from_account_id=donor["id"], to_account_id=GOV_TAX_ACCOUNT,
+                            description="30% Tax - ID: {parent_id}", tax_category=tax_category, parent=0,
+                            metadata={"tax": str(tax), "tax_amount": str(tax_amount), "tax_category": tax_category}))
+        try:
+            ids = post_legs(cur, legs)
+        except LedgerError as e:
+            if e.reason == "insufficient":
                 return jsonify({"error": "Insufficient funds in sender account"}), 402
-            
-            donor_account_number = str(donor["account_number"])
-            donor_holder = str(donor["holder"])
-                
-            # 4. Retrieve Recipient
-            cur.execute("""
-                SELECT b.id, b.is_frozen, b.account_number,
-                       CASE
-                           WHEN b.account_holder_type = 'user' THEN u.username
-                           WHEN b.account_holder_type = 'gov' THEN 'Gov Entity'
-                           WHEN b.account_holder_type = 'company' THEN 'Company'
-                           ELSE 'Unknown'
-                       END AS holder
-                FROM bank_accounts b
-                LEFT JOIN users u
-                    ON b.account_holder_type = 'user'
-                    AND u.id = CAST(b.account_holder_id AS UNSIGNED)
-                WHERE b.uuid = %s
-                  AND b.is_deleted = 0
-                LIMIT 1
-            """, (recipient_uuid,))
-            receiver_row = cur.fetchone()
-            if not receiver_row:
-                return jsonify({"error": "Recipient account not found"}), 404
-                
-            receiver = cast(dict[str, Any], receiver_row)
-            receiver_account_number = str(receiver["account_number"])
-            receiver_holder = str(receiver["holder"])
-            
-            if donor["is_frozen"] or receiver["is_frozen"]:
+            if e.reason == "frozen":
                 return jsonify({"error": "Account involved is frozen"}), 403
-                
-            # 5. Insert Primary Transaction
-            description = token_data.get("label") or "SP Token Payment"
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_type, 
-                    from_account_id, 
-                    to_account_id, 
-                    amount,
-                    tax_category,
-                    description,
-                    confirmed
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, ("payment", donor["id"], receiver["id"], amount, tax_category, description, 1))
-            transaction_id = cur.lastrowid
-            
-            # 6. Apply Balances
-            cur.execute("UPDATE bank_accounts SET balance = balance - %s WHERE id = %s", (amount, donor["id"]))
-            cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE id = %s", (amount, receiver["id"]))
-            
-            # 7. Apply Tax Transaction (if necessary)
-            tax_id = ""
-            if tax_amount > 0:
-                tax = Decimal("0.300")
-                gov_tax_account = 26
-                tax_desc = f"30% Tax - ID: {transaction_id}"
-                metadata = json.dumps({
-                    "tax": str(tax), 
-                    "tax_amount": str(tax_amount), 
-                    "tax_category": tax_category, 
-                    "transaction_id": transaction_id
-                })
-                cur.execute("""
-                    INSERT INTO transactions (
-                        transaction_type, 
-                        from_account_id,
-                        to_account_id,
-                        amount,
-                        tax_category,
-                        description,
-                        metadata,
-                        confirmed
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, ("tax", donor["id"], gov_tax_account, tax_amount, tax_category, tax_desc, metadata, 1))
-                tax_id = cur.lastrowid
-                cur.execute("UPDATE bank_accounts SET balance = balance - %s WHERE id = %s", (tax_amount, donor["id"]))
-                cur.execute("UPDATE bank_accounts SET balance = balance + %s WHERE id = %s", (tax_amount, gov_tax_account))
-            # 8. Mark Token as Used
-            cur.execute("""
-                UPDATE tokens 
-                SET status = 'used', used_at = NOW() 
-                WHERE token = %s
-            """, (token_str,))
-            
-            webhook_url = token_data.get("webhook_url")
-            
-        finally:
-            cur.close()
-            
-    # Webhook Logic (outside the DB transaction block but after it commits)
-    if webhook_url:
-        try:
-            timestamp_iso = Instant.now().py_datetime().isoformat()
-            is_discord = "discord.com/api/webhooks/" in webhook_url
-            if is_discord:
-                # Discord Rich Embed format
-                payload = {
-                    "embeds": [{
-                        "title": "Payment Completed",
-                        "color": 65280, # Green
-                        "timestamp": timestamp_iso,
-                        "fields": [
-                            {"name": "Transaction ID", "value": str(transaction_id), "inline": True},
-                            {"name": "Amount", "value": f"{amount} $", "inline": True},
-                            {"name": "Tax Subtracted", "value": f"{tax_amount} $", "inline": True},
-                            {"name": "Sender", "value": f"{donor_holder} ({donor_account_number})", "inline": False},
-                            {"name": "Recipient", "value": f"{receiver_holder} ({receiver_account_number})", "inline": False},
-                            {"name": "Label", "value": description, "inline": False}
-                        ],
-                        "footer": {"text": "LinePay - Provided by Albion InterCap"}
-                    }]
-                }
-            else:
-                # Custom generic JSON format
-                payload = {
-                    "status": "Payment Completed",
-                    "transaction_id": transaction_id,
-                    "amount": str(amount),
-                    "tax_amount": str(tax_amount),
-                    "description": description,
-                    "sender_account_number": donor_account_number,
-                    "sender_holder": donor_holder,
-                    "recipient_account_number": receiver_account_number,
-                    "recipient_holder": receiver_holder,
-                    "timestamp": timestamp_iso
-                }
-            
-            requests.post(webhook_url, json=payload, timeout=5)
-        except Exception as e:
-            logger.error(f"Failed to trigger webhook for token {token_str}: {str(e)}")
+            raise
+
+        # 5. Mark Token as Used
+        cur.execute("""
+            UPDATE tokens 
+            SET status = 'used', used_at = NOW() 
+            WHERE token = %s
+        """, (token_str,))
+
+        # 6. Webhook goes into the outbox in this transaction, delivered in the background
+        webhook_url = token_data.get("webhook_url")
+        if webhook_url:
+            donor_ref = (donor["account_holder_type"], donor["account_holder_id"], donor["account_number"])
+            receiver_ref = (receiver["account_holder_type"], receiver["account_holder_id"], receiver["account_number"])
+            holders = resolve_holders([donor_ref, receiver_ref], cur)
+            webhooks.enqueue(cur, webhook_url, _webhook_payload(
+                webhook_url,
+                transaction_id=ids[0],
+                amount=amount,
+                tax_amount=tax_amount,
+                description=description,
+                donor_account_number=str(donor["account_number"]),
+                donor_holder=holders[donor_ref],
+                receiver_account_number=str(receiver["account_number"]),
+                receiver_holder=holders[receiver_ref],
+            ))
+
+        return {
+            "transaction_id": ids[0],
+            "tax_id": ids[1] if len(ids) > 1 else "",
+            "webhook": bool(webhook_url),
+        }
+
+    try:
+        result = ledger_run(post)
+    except LedgerError as e:
+        return jsonify({"error": e.message}), e.status
+    if not isinstance(result, dict):
+        return result
+
+    transaction_id = result["transaction_id"]
+    tax_id = result["tax_id"]
+    if result["webhook"]:
+        webhooks.kick()
 
     return jsonify({
         "success": True,
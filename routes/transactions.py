@@ -1,7 +1,12 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from core.coreAuthUtil import require_token, require_permission
 from core.cursorHelper import parse_cursor, create_cursor
 from core.database import db_helper
+from core.accountDirectory import lookup as lookup_account
+from core.hotAccounts import balance_of
+from core.holderDirectory import resolve as resolve_holders
+from core.balanceSnapshots import balance_at
+from core import statementCache
 from core.logger import logger
 from typing import Any, cast
 import os
@@ -11,22 +16,12 @@ import simplejson as json
 
 bp = Blueprint("transactions", __name__, url_prefix="/api/transactions")
 
-def get_account_ids(cur: Any, identifier: str) -> tuple[int, int, Decimal] | None:
-    """Helper to resolve an account and return (id, account_holder_id, balance)."""
-    if identifier.isdigit():
-        col = "id"
-    elif len(identifier) == 36 and "-" in identifier:
-        col = "uuid"
-    else:
-        col = "account_number"
-        
-    cur.execute(f"SELECT id, account_holder_id, balance FROM bank_accounts WHERE {col} = %s", (identifier,))
-    row = cur.fetchone()
-    if not row:
+def get_account_ids(cur: Any, identifier: str) -> tuple[int, int] | None:
+    """Helper to resolve an account (id, uuid or account number) to (id, account_holder_id)."""
+    account = lookup_account(identifier, cur)
+    if account is None:
         return None
-        
-    parse = cast(dict[str, Any], row)
-    return int(parse["id"]), int(parse["account_holder_id"]), Decimal(str(parse["balance"]))
+    return account["id"], int(account["account_holder_id"])
 
 @bp.route("/statement/<string:bankaccount_id>/<int:year>/<int:month>", methods=["GET"])
 @require_permission("bank.accounts.self.view.statement")
@@ -51,10 +46,17 @@ def get_statement(data: dict[str, Any], bankaccount_id: str, year: int, month: i
         if not ids:
             return {"error": "Account not found"}, 404
 
-        real_account_id, account_holder_id, current_balance = ids
+        real_account_id, account_holder_id = ids
         if account_holder_id != int(user_id):
             return {"error": "Account not found"}, 404
 
+        # --- Closed months never change: serve them from the statement cache ---
+        closed = statementCache.is_closed(end)
+        if closed:
+            cached = statementCache.get(real_account_id, year, month)
+            if cached is not None:
+                return _statement_response(json.loads(cached), cur)
+
         # --- Main query (index-friendly + single pass) ---
         sql = """
         SELECT 
@@ -70,23 +72,14 @@ def get_statement(data: dict[str, Any], bankaccount_id: str, year: int, month: i
             from_acc.account_number AS from_account_number,
             from_acc.account_holder_type AS from_holder_type,
             from_acc.account_holder_id AS from_holder_id,
-            from_user.username AS from_username,
 
             to_acc.account_number AS to_account_number,
             to_acc.account_holder_type AS to_holder_type,
-            to_acc.account_holder_id AS to_holder_id,
-            to_user.username AS to_username
+            to_acc.account_holder_id AS to_holder_id
 
         FROM transactions t
         LEFT JOIN bank_accounts from_acc ON t.from_account_id = from_acc.id
-        LEFT JOIN users from_user 
-            ON from_acc.account_holder_type = 'user' 
-           AND from_user.id = from_acc.account_holder_id
-
         LEFT JOIN bank_accounts to_acc ON t.to_account_id = to_acc.id
-        LEFT JOIN users to_user 
-            ON to_acc.account_holder_type = 'user' 
-           AND to_user.id = to_acc.account_holder_id
 
         WHERE 
             (t.from_account_id = %(acc_id)s OR t.to_account_id = %(acc_id)s)
@@ -96,60 +89,22 @@ def get_statement(data: dict[str, Any], bankaccount_id: str, year: int, month: i
         ORDER BY t.created_at DESC, t.id DESC;
         """
 
-        cur.execute(sql, {
-            "acc_id": real_account_id,
-            "start": start,
-            "end": end
-        })
+        # Rows and both balance reads in one (REPEATABLE READ) transaction, so they see the same
+        # snapshot; a closed month is cached for the TTL and a torn read would stick that long
+        with db_helper.transaction():
+            cur.execute(sql, {
+                "acc_id": real_account_id,
+                "start": start,
+                "end": end
+            })
 
-        rows = cast(list[dict[str, Any]], cur.fetchall())
+            rows = cast(list[dict[str, Any]], cur.fetchall())
 
-        # --- Reconstruct Historical Balances ---
-        # 1. Calculate the exact net flow that happened AFTER this month
-        cur.execute("""
-            SELECT SUM(amount) as future_in 
-            FROM transactions 
-            WHERE to_account_id = %(acc_id)s 
-              AND created_at >= %(end)s 
-              AND confirmed = 1
-        """, {"acc_id": real_account_id, "end": end})
-        row_future_in = cast(dict[str, Any], cur.fetchone() or {})
-        future_in = Decimal(str(row_future_in.get("future_in") or 0))
-
-        cur.execute("""
-            SELECT SUM(amount) as future_out 
-            FROM transactions 
-            WHERE from_account_id = %(acc_id)s 
-              AND created_at >= %(end)s 
-              AND confirmed = 1
-        """, {"acc_id": real_account_id, "end": end})
-        row_future_out = cast(dict[str, Any], cur.fetchone() or {})
-        future_out = Decimal(str(row_future_out.get("future_out") or 0))
-
-        # 2. Starting from the live balance, remove all future flow mathematically to get our ending boundary
-        ending_balance = current_balance - (future_in - future_out)
-
-    # --- Domain mapping (kept OUT of SQL) ---
-    GOV_ACCOUNT_NAMES = {
-        "G-10091a4": "Allgemeine Staatskasse",
-        "G-4003854": "Andere",
-        "G-3006707": "Strafgelder",
-        "G-200a869": "Steuern",
-    }
-
-    def resolve_owner(holder_type: str | None, account_number: str | None, username: str | None) -> str:
-        if holder_type == "user":
-            return username or "Unknown User"
-
-        if holder_type == "company":
-            return "Unknown Company"
-
-        if holder_type == "gov":
-            if account_number and account_number in GOV_ACCOUNT_NAMES:
-                return GOV_ACCOUNT_NAMES[account_number]
-            return "Regierung"
-
-        return "System/External"
+            # --- Reconstruct Historical Balances ---
+            # Anchor on the nearest month-boundary snapshot at or after the end of this month,
+            # so only the flow between the two is summed (not the whole later history)
+            current_balance = balance_of(cur, real_account_id) or Decimal("0")
+            ending_balance = balance_at(cur, real_account_id, end, current_balance)
 
     # --- Post-processing + aggregation ---
     total_in = Decimal("0")
@@ -172,37 +127,16 @@ def get_statement(data: dict[str, Any], bankaccount_id: str, year: int, month: i
             elif str(r.get("from_account_id")) == str(real_account_id):
                 total_out += amount
 
-        # enrich response
-        r["from_account_owner"] = resolve_owner(
-            r.get("from_holder_type"),
-            r.get("from_account_number"),
-            r.get("from_username"),
-        )
-
-        r["to_account_owner"] = resolve_owner(
-            r.get("to_holder_type"),
-            r.get("to_account_number"),
-            r.get("to_username"),
-        )
-
         # optional: normalize amount to float for JSON
         r["amount"] = float(amount)
 
-        # cleanup internal fields (keep response clean)
-        del r["from_holder_type"]
-        del r["from_holder_id"]
-        del r["from_username"]
-        del r["to_holder_type"]
-        del r["to_holder_id"]
-        del r["to_username"]
-
     # 3. Step back once more using the month's own flow to find its starting boundary!
     starting_balance = ending_balance - (total_in - total_out)
 
     now = datetime.now()
     is_incomplete = (year > now.year) or (year == now.year and month >= now.month)
 
-    return jsonify({
+    statement = {
         "statement_period": f"{year}-{month:02d}",
         "is_incomplete": is_incomplete,
         "summary": {
@@ -212,7 +146,40 @@ def get_statement(data: dict[str, Any], bankaccount_id: str, year: int, month: i
             "ending_balance": float(ending_balance)
         },
         "transactions": rows
-    }), 200
+    }
+    if not closed:
+        return _with_owners(statement), 200
+    # Cached without holder names, they are resolved on every view (users can be renamed)
+    body = jsonify(statement).get_data(as_text=True)
+    statementCache.put(real_account_id, year, month, body)
+    return _statement_response(json.loads(body))
+
+def _with_owners(statement: dict[str, Any], cur: Any = None) -> Response:
+    """Replaces the holder refs of every row with the holder's current name."""
+    rows = cast(list[dict[str, Any]], statement["transactions"])
+    # --- Holder names for both sides, one bulk lookup instead of per-row users joins ---
+    owners = resolve_holders(
+        [(r.get("from_holder_type"), r.get("from_holder_id"), r.get("from_account_number")) for r in rows]
+        + [(r.get("to_holder_type"), r.get("to_holder_id"), r.get("to_account_number")) for r in rows],
+        cur,
+    )
+    for r in rows:
+        r["from_account_owner"] = owners[(r.get("from_holder_type"), r.get("from_holder_id"), r.get("from_account_number"))]
+        r["to_account_owner"] = owners[(r.get("to_holder_type"), r.get("to_holder_id"), r.get("to_account_number"))]
+
+        # cleanup internal fields (keep response clean)
+        del r["from_holder_type"]
+        del r["from_holder_id"]
+        del r["to_holder_type"]
+        del r["to_holder_id"]
+    return jsonify(statement)
+
+def _statement_response(statement: dict[str, Any], cur: Any = None) -> Response:
+    """Closed-month statement with ETag, 304 if the client already has this version."""
+    response = _with_owners(statement, cur)
+    response.set_etag(statementCache.etag_for(response.get_data(as_text=True)))
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
 
 @bp.route("/recent/<string:bankaccount_id>", methods=["GET"])
 @require_token
@@ -225,7 +192,7 @@ def get_recent_transactions(data: dict[str, int | str | bool], bankaccount_id: s
         if not ids:
             return {"error":"Account not found"}, 404
         
-        real_account_id, account_holder_id, _ = ids
+        real_account_id, account_holder_id = ids
         if account_holder_id != int(user_id):
             return {"error":"Account not found"}, 404
         
@@ -258,7 +225,7 @@ def get_history(data: dict[str, int | str | bool], bankaccount_id: str):
         if not ids:
             return {"error":"Account not found"}, 404
         
-        real_account_id, account_holder_id, _ = ids
+        real_account_id, account_holder_id = ids
         if account_holder_id != int(user_id):
             return {"error":"Account not found"}, 404
         
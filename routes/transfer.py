@@ -1,18 +1,72 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
 from core.coreAuthUtil import require_token
+from core.cursorHelper import parse_cursor, create_cursor
 from core.database import db_helper
+from core.idempotency import idempotent
+from core.accountDirectory import lookup as lookup_account, lookup_many as lookup_accounts
+from core.ledger import Leg, LedgerError, lock_for_posting, post_legs, run as ledger_run, GOV_TAX_ACCOUNT
 from core.logger import logger
 from typing import Any, cast
 import os
+from datetime import datetime
 from decimal import Decimal
 import simplejson as json
 
 bp = Blueprint("bank", __name__, url_prefix="/api/bank")
 
 
+TX_COLUMNS = "uuid, transaction_type, from_account_id, to_account_id, amount, confirmed, created_at, description, metadata, tax_category"
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH = 500
+
+
+def _transactions_query(limit: int | None) -> str:
+    # Two index range scans (to / from) instead of one OR; self-transfers only come from the first one
+    limit_sql = f"LIMIT {int(limit)}" if limit is not None else ""
+    return f"""
+        (SELECT id, {TX_COLUMNS} FROM transactions
+         WHERE to_account_id = %(acc_id)s AND (created_at, id) < (%(ts)s, %(id)s)
+         ORDER BY created_at DESC, id DESC {limit_sql})
+        UNION ALL
+        (SELECT id, {TX_COLUMNS} FROM transactions
+         WHERE from_account_id = %(acc_id)s AND NOT (to_account_id <=> %(acc_id)s)
+           AND (created_at, id) < (%(ts)s, %(id)s)
+         ORDER BY created_at DESC, id DESC {limit_sql})
+        ORDER BY created_at DESC, id DESC
+        {limit_sql}
+    """
+
+
+def _stream_batches(params: dict[str, Any], limit: int | None):
+    """Yields rows in batches from an unbuffered cursor, so memory stays flat for any history size."""
+    db = db_helper.get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute(_transactions_query(limit), params)
+        while True:
+            batch = cast(list[dict[str, Any]], cur.fetchmany(STREAM_BATCH))
+            if not batch:
+                break
+            for row in batch:
+                del row["id"]
+            yield batch
+    finally:
+        # Client may have gone away mid-stream, drop what the server still sends
+        if db.unread_result:
+            db.consume_results()
+        cur.close()
+
+
 @bp.route("/view-transactions", methods=["POST"])
 @require_token
 def get_all_transactions(data):
+    """
+        Transactions of an account, newest first.
+        - with "cursor" / "limit": one keyset page plus "next_cursor"
+        - "stream": "ndjson" (or Accept: application/x-ndjson): one transaction per line
+        - otherwise the full history in the usual {"transactions": [...]} shape, sent as a chunked stream
+    """
     user_id = data["id"]  # internal int ID from JWT
     req = request.get_json()
 
@@ -20,24 +74,61 @@ def get_all_transactions(data):
         return jsonify({"error": "Missing required fields"}), 400
 
     account_id = req["acc_id"]
-    logger.verbose(f"Getting transaction data for {account_id}")
+    paged = "cursor" in req or "limit" in req
+    limit: int | None = None
+    if paged:
+        try:
+            limit = min(max(int(req.get("limit") or PAGE_SIZE), 1), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid limit"}), 400
+    stream = req.get("stream")
+    if stream is None and request.accept_mimetypes.best == "application/x-ndjson":
+        stream = "ndjson"
+
+    cursor_time, cursor_id = parse_cursor(req.get("cursor"))
+    if not cursor_time or not cursor_id:
+        cursor_time = datetime(9999, 12, 31, 23, 59, 59)
+        cursor_id = 999999999
+
+    logger.verbose("Getting transaction data for %s", account_id)
+    account = lookup_account(str(account_id), kinds=("id",))
+    if account is None or account["account_holder_id"] != str(user_id):
+        return jsonify({"error": "Account not found"}), 404
+
+    params = {"acc_id": account["id"], "ts": cursor_time, "id": cursor_id}
     with db_helper.cursor() as cur:
-        cur.execute("SELECT account_holder_id FROM bank_accounts WHERE id = %s", (account_id,))
-        row = cur.fetchone()
-        if not row:
-            return jsonify({"error": "Account not found"}), 404
-        parse = cast(dict[str, Any], row)
-        if int(parse["account_holder_id"]) != int(user_id):
-            return jsonify({"error": "Account not found"}), 404
-        cur.execute("SELECT uuid, transaction_type, from_account_id, to_account_id, amount, confirmed, created_at, description, metadata, tax_category FROM transactions WHERE to_account_id = %s OR from_account_id = %s", (account_id, account_id,))
-        rows = cur.fetchall()
-        return jsonify({"transactions": rows}), 200
+        if paged and not stream:
+            cur.execute(_transactions_query(limit), params)
+            rows = cast(list[dict[str, Any]], cur.fetchall())
+            next_cursor = None
+            if limit is not None and len(rows) == limit:
+                next_cursor = create_cursor(rows[-1]["created_at"], int(rows[-1]["id"]))
+            for r in rows:
+                del r["id"]
+            return jsonify({"transactions": rows, "next_cursor": next_cursor}), 200
+
+    dumps = current_app.json.dumps
+    if stream == "ndjson":
+        def generate():
+            for batch in _stream_batches(params, limit):
+                yield "".join(dumps(r) + "\n" for r in batch)
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    def generate_array():
+        yield '{"transactions": ['
+        first = True
+        for batch in _stream_batches(params, limit):
+            chunk = ",".join(dumps(r) for r in batch)
+            yield chunk if first else "," + chunk
+            first = False
+        yield "]}"
+    return Response(stream_with_context(generate_array()), mimetype="application/json")
 
 
 @bp.route("/view-transactions/<uuid:tx_uuid>", methods=["GET"])
 @require_token
 def get_transaction(data, tx_uuid):
-    logger.verbose(f"Getting transaction data for {data['id']}")
+    logger.verbose("Getting transaction data for %s", data['id'])
     with db_helper.cursor() as cur:
         cur.execute("SELECT uuid, transaction_type, from_account_id, to_account_id, amount, confirmed, created_at, description, metadata, tax_category FROM transactions WHERE uuid = %s", (tx_uuid,))
         row = cur.fetchone()
@@ -45,6 +136,7 @@ def get_transaction(data, tx_uuid):
 
 @bp.route("/transactions", methods=["POST"])
 @require_token
+@idempotent
 def transfer(data):
     """
         Transfer funds between two bank accounts owned by the authenticated user.
@@ -58,8 +150,8 @@ def transfer(data):
     if not req or not all(k in req for k in ("from_account", "to_account", "amount")):
         return jsonify({"error": "Missing required fields"}), 400
 
-    donor_uuid = req["from_account"]
-    receiver_uuid = req["to_account"]
+    donor_uuid = str(req["from_account"])
+    receiver_uuid = str(req["to_account"])
 
     # Validate and parse amount as Decimal
     try:
@@ -70,70 +162,30 @@ def transfer(data):
         return jsonify({"error": "Amount must be positive"}), 400
 
 
-    # Use transaction for atomicity
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
-        try:
-            # --- Validate donor account: must exist and be owned by user ---
-            cur.execute("""
-                SELECT id, balance, is_frozen
-                FROM bank_accounts 
-                WHERE uuid = %s 
-                  AND account_holder_type = 'user' 
-                  AND account_holder_id = %s 
-                  AND is_deleted = 0
-            """, (donor_uuid, str(user_id)))
-            donor_row = cur.fetchone()
-            if donor_row is None:
-                return jsonify({"error": "Donor account not found or not owned"}), 404
-
-            donor = cast(dict[str, Any], donor_row)
-            if donor["balance"] < amount:
-                return jsonify({"error": "Insufficient funds"}), 402
-
-            # --- Validate receiver account: must exist, be owned by SAME user ---
-            cur.execute("""
-                SELECT id, is_frozen
-                FROM bank_accounts 
-                WHERE uuid = %s 
-                  AND account_holder_type = 'user' 
-                  AND account_holder_id = %s 
-                  AND is_deleted = 0
-            """, (receiver_uuid, str(user_id)))
-            receiver_row = cur.fetchone()
-            if receiver_row is None:
-                return jsonify({"error": "Receiver account not found or not owned"}), 404
-
-            receiver = cast(dict[str, Any], receiver_row)
-            if receiver["is_frozen"] | donor["is_frozen"]:
-                return jsonify({"error": "Account is frozen"}), 403
-            # --- Record transaction (confirmed = 1 immediately) ---
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_type, 
-                    from_account_id, 
-                    to_account_id, 
-                    amount,
-                    confirmed
-                ) VALUES (%s, %s, %s, %s, %s)
-            """, ("transfer", donor["id"], receiver["id"], amount, 1))
-            transaction_id = cur.lastrowid
-
-            # --- Atomically update balances ---
-            cur.execute(
-                "UPDATE bank_accounts SET balance = balance - %s WHERE id = %s",
-                (amount, donor["id"])
-            )
-            cur.execute(
-                "UPDATE bank_accounts SET balance = balance + %s WHERE id = %s",
-                (amount, receiver["id"])
-            )
+    def post(cur) -> int:
+        # --- Resolve both accounts: must exist and be owned by the SAME user ---
+        owned = {
+            ident: acc["id"]
+            for ident, acc in lookup_accounts([donor_uuid, receiver_uuid], cur, kinds=("uuid",)).items()
+            if acc["account_holder_type"] == "user" and acc["account_holder_id"] == str(user_id) and not acc["is_deleted"]
+        }
+        if donor_uuid not in owned:
+            raise LedgerError("not_found", "Donor account not found or not owned", 404)
+        if receiver_uuid not in owned:
+            raise LedgerError("not_found", "Receiver account not found or not owned", 404)
+
+        # --- Lock, check funds/frozen, record transaction (confirmed = 1 immediately), update balances ---
+        transaction_id, = post_legs(cur, [
+            Leg("transfer", amount, from_account_id=owned[donor_uuid], to_account_id=owned[receiver_uuid]),
+        ])
+        return transaction_id
 
-            logger.verbose(f"Transfer of {amount} completed. TX ID: {transaction_id}")
-
-        finally:
-            cur.close()
+    try:
+        transaction_id = ledger_run(post)
+    except LedgerError as e:
+        return jsonify({"error": e.message}), e.status
 
+    logger.verbose("Transfer of %s completed. TX ID: %s", amount, transaction_id)
     return jsonify({
         "success": True,
         "message": "Transfer successful",
@@ -142,6 +194,7 @@ def transfer(data):
 
 @bp.route("/pay", methods=["POST"])
 @require_token
+@idempotent
 def make_payment(data):
     """
         Makes a payment to a bank account with their UUID using a bank account from a authenticated user.
@@ -154,8 +207,8 @@ def make_payment(data):
     if not req or not all(k in req for k in ("from_account", "to_account", "amount", "description", "tax_category")):
         return jsonify({"error": "Missing required fields"}), 400
 
-    donor_uuid = req["from_account"]
-    receiver_uuid = req["to_account"]
+    donor_uuid = str(req["from_account"])
+    receiver_uuid = str(req["to_account"])
     description = req["description"]
     tax_category = str(req["tax_category"])
 
@@ -171,104 +224,37 @@ def make_payment(data):
         case "1":
             tax = Decimal("0.300") # 30% Tax, hardcoded until Government System
             tax_amount = (amount * tax).quantize(Decimal("0.001"))
-            final_amount = amount + tax_amount
         case _:
             tax_amount = Decimal("0.000")
-            final_amount = amount
-        
-    # Use transaction for atomicity
-    with db_helper.transaction() as db:
-        cur = db.cursor(dictionary=True)
-        try:
-            # --- Validate donor account: must exist and be owned by user ---
-            cur.execute("""
-                SELECT id, balance, is_frozen
-                FROM bank_accounts 
-                WHERE uuid = %s 
-                  AND account_holder_type = 'user' 
-                  AND account_holder_id = %s 
-                  AND is_deleted = 0
-            """, (donor_uuid, str(user_id)))
-            donor_row = cur.fetchone()
-            if donor_row is None:
-                return jsonify({"error": "Donor account not found or not owned"}), 404
-
-            donor = cast(dict[str, Any], donor_row)
-            if donor["balance"] < final_amount:
-                return jsonify({"error": "Insufficient funds"}), 402
-
-            # --- Validate receiver account: must exist, be owned by SAME user ---
-            cur.execute("""
-                SELECT id, is_frozen
-                FROM bank_accounts 
-                WHERE uuid = %s
-                  AND is_deleted = 0
-            """, (receiver_uuid,))
-            receiver_row = cur.fetchone()
-            if receiver_row is None:
-                return jsonify({"error": "Receiver account not found"}), 404
-
-            receiver = cast(dict[str, Any], receiver_row)
-
-            
-            if donor["is_frozen"] or receiver["is_frozen"]:
-                return jsonify({"error": "Account is frozen"}), 403
-            # --- Record transaction (confirmed = 1 immediately) ---
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_type, 
-                    from_account_id, 
-                    to_account_id, 
-                    amount,
-                    tax_category,
-                    description,
-                    confirmed
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, ("payment", donor["id"], receiver["id"], amount, tax_category, description, 1))
-            transaction_id = cur.lastrowid
-
-            # --- Atomically update balances ---
-            cur.execute(
-                "UPDATE bank_accounts SET balance = balance - %s WHERE id = %s",
-                (amount, donor["id"])
-            )
-            cur.execute(
-                "UPDATE bank_accounts SET balance = balance + %s WHERE id = %s",
-                (amount, receiver["id"])
-            )
 
-            if tax_amount > 0:
-                tax = Decimal("0.300") # 30% Tax, hardcoded until Government System
-                description = str(f"30% Tax - ID: {transaction_id}")
-                gov_tax_account: int = 26
-                metadata = json.dumps({"tax": str(tax), "tax_amount": str(tax_amount), "tax_category": tax_category, "transaction_id": transaction_id})
-                cur.execute("""
-                    INSERT INTO transactions (
-                        transaction_type, 
-                        from_account_id,
-                        to_account_id,
-                        amount,
-                        tax_category,
-                        description,
-                        metadata,
-                        confirmed
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, ("tax", donor["id"], gov_tax_account, tax_amount, tax_category, description, metadata, 1))
-                tax_id = cur.lastrowid
-                cur.execute(
-                    "UPDATE bank_accounts SET balance = balance - %s WHERE id = %s",
-                    (tax_amount, donor["id"])
-                )
-                cur.execute(
-                    "UPDATE bank_accounts SET balance = balance + %s WHERE id = %s",
-                    (tax_amount, gov_tax_account)
-                )
-            else:
-                tax_id = ""
-            logger.verbose(f"Payment of {amount} completed. TX ID: {transaction_id}, Tax ID: {tax_id}")
-
-        finally:
-            cur.close()
+    def post(cur) -> tuple[int, int | str]:
+        # --- Resolve donor (must be owned by user) and receiver ---
+        rows = {ident: acc for ident, acc in lookup_accounts([donor_uuid, receiver_uuid], cur, kinds=("uuid",)).items() if not acc["is_deleted"]}
+        donor = rows.get(donor_uuid)
+        if donor is None or donor["account_holder_type"] != "user" or str(donor["account_holder_id"]) != str(user_id):
+            raise LedgerError("not_found", "Donor account not found or not owned", 404)
+        receiver = rows.get(receiver_uuid)
+        if receiver is None:
+            raise LedgerError("not_found", "Receiver account not found", 404)
+
+        legs = [Leg("payment", amount, from_account_id=donor["id"], to_account_id=receiver["id"],
+                    description=description, tax_category=tax_category)]
+        if tax_amount > 0:
+            tax = Decimal("0.300") # 30% Tax, hardcoded until Government System
+            legs.append(Leg("tax", tax_amount, from_account_id=donor["id"], to_account_id=GOV_TAX_ACCOUNT,
+                            description="30% Tax - ID: {parent_id}", tax_category=tax_category, parent=0,
+                            metadata={"tax": str(tax), "tax_amount": str(tax_amount), "tax_category": tax_category}))
+
+        # --- Lock, check funds/frozen, record transactions (confirmed = 1 immediately), update balances ---
+        ids = post_legs(cur, legs)
+        return ids[0], ids[1] if len(ids) > 1 else ""
+
+    try:
+        transaction_id, tax_id = ledger_run(post)
+    except LedgerError as e:
+        return jsonify({"error": e.message}), e.status
+
+    logger.verbose("Payment of %s completed. TX ID: %s, Tax ID: %s", amount, transaction_id, tax_id)
     # here would come a notification call to the reciever later
     return jsonify({
         "success": True,
@@ -277,4 +263,120 @@ def make_payment(data):
         "tax_id": tax_id
     }), 200
 
-     
\ No newline at end of file
+BATCH_PAYMENT_LIMIT = 250
+
+@bp.route("/pay/batch", methods=["POST"])
+@require_token
+@idempotent
+def make_batch_payment(data):
+    """
+        Pays many recipients from one account of the authenticated user in a single transaction.
+        Body: {"from_account": uuid, "payments": [{"to_account": uuid, "amount", "description"?, "tax_category"?}, ...]}
+        Invalid legs (bad amount, unknown / frozen recipient) are reported per leg and skipped,
+        all valid legs (+ their tax legs) are posted together against one locked balance read.
+    """
+    logger.verbose("Batch payment initialized...")
+
+    user_id = data["id"]  # internal int ID from JWT
+    req = request.get_json()
+
+    if not req or not all(k in req for k in ("from_account", "payments")):
+        return jsonify({"error": "Missing required fields"}), 400
+    payments = req["payments"]
+    if not isinstance(payments, list) or not payments:
+        return jsonify({"error": "Missing required fields"}), 400
+    if len(payments) > BATCH_PAYMENT_LIMIT:
+        return jsonify({"error": f"At most {BATCH_PAYMENT_LIMIT} payments per request"}), 400
+
+    donor_uuid = str(req["from_account"])
+    results: list[dict[str, Any]] = [{"index": i} for i in range(len(payments))]
+
+    # --- Validate the legs themselves (no DB needed) ---
+    parsed: dict[int, tuple[str, Decimal, Decimal, str | None, str]] = {}
+    for i, payment in enumerate(payments):
+        if not isinstance(payment, dict) or not all(k in payment for k in ("to_account", "amount")):
+            results[i].update(status="error", error="Missing required fields")
+            continue
+        try:
+            amount = Decimal(str(payment["amount"])).quantize(Decimal("0.001"))
+        except Exception:
+            results[i].update(status="error", error="Invalid amount")
+            continue
+        if amount <= 0:
+            results[i].update(status="error", error="Amount must be positive")
+            continue
+        tax_category = str(payment.get("tax_category", "0"))
+        match tax_category:
+            case "1":
+                tax_amount = (amount * Decimal("0.300")).quantize(Decimal("0.001")) # 30% Tax, hardcoded until Government System
+            case _:
+                tax_amount = Decimal("0.000")
+        parsed[i] = (str(payment["to_account"]), amount, tax_amount, payment.get("description"), tax_category)
+
+    def post(cur) -> dict[str, Any]:
+        # Results are rebuilt on every attempt (the ledger may retry this function)
+        attempt = {i: dict(r) for i, r in enumerate(results)}
+
+        # --- Resolve donor (must be owned by user) and all receivers in one go ---
+        accounts = lookup_accounts([donor_uuid] + [p[0] for p in parsed.values()], cur, kinds=("uuid",))
+        donor = accounts.get(donor_uuid)
+        if donor is None or donor["is_deleted"] or donor["account_holder_type"] != "user" or donor["account_holder_id"] != str(user_id):
+            raise LedgerError("not_found", "Donor account not found or not owned", 404)
+
+        receivers = {i: accounts.get(p[0]) for i, p in parsed.items()}
+        # --- One lock statement for the donor + every receiver, then per-leg checks against the locked rows ---
+        credited = [r["id"] for r in receivers.values() if r is not None]
+        if any(p[2] > 0 for p in parsed.values()):
+            credited.append(GOV_TAX_ACCOUNT)
+        locked = lock_for_posting(cur, [donor["id"]], credited)
+        donor_row = locked.get(donor["id"])
+        if donor_row is None or donor_row["is_deleted"]:
+            raise LedgerError("not_found", "Donor account not found or not owned", 404)
+        if donor_row["is_frozen"]:
+            raise LedgerError("frozen", "Account is frozen", 403)
+
+        legs: list[Leg] = []
+        leg_of: dict[int, tuple[int, int | None]] = {}
+        for i, (_, amount, tax_amount, description, tax_category) in parsed.items():
+            receiver = receivers[i]
+            row = locked.get(receiver["id"]) if receiver is not None else None
+            if row is None or row["is_deleted"]:
+                attempt[i].update(status="error", error="Receiver account not found")
+                continue
+            if row["is_frozen"]:
+                attempt[i].update(status="error", error="Receiver account is frozen")
+                continue
+            payment_index = len(legs)
+            legs.append(Leg("payment", amount, from_account_id=donor["id"], to_account_id=receiver["id"],
+                            description=description, tax_category=tax_category))
+            tax_index = None
+            if tax_amount > 0:
+                tax_index = len(legs)
+                legs.append(Leg("tax", tax_amount, from_account_id=donor["id"], to_account_id=GOV_TAX_ACCOUNT,
+                                description="30% Tax - ID: {parent_id}", tax_category=tax_category, parent=payment_index,
+                                metadata={"tax": "0.300", "tax_amount": str(tax_amount), "tax_category": tax_category}))
+            leg_of[i] = (payment_index, tax_index)
+
+        if not legs:
+            return {"results": [attempt[i] for i in sorted(attempt)], "posted": 0, "total": Decimal("0")}
+
+        # --- All valid legs + tax legs: funds checked once, multi-row INSERTs, one balance UPDATE ---
+        ids = post_legs(cur, legs, locked=locked)
+        total = Decimal("0")
+        for i, (payment_index, tax_index) in leg_of.items():
+            attempt[i].update(
+                status="ok",
+                transaction_id=ids[payment_index],
+                tax_id=ids[tax_index] if tax_index is not None else "",
+            )
+            total += legs[payment_index].amount + (legs[tax_index].amount if tax_index is not None else 0)
+        return {"results": [attempt[i] for i in sorted(attempt)], "posted": len(leg_of), "total": total}
+
+    try:
+        result = ledger_run(post)
+    except LedgerError as e:
+        return jsonify({"error": e.message, "results": results}), e.status
+
+    logger.verbose("Batch payment of %s legs completed, %s total", result["posted"], result["total"])
+    status = 200 if result["posted"] else 400
+    return jsonify({"success": result["posted"] > 0, **result}), status